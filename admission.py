@@ -0,0 +1,357 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# Состояние лимитов лежит в отдельном маленьком SQLite-файле: его видят все
+# gunicorn-воркеры на машине, а BEGIN IMMEDIATE делает проверку+запись атомарной.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    holder   TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    expires  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_slots_provider ON slots (provider);
+CREATE TABLE IF NOT EXISTS waiters (
+    holder   TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    enqueued REAL NOT NULL,
+    deadline REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_waiters_provider ON waiters (provider, enqueued);
+CREATE TABLE IF NOT EXISTS buckets (
+    user_id INTEGER PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+POLL_INTERVAL = 0.05
+
+
+class AdmissionError(Exception):
+    """Запрос к ИИ не пропущен; retry_after — через сколько секунд стоит повторить."""
+
+    status = 503
+
+    def __init__(self, message, retry_after=1.0, reason="queue_full"):
+        super().__init__(message)
+        self.retry_after = max(1, int(round(retry_after)))
+        self.reason = reason
+
+
+class Overloaded(AdmissionError):
+    """Провайдер занят, очередь полна или ждать дольше дедлайна."""
+
+    status = 503
+
+
+class RateLimited(AdmissionError):
+    """Пользователь исчерпал свой лимит запросов."""
+
+    status = 429
+
+
+class Lease:
+    """Занятый слот провайдера; release() можно звать сколько угодно раз."""
+
+    def __init__(self, limiter, holder):
+        self.limiter = limiter
+        self.holder = holder
+
+    def release(self):
+        if self.holder is not None:
+            self.limiter._release(self.holder)
+            self.holder = None
+
+    async def arelease(self):
+        await asyncio.to_thread(self.release)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionControl:
+    """
+    Ограничения на вызовы провайдера, общие для всех воркеров:
+    - не больше limits[provider] запросов одновременно (слоты с арендой на lease секунд,
+      чтобы упавший процесс не держал слот вечно);
+    - остальные ждут в очереди (FIFO) не дольше timeout; очередь ограничена queue_size,
+      сверх неё — сразу Overloaded;
+    - у каждого пользователя token bucket: rate запросов в минуту, burst подряд.
+    """
+
+    def __init__(self, path, limits=None, default_limit=8, queue_size=32, timeout=15.0,
+                 rate=20.0, burst=5, lease=300.0):
+        self.path = path
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.rate = rate            # запросов в минуту на пользователя (0 — без лимита)
+        self.burst = burst
+        self.lease = lease
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0, "rate_limited": 0}
+        self.wait_total = 0.0
+
+    @classmethod
+    def from_env(cls, path, providers=(), env=None):
+        """AI_MAX_INFLIGHT — общий лимит, <PREFIX>_MAX_INFLIGHT — свой для провайдера."""
+        env = os.environ if env is None else env
+        default_limit = int(env.get("AI_MAX_INFLIGHT", 8))
+        limits = {}
+        for provider in providers:
+            value = env.get(f"{provider.env_prefix}_MAX_INFLIGHT")
+            limits[provider.name] = int(value) if value else default_limit
+        return cls(
+            env.get("ADMISSION_DB") or path,
+            limits=limits,
+            default_limit=default_limit,
+            queue_size=int(env.get("AI_QUEUE_SIZE", 32)),
+            timeout=float(env.get("AI_QUEUE_TIMEOUT", 15)),
+            rate=float(env.get("AI_RATE_PER_MINUTE", 20)),
+            burst=int(env.get("AI_RATE_BURST", 5)),
+        )
+
+    # ---------- Соединение ----------
+    def _connect(self) -> sqlite3.Connection:
+        # своё соединение на поток и процесс (после fork старое использовать нельзя)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # таблицы создаём при первом соединении, а не при импорте app
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def limit_for(self, provider) -> int:
+        return self.limits.get(provider, self.default_limit)
+
+    # ---------- Пользовательский лимит ----------
+    def check_user(self, user_id, provider=""):
+        """Снимает один токен из корзины пользователя или бросает RateLimited."""
+        if not self.rate or user_id is None:
+            return
+        per_second = self.rate / 60.0
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE user_id = ?", (user_id,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (user_id, tokens, updated) VALUES (?, ?, ?)",
+                (user_id, tokens, now),
+            )
+        if not allowed:
+            with self._lock:
+                self.rejected["rate_limited"] += 1
+            metrics.ADMISSION_REJECTED.labels(provider, "rate_limited").inc()
+            raise RateLimited("Too many requests — please slow down a little.",
+                              (1 - tokens) / per_second, reason="rate_limited")
+
+    # ---------- Слоты провайдера ----------
+    def check_capacity(self, provider):
+        """Быстрая проверка перед постановкой фоновой задачи: очередь к провайдеру не переполнена."""
+        now = time.time()
+        conn = self._connect()
+        waiting = conn.execute(
+            "SELECT COUNT(*) FROM waiters WHERE provider = ? AND deadline > ?", (provider, now)
+        ).fetchone()[0]
+        if waiting >= self.queue_size:
+            with self._lock:
+                self.rejected["queue_full"] += 1
+            metrics.ADMISSION_REJECTED.labels(provider, "queue_full").inc()
+            raise Overloaded("Aika is very busy right now — please try again in a moment.", self.timeout)
+
+    def in_flight(self, provider) -> int:
+        """Сколько вызовов провайдера сейчас выполняется во всех воркерах."""
+        conn = self._connect()
+        return conn.execute(
+            "SELECT COUNT(*) FROM slots WHERE provider = ? AND expires >= ?", (provider, time.time())
+        ).fetchone()[0]
+
+    def _try_acquire(self, provider, holder, enqueued, deadline, bounded):
+        """
+        Одна попытка: True — слот наш, False — ждём дальше.
+        Слот получает ждущий, только если перед ним в очереди меньше ждущих, чем свободных слотов.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            conn.execute("DELETE FROM waiters WHERE deadline < ?", (now,))
+            in_flight = conn.execute("SELECT COUNT(*) FROM slots WHERE provider = ?", (provider,)).fetchone()[0]
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM waiters WHERE provider = ? AND enqueued < ? AND holder != ?",
+                (provider, enqueued, holder),
+            ).fetchone()[0]
+            if in_flight + ahead < self.limit_for(provider):
+                conn.execute("DELETE FROM waiters WHERE holder = ?", (holder,))
+                conn.execute(
+                    "INSERT INTO slots (holder, provider, expires) VALUES (?, ?, ?)",
+                    (holder, provider, now + self.lease),
+                )
+                return True
+            registered = conn.execute("SELECT 1 FROM waiters WHERE holder = ?", (holder,)).fetchone()
+            if not registered:
+                if bounded:
+                    waiting = conn.execute(
+                        "SELECT COUNT(*) FROM waiters WHERE provider = ?", (provider,)
+                    ).fetchone()[0]
+                    if waiting >= self.queue_size:
+                        raise Overloaded("Aika is very busy right now — please try again in a moment.",
+                                         self.timeout)
+                conn.execute(
+                    "INSERT INTO waiters (holder, provider, enqueued, deadline) VALUES (?, ?, ?, ?)",
+                    (holder, provider, enqueued, deadline),
+                )
+            else:
+                conn.execute("UPDATE waiters SET deadline = ? WHERE holder = ?", (deadline, holder))
+            return False
+
+    def _give_up(self, holder):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM waiters WHERE holder = ?", (holder,))
+
+    def _release(self, holder):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE holder = ?", (holder,))
+
+    async def _abandon(self, holder, attempt=None):
+        """Ждущий отменён: дожидаемся его попытки и убираем и место в очереди, и слот, если он успел его занять."""
+        if attempt is not None:
+            await asyncio.wait([attempt])
+        await asyncio.to_thread(self._give_up, holder)
+        await asyncio.to_thread(self._release, holder)
+
+    def _new_holder(self):
+        return f"{os.getpid()}:{uuid.uuid4().hex}"
+
+    def _count(self, provider, started, error=None):
+        waited = time.time() - started
+        with self._lock:
+            if error is None:
+                self.admitted += 1
+                self.wait_total += waited
+            else:
+                self.rejected[error.reason] += 1
+        if error is None:
+            metrics.ADMISSION_WAIT.labels(provider).observe(waited)
+        else:
+            metrics.ADMISSION_REJECTED.labels(provider, error.reason).inc()
+
+    def acquire(self, provider, timeout=None, bounded=True) -> Lease:
+        """
+        Ждёт свободный слот не дольше timeout (по умолчанию self.timeout).
+        bounded=False — для фоновых задач: они уже приняты и в лимит очереди не упираются.
+        """
+        holder = self._new_holder()
+        started = time.time()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        try:
+            while True:
+                # запас к дедлайну в таблице: запись ждущего не должна истечь раньше нас
+                if self._try_acquire(provider, holder, started, deadline + 5, bounded):
+                    self._count(provider, started)
+                    return Lease(self, holder)
+                if time.time() >= deadline:
+                    self._give_up(holder)
+                    raise Overloaded("Aika is busy — the queue wait timed out. Please try again.",
+                                     self.timeout, reason="timeout")
+                time.sleep(POLL_INTERVAL * random.uniform(0.5, 1.5))
+        except Overloaded as e:
+            self._count(provider, started, e)
+            raise
+
+    async def aacquire(self, provider, timeout=None, bounded=True) -> Lease:
+        """То же для asyncio: ждём в цикле событий, в SQLite ходим из пула потоков."""
+        holder = self._new_holder()
+        started = time.time()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        attempt = None
+        try:
+            while True:
+                # shield: отмена не прерывает попытку в потоке — иначе не узнать, занят ли слот
+                attempt = asyncio.ensure_future(
+                    asyncio.to_thread(self._try_acquire, provider, holder, started, deadline + 5, bounded)
+                )
+                if await asyncio.shield(attempt):
+                    self._count(provider, started)
+                    return Lease(self, holder)
+                if time.time() >= deadline:
+                    await asyncio.to_thread(self._give_up, holder)
+                    raise Overloaded("Aika is busy — the queue wait timed out. Please try again.",
+                                     self.timeout, reason="timeout")
+                await asyncio.sleep(POLL_INTERVAL * random.uniform(0.5, 1.5))
+        except Overloaded as e:
+            self._count(provider, started, e)
+            raise
+        except asyncio.CancelledError:
+            # отменили (клиент ушёл, hedge проиграл) — в том числе сразу после того, как слот заняли
+            await asyncio.shield(self._abandon(holder, attempt))
+            raise
+
+    @contextmanager
+    def slot(self, provider, timeout=None, bounded=True):
+        lease = self.acquire(provider, timeout, bounded)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    # ---------- Метрики ----------
+    def stats(self) -> dict:
+        now = time.time()
+        conn = self._connect()
+        in_flight = dict(conn.execute(
+            "SELECT provider, COUNT(*) FROM slots WHERE expires >= ? GROUP BY provider", (now,)
+        ).fetchall())
+        waiting = dict(conn.execute(
+            "SELECT provider, COUNT(*) FROM waiters WHERE deadline >= ? GROUP BY provider", (now,)
+        ).fetchall())
+        with self._lock:
+            return {
+                "providers": {
+                    name: {
+                        "in_flight": in_flight.get(name, 0),
+                        "waiting": waiting.get(name, 0),
+                        "limit": self.limit_for(name),
+                    }
+                    for name in sorted(set(in_flight) | set(waiting) | set(self.limits))
+                },
+                "default_limit": self.default_limit,
+                "queue_size": self.queue_size,
+                "timeout": self.timeout,
+                "rate_per_minute": self.rate,
+                "burst": self.burst,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "avg_wait": round(self.wait_total / self.admitted, 3) if self.admitted else 0.0,
+            }
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from models import db, Advice
+
+# Поля профиля, которые попадают в промпт dashboard()
+PROFILE_FIELDS = (
+    "age", "gender", "height", "weight",
+    "health_conditions", "allergies", "medications",
+    "sleep_hours", "activity_level", "diet_type",
+    "smoking", "alcohol",
+)
+
+
+def profile_fingerprint(user) -> str:
+    """sha256 от полей профиля — меняется только если меняется промпт."""
+    data = {field: getattr(user, field) for field in PROFILE_FIELDS}
+    raw = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AdviceCache:
+    """
+    Двухуровневый кэш совета для dashboard:
+    1) LRU в памяти воркера (ограничен maxsize, живёт ttl секунд)
+    2) таблица Advice в БД — переживает рестарт и общая для всех gunicorn-воркеров
+    """
+
+    def __init__(self, maxsize=1024, ttl=6 * 3600, cacheable=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cacheable = cacheable or (lambda text: bool(text))
+        self._items = OrderedDict()  # user_id -> (fingerprint, text, created_ts)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, user, factory) -> str:
+        fingerprint, text = self.lookup(user)
+        if text is None:
+            text = factory()
+            self.store(user.id, fingerprint, text)
+        return text
+
+    def lookup(self, user):
+        """(fingerprint, совет или None при промахе). Отдельно от store() — для async-режима."""
+        fingerprint = profile_fingerprint(user)
+
+        # ---- 1. память ----
+        with self._lock:
+            entry = self._items.get(user.id)
+            if entry and entry[0] == fingerprint and not self._expired(entry[2]):
+                self._items.move_to_end(user.id)
+                self.hits += 1
+                metrics.ADVICE_CACHE_LOOKUPS.labels("hit").inc()
+                return fingerprint, entry[1]
+
+        # ---- 2. БД ----
+        row = db.session.get(Advice, user.id)
+        if row and row.fingerprint == fingerprint and row.created_at:
+            age = (datetime.utcnow() - row.created_at).total_seconds()
+            created_ts = time.time() - age
+            if not self._expired(created_ts):
+                self._remember(user.id, fingerprint, row.text, created_ts)
+                with self._lock:
+                    self.hits += 1
+                metrics.ADVICE_CACHE_LOOKUPS.labels("hit").inc()
+                return fingerprint, row.text
+
+        # ---- 3. промах — совет сгенерирует ИИ ----
+        with self._lock:
+            self.misses += 1
+        metrics.ADVICE_CACHE_LOOKUPS.labels("miss").inc()
+        return fingerprint, None
+
+    def store(self, user_id, fingerprint, text):
+        if not self.cacheable(text):
+            return
+
+        row = db.session.get(Advice, user_id)
+        if row is None:
+            row = Advice(user_id=user_id)
+            db.session.add(row)
+        row.fingerprint = fingerprint
+        row.text = text
+        row.created_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # другой воркер успел записать совет раньше — не страшно
+            db.session.rollback()
+        self._remember(user_id, fingerprint, text, time.time())
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+        Advice.query.filter_by(user_id=user_id).delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+    def _expired(self, created_ts) -> bool:
+        return time.time() - created_ts >= self.ttl
+
+    def _remember(self, user_id, fingerprint, text, created_ts):
+        with self._lock:
+            self._items[user_id] = (fingerprint, text, created_ts)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
@@ -1,26 +1,18 @@
 import os
 import json
+import asyncio
+import contextlib
+import itertools
 import random
-import requests
+import threading
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for
-from werkzeug.utils import secure_filename
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, jsonify, stream_with_context,
+    make_response, has_request_context
+)
 from dotenv import load_dotenv
 load_dotenv()
-AI_PROVIDER   = os.getenv("AI_PROVIDER", "openai")               # openai | huggingface | ollama
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-HF_API_KEY     = os.getenv("HF_API_KEY")
-HF_MODEL       = os.getenv("HF_MODEL", "HuggingFaceTB/SmolLM3-3B")
-OLLAMA_MODEL   = os.getenv("OLLAMA_MODEL", "mistral")
-
-SECRET_KEY     = os.getenv("SECRET_KEY", "change-me-in-.env")   # для Flask-Login
-
-# ⚙️ Подключаем нужного клиента по провайдеру
-if AI_PROVIDER == "openai" and OPENAI_API_KEY:
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    client = None
 
 from flask_login import (
     LoginManager, login_user, logout_user, login_required, current_user
@@ -28,18 +20,39 @@ from flask_login import (
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # ВАЖНО: из models импортируем User (должен быть описан в models.py)
-from models import db, User, Symptom, Photo, Tip
+from models import (
+    db, User, Symptom, Photo, Tip, Job,
+    STATUS_PENDING, STATUS_DONE, STATUS_ERROR
+)
+import database
+import migrations
+import search
+import export
+import cleanup
+from advice_cache import AdviceCache
+from providers import load_providers, ProviderError, FALLBACK_REPLIES
+from failover import Answer, Failover
+from jobs import JobQueue
+from admission import AdmissionControl, AdmissionError, Overloaded
+import metrics
+from singleflight import SingleFlight, normalize_prompt
+from symptom_cache import SymptomAnswerCache
+from conversation import ConversationMemory
+from tip_pool import TipPool, CATEGORIES as TIP_CATEGORIES, tip_prompt
+from imaging import (
+    save_upload, make_variants, prepare_for_model, get_pool, warm_pool, extension,
+    UnsupportedImage, BROWSER_EXTENSIONS
+)
+from pagination import decode_cursor, latest_page, merged_feed
 
 # ------------------ ENV ------------------
-
-AI_PROVIDER   = os.getenv("AI_PROVIDER", "openai")               # openai | huggingface | ollama
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-HF_API_KEY     = os.getenv("HF_API_KEY")
-HF_MODEL       = os.getenv("HF_MODEL", "HuggingFaceTB/SmolLM3-3B")
-OLLAMA_MODEL   = os.getenv("OLLAMA_MODEL", "mistral")
-
 SECRET_KEY     = os.getenv("SECRET_KEY", "change-me-in-.env")   # для Flask-Login
 
+# ИИ-провайдеры выбираются один раз при старте: AI_PROVIDER = openai | huggingface | ollama
+# или цепочка AI_PROVIDERS=ollama,huggingface,openai — первый основной, остальные запасные
+providers = load_providers()
+ai = providers[0]
+
 # ------------------ Flask app ------------------
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
@@ -55,17 +68,44 @@ UPLOAD_DIR    = os.path.join(BASE_DIR, "static", "uploads")
 os.makedirs(INSTANCE_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# База данных
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{}".format(
-    os.path.join(os.path.abspath(os.path.dirname(__file__)), "instance", "health.db")
-)
-
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
-
-db.init_app(app)
-with app.app_context():
-    db.create_all()
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", 25)) * 1024 * 1024
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))  # процессы для HEIC-конвертации и превью
+
+# База данных: DATABASE_URL или instance/health.db (SQLite в WAL, пул соединений)
+database.init_app(app, db, os.path.join(os.path.abspath(INSTANCE_DIR), "health.db"))
+metrics.init_app(app)  # /metrics + латентность запросов и SQL
+migrations.init_app(app)  # flask db upgrade / status
+search.init_app(app)      # flask search rebuild / optimize
+export.init_app(app, UPLOAD_DIR)  # flask export <user>
+cleanup.init_app(app, UPLOAD_DIR)  # flask cleanup uploads / vacuum
+# Схема — отдельным шагом перед стартом: flask --app app db upgrade (в Procfile — release).
+# DB_AUTO_MIGRATE=1 — применять при импорте, как раньше (разработка, тесты)
+if os.getenv("DB_AUTO_MIGRATE") == "1":
+    with app.app_context():
+        migrations.upgrade()
+
+# Размеры страниц для чата и истории
+CHAT_PAGE_SIZE    = int(os.getenv("CHAT_PAGE_SIZE", 50))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 20))
+SEARCH_PAGE_SIZE  = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+
+# Фоновая очередь ИИ-задач: AI_WORKERS — сколько генераций одновременно на процесс
+jobs = JobQueue(app, max_workers=int(os.getenv("AI_WORKERS", 4)))
+
+# Допуск к провайдеру, общий для всех воркеров: AI_MAX_INFLIGHT одновременных вызовов,
+# очередь AI_QUEUE_SIZE с ожиданием до AI_QUEUE_TIMEOUT, AI_RATE_PER_MINUTE на пользователя
+admission = AdmissionControl.from_env(os.path.join(INSTANCE_DIR, "admission.db"), providers=providers)
+# фоновые задачи уже приняты — ждут слот дольше и в лимит очереди не упираются
+JOB_QUEUE_TIMEOUT = float(os.getenv("AI_JOB_QUEUE_TIMEOUT", 300))
+
+# Кэш совета на dashboard (память воркера + таблица Advice)
+advice_cache = AdviceCache(
+    maxsize=int(os.getenv("ADVICE_CACHE_SIZE", 1024)),
+    ttl=int(os.getenv("ADVICE_CACHE_TTL", 6 * 3600)),
+    cacheable=lambda text: is_real_reply(text),
+)
 
 # ------------------ Login Manager ------------------
 login_manager = LoginManager()
@@ -77,101 +117,664 @@ def load_user(user_id: str):
     return User.query.get(int(user_id))
 
 # ------------------ AI Core ------------------
+def is_real_reply(text: str) -> bool:
+    """Ответ пришёл от модели, а не заглушка / сообщение об ошибке."""
+    return bool(text) and text not in FALLBACK_REPLIES and not text.startswith("⚠️")
+
+
+# Одинаковые промпты «в полёте» склеиваются в один вызов провайдера;
+# AI_RESULT_CACHE_TTL > 0 дополнительно держит готовый ответ несколько секунд
+inflight = SingleFlight(
+    ttl=float(os.getenv("AI_RESULT_CACHE_TTL", 0)),
+    cacheable=lambda answer: answer.provider != "canned",
+)
+
+
 def ask_aika(prompt: str) -> str:
     """
-    Универсальный вызов ИИ: OpenAI / HuggingFace / Ollama
+    Универсальный вызов ИИ через цепочку провайдеров (providers.py, failover.py).
     Всегда отвечаем ТОЛЬКО на английском.
     """
+    return ask_aika_reply(prompt).text
+
+
+def ask_aika_reply(prompt: str) -> Answer:
+    """То же, что ask_aika, но вместе с именем провайдера, который ответил."""
+    key = (ai.name, ai.model, normalize_prompt(prompt))
+    return inflight.do(key, lambda: _ask_chain(prompt, has_request_context()))
+
+
+def provider_slot(provider, interactive=True, deadline=None):
+    """
+    Слот провайдера: в запросе ждём недолго (иначе 503), фоновая задача — до AI_JOB_QUEUE_TIMEOUT
+    или до deadline (time.monotonic()) — общего для всей цепочки, чтобы hedge не ждал дольше.
+    """
+    if interactive:
+        return admission.slot(provider.name)
+    timeout = JOB_QUEUE_TIMEOUT if deadline is None else max(deadline - time.monotonic(), 0)
+    return admission.slot(provider.name, timeout=timeout, bounded=False)
+
+
+def admit(user_id):
+    """Перед запросом к ИИ: очередь к провайдеру не переполнена и лимит пользователя не исчерпан."""
+    admission.check_capacity(ai.name)
+    admission.check_user(user_id, ai.name)
+
+
+# Цепочка провайдеров: основной не ответил за свой p95 — тот же промпт уходит следующему
+# (hedge), упал — следующему сразу; в AI_LATENCY_BUDGET (в запросе) или AI_JOB_LATENCY_BUDGET
+# (фоновая задача) не уложились — заглушка. Падающих провайдеров пропускает circuit breaker
+failover = Failover.from_env(providers)
+VISION_PROVIDERS = [p for p in providers if p.supports_vision]
+
+
+def _canned(errors) -> Answer:
+    """Никто из цепочки не ответил: сообщение об ошибке провайдера или заглушка."""
+    message = next((str(e) for e in reversed(errors) if isinstance(e, ProviderError)), None)
+    return Answer(message or random.choice(FALLBACK_REPLIES), "canned")
+
+
+def _ask_chain(prompt: str, interactive: bool, kind="generate", image=None, chain=None) -> Answer:
+    # interactive считаем здесь: попытки идут в потоках failover, где нет контекста запроса
+    errors = []
+    # фоновая задача: бюджет на ответ — с момента, когда слот получен (admitted), а не с постановки в очередь
+    admitted = None if interactive else threading.Event()
+    queue_deadline = time.monotonic() + JOB_QUEUE_TIMEOUT
+    finished = threading.Event()
+
+    def attempt(provider):
+        try:
+            with provider_slot(provider, interactive, queue_deadline):
+                if finished.is_set():
+                    # цепочка уже ответила / сдалась, пока ждали слот — провайдера зря не зовём
+                    raise Overloaded("chain already finished", reason="abandoned")
+                if admitted is not None:
+                    admitted.set()
+                with metrics.track_ai(provider.name, provider.model, kind):
+                    if image is None:
+                        answer = provider.generate(prompt)
+                    else:
+                        answer = provider.analyze_image(prompt, image)
+        except AdmissionError:
+            raise
+        except Exception as e:
+            print(f"AI ERROR ({provider.name}):", repr(e))
+            errors.append(e)
+            raise
+        metrics.observe_answer(provider.name, provider.model, kind, answer)
+        if not is_real_reply(answer):
+            # заглушка / ⚠️-сообщение — для цепочки это отказ, пробуем следующего
+            errors.append(ProviderError(answer))
+            raise errors[-1]
+        return answer
+
+    budget = failover.budget if interactive else failover.job_budget
     try:
-        # ---- OpenAI ----
-        if AI_PROVIDER == "openai" and OPENAI_API_KEY:
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are Aika — a friendly health assistant. "
-                            "Always reply ONLY in English, never in any other language. "
-                            "Be concise and kind. End every response with: 'This is not a diagnosis.'"
-                        )
-                    },
-                    {"role": "user", "content": prompt}
-                ]
+        # AdmissionError — страница «Aika is busy»; у фоновой задачи ещё OutOfBudget — задача в error
+        answer = failover.call(attempt, chain, budget, admitted, JOB_QUEUE_TIMEOUT)
+    finally:
+        finished.set()
+    return failover.served_by(answer or _canned(errors), kind)
+
+
+def ask_aika_image(prompt: str, image: bytes) -> Answer:
+    """Анализ фото vision-моделями цепочки (VISION_PROVIDERS)."""
+    return _ask_chain(prompt, has_request_context(), "vision", image, VISION_PROVIDERS)
+
+
+def stream_start():
+    """
+    Слот для стрима берём до заголовков ответа — при перегрузке успеваем отдать честный 503.
+    Берём у первого провайдера цепочки, которого пропускает breaker и у которого есть место.
+    Возвращает (остальные провайдеры цепочки, провайдер, его слот); провайдер None — breaker'ы всех открыты.
+    """
+    attempts = failover.allowed()
+    rejected = None
+    for provider in attempts:
+        try:
+            return attempts, provider, admission.acquire(provider.name)
+        except AdmissionError as e:
+            failover.record(provider, error=e)
+            rejected = rejected or e
+    if rejected is not None:
+        raise rejected
+    return attempts, None, None
+
+
+async def astream_start():
+    """stream_start() для async-режима."""
+    attempts = failover.allowed()
+    rejected = None
+    for provider in attempts:
+        try:
+            return attempts, provider, await admission.aacquire(provider.name)
+        except AdmissionError as e:
+            failover.record(provider, error=e)
+            rejected = rejected or e
+    if rejected is not None:
+        raise rejected
+    return attempts, None, None
+
+
+def _check_first_chunk(chunk):
+    # заглушка / ⚠️-сообщение первым куском: провайдер не ответил, а клиенту ещё ничего не ушло
+    if not is_real_reply(chunk):
+        raise ProviderError(chunk)
+
+
+def _finish_stream(provider, text, started, served):
+    """Итог стрима — как в _ask_chain: не ответ модели (заглушка по кускам) — отказ провайдера и canned."""
+    if is_real_reply(text):
+        failover.record(provider, time.monotonic() - started)
+    else:
+        failover.record(provider, error=ProviderError(text))
+        served["provider"] = "canned"
+
+
+def ask_aika_stream(prompt: str, served=None, attempts=None, first=None, lease=None):
+    """
+    То же, что ask_aika, но отдаёт ответ кусками по мере генерации.
+    OpenAI и Ollama стримят токены, остальные провайдеры — одним куском.
+    first / lease — провайдер и слот, взятые маршрутом до начала ответа (stream_start()),
+    attempts — остальная цепочка: слот каждого берём здесь и только на время его попытки.
+    Провайдер упал до первого куска — следующий по цепочке (без hedge: два стрима
+    параллельно не склеить); кто ответил — в served["provider"].
+    """
+    served = {} if served is None else served
+    attempts = failover.allowed() if attempts is None else attempts
+    errors = []
+    for provider in itertools.chain([first] if first else [], attempts):
+        sent = False
+        parts = []
+        started = time.monotonic()
+        try:
+            with lease if provider is first else admission.slot(provider.name), contextlib.closing(
+                metrics.track_stream(provider.stream(prompt), provider.name, provider.model)
+            ) as chunks:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if not sent:
+                        _check_first_chunk(chunk)
+                        sent = True
+                        served["provider"] = provider.name
+                    parts.append(chunk)
+                    yield chunk
+        except Exception as e:
+            print(f"AI STREAM ERROR ({provider.name}):", repr(e))
+            failover.record(provider, error=e)
+            # если часть ответа уже ушла — не подмешиваем заглушку в середину
+            if sent:
+                yield " ⚠️ (response interrupted)"
+                break
+            errors.append(e)
+            continue
+        if not sent:
+            failover.record(provider, error=ProviderError("empty stream"))
+            continue
+        _finish_stream(provider, "".join(parts), started, served)
+        break
+    if "provider" not in served:
+        served["provider"] = "canned"
+        yield _canned(errors).text
+    failover.served_by(Answer(None, served["provider"]), "stream")
+
+
+# ---- async-режим (asgi.py, uvicorn): ожидание ответа не держит поток ----
+async def ask_aika_async(prompt: str) -> str:
+    key = (ai.name, ai.model, normalize_prompt(prompt))
+    return (await inflight.ado(key, lambda: _ask_chain_async(prompt))).text
+
+
+async def _ask_chain_async(prompt: str) -> Answer:
+    errors = []
+
+    async def attempt(provider):
+        try:
+            lease = await admission.aacquire(provider.name)
+            try:
+                with metrics.track_ai(provider.name, provider.model, "generate"):
+                    answer = await provider.agenerate(prompt)
+            finally:
+                await lease.arelease()
+        except (AdmissionError, asyncio.CancelledError):
+            raise  # CancelledError — ответил другой провайдер
+        except Exception as e:
+            print(f"AI ERROR ({provider.name}):", repr(e))
+            errors.append(e)
+            raise
+        metrics.observe_answer(provider.name, provider.model, "generate", answer)
+        if not is_real_reply(answer):
+            errors.append(ProviderError(answer))
+            raise errors[-1]
+        return answer
+
+    answer = await failover.acall(attempt)
+    return failover.served_by(answer or _canned(errors))
+
+
+async def ask_aika_stream_async(prompt: str, served=None, attempts=None, first=None, lease=None):
+    served = {} if served is None else served
+    attempts = failover.allowed() if attempts is None else attempts
+    errors = []
+    for provider in itertools.chain([first] if first else [], attempts):
+        sent = False
+        parts = []
+        started = time.monotonic()
+        slot = lease if provider is first else None
+        try:
+            if slot is None:
+                slot = await admission.aacquire(provider.name)
+            chunks = metrics.atrack_stream(provider.astream(prompt), provider.name, provider.model)
+            async with contextlib.aclosing(chunks):
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if not sent:
+                        _check_first_chunk(chunk)
+                        sent = True
+                        served["provider"] = provider.name
+                    parts.append(chunk)
+                    yield chunk
+        except Exception as e:
+            print(f"AI STREAM ERROR ({provider.name}):", repr(e))
+            failover.record(provider, error=e)
+            if sent:
+                yield " ⚠️ (response interrupted)"
+                break
+            errors.append(e)
+            continue
+        finally:
+            if slot:
+                await slot.arelease()
+        if not sent:
+            failover.record(provider, error=ProviderError("empty stream"))
+            continue
+        _finish_stream(provider, "".join(parts), started, served)
+        break
+    if "provider" not in served:
+        served["provider"] = "canned"
+        yield _canned(errors).text
+    failover.served_by(Answer(None, served["provider"]), "stream")
+
+
+# ------------------ Background AI jobs ------------------
+# Запись (Symptom / Photo / Tip) создаётся сразу в статусе pending,
+# а ответ ИИ дописывает фоновая задача. Страница опрашивает /jobs/<kind>/<id>.
+PHOTO_PROMPT = (
+    "The user uploaded a skin photo. "
+    "Give a gentle English health suggestion (not a diagnosis)."
+)
+VISION_PROMPT = (
+    "Look at this skin photo and describe gently what you notice. "
+    "Give a short English health suggestion (not a diagnosis)."
+)
+JOB_MODELS = {"symptom": Symptom, "photo": Photo, "tip": Tip}
+
+
+def mark_job_failed(job):
+    item = db.session.get(JOB_MODELS[job.kind], job.target_id)
+    if item:
+        item.status = STATUS_ERROR
+
+
+@jobs.handler("symptom", on_error=mark_job_failed)
+def run_symptom_job(job):
+    symptom = db.session.get(Symptom, job.target_id)
+    if symptom is None:
+        return ""  # запись удалили (например, вместе с аккаунтом), пока задача ждала — провайдер не зовём
+    # контекст — на момент ответа: реплики до этой, включая дописанные за время ожидания
+    context = memory.context(symptom.user_id, before_id=symptom.id)
+    # готовый ответ на похожую жалобу годится только для первого сообщения без предыстории
+    cached = symptom_cache.lookup(symptom.text) if context.empty else None
+    if not cached:
+        job.prompt = symptom_prompt(symptom.text, context)
+    reply = Answer(cached, "cache") if cached else ask_aika_reply(job.prompt)
+    answer = reply.text
+    symptom.category = answer
+    symptom.provider = reply.provider
+    symptom.status = STATUS_DONE
+    if not cached and context.empty:
+        symptom.context_free = remember_symptom_answer(symptom.text, answer)
+    db.session.commit()
+    schedule_summary(symptom.user_id)
+    return answer
+
+
+@jobs.handler("summary")
+def run_summary_job(job):
+    """Сворачиваем старые реплики чата в пересказ (User.chat_summary)."""
+    prompt, upto_id = memory.summary_prompt(job.user_id)
+    if prompt is None:
+        return ""
+    job.prompt = prompt
+    summary = ask_aika(prompt)
+    if not is_real_reply(summary):
+        raise RuntimeError(f"summary not updated: {summary}")
+    memory.save_summary(job.user_id, summary, upto_id)
+    # накопилось больше, чем за один проход, — следующая порция
+    schedule_summary(job.user_id, current_job_id=job.id)
+    return summary
+
+
+def schedule_summary(user_id, current_job_id=None):
+    """Пересказ обновляем в фоне, когда за окном последних реплик накопилось CHAT_SUMMARIZE_EVERY."""
+    if user_id is None or not memory.needs_summary(user_id):
+        return
+    last = (
+        Job.query.filter(Job.kind == "summary", Job.user_id == user_id, Job.id != current_job_id)
+        .order_by(Job.id.desc())
+        .first()
+    )
+    if last is not None:
+        if last.status in ("queued", "running"):
+            return
+        # провайдер не смог пересказать — не зовём его заново на каждое сообщение
+        if last.status == "error" and last.finished_at and \
+                (datetime.utcnow() - last.finished_at).total_seconds() < CHAT_SUMMARY_BACKOFF:
+            return
+    jobs.submit("summary", "", target_id=user_id, user_id=user_id)
+
+
+def ensure_photo_variants(photo):
+    """Превью и JPEG-версию (в т.ч. из HEIC) делаем в пуле процессов, не в потоке запроса."""
+    if photo.thumb_path:
+        return
+    # такое же фото уже загружали — варианты готовы
+    twin = Photo.query.filter(
+        Photo.sha256 == photo.sha256, Photo.thumb_path.isnot(None), Photo.id != photo.id
+    ).first()
+    if twin:
+        info = {
+            "width": twin.width, "height": twin.height,
+            "thumb_path": twin.thumb_path, "medium_path": twin.medium_path,
+        }
+    else:
+        started = time.perf_counter()
+        try:
+            future = get_pool(IMAGE_WORKERS).submit(make_variants, UPLOAD_DIR, photo.filename, photo.sha256)
+            info = future.result(timeout=120)
+            # для HEIC это и есть время конвертации в JPEG
+            metrics.IMAGE_PROCESSING.labels("variants", extension(photo.filename)).observe(
+                time.perf_counter() - started
             )
-            return completion.choices[0].message.content.strip()
-
-        # ---- HuggingFace ----
-        elif AI_PROVIDER == "huggingface" and HF_API_KEY:
-            # многие модели HF не имеют Chat API — используем text generation endpoint
-            resp = requests.post(
-                f"https://api-inference.huggingface.co/models/{HF_MODEL}",
-                headers={"Authorization": f"Bearer {HF_API_KEY}"},
-                json={
-                    "inputs": f"Reply only in English. {prompt}",
-                    "parameters": {"max_new_tokens": 180}
-                },
-                timeout=90
+        except Exception as e:
+            print("⚠️ Image processing failed:", e)
+            return
+    for key, value in info.items():
+        setattr(photo, key, value)
+    db.session.commit()
+
+
+@jobs.handler("photo", on_error=mark_job_failed)
+def run_photo_job(job):
+    photo = db.session.get(Photo, job.target_id)
+    if photo is None:
+        return ""
+    ensure_photo_variants(photo)
+
+    reply = None
+    if VISION_PROVIDERS:
+        # фото уменьшаем до разрешения, которое реально использует первая vision-модель цепочки
+        vision = VISION_PROVIDERS[0]
+        source = photo.medium_path or photo.filename
+        try:
+            future = get_pool(IMAGE_WORKERS).submit(
+                prepare_for_model, UPLOAD_DIR, source, vision.vision_size
             )
-            if resp.status_code == 200:
-                try:
-                    data = resp.json()
-                    # Формат HF бывает разный
-                    if isinstance(data, list) and data and "generated_text" in data[0]:
-                        return data[0]["generated_text"].strip()
-                    if isinstance(data, dict) and "generated_text" in data:
-                        return data["generated_text"].strip()
-                    # Если пришёл другой формат — возвращаем строку как есть
-                    return str(data)
-                except Exception as e:
-                    print("HF JSON PARSE ERROR:", e)
-                    return "⚠️ Error parsing HuggingFace response. This is not a diagnosis."
-            else:
-                return f"⚠️ HuggingFace API error {resp.status_code}: {resp.text}"
-
-        # ---- Ollama (локально) ----
-        elif AI_PROVIDER == "ollama":
-            # Принудительно просим английский
-            local_prompt = f"Reply only in English. {prompt}"
-            resp = requests.post(
-                "http://127.0.0.1:11434/api/generate",
-                json={"model": OLLAMA_MODEL, "prompt": local_prompt},
-                timeout=90,
-                stream=True  # читаем стримом
+            payload, info = future.result(timeout=60)
+            metrics.IMAGE_PROCESSING.labels("model_payload", extension(source)).observe(info["decode_ms"] / 1000)
+            print(
+                f"🖼 Photo {photo.id} → {vision.name}: {info['bytes'] / 1024:.0f} KB, "
+                f"{info['width']}x{info['height']}, decode {info['decode_ms']} ms"
             )
+            reply = ask_aika_image(VISION_PROMPT, payload)
+        except Exception as e:
+            print("⚠️ Photo preprocessing failed:", e)
+    if reply is None or reply.provider == "canned":
+        # ни одна vision-модель не ответила — совет по тексту промпта
+        reply = ask_aika_reply(job.prompt)
+    photo.result = reply.text
+    photo.provider = reply.provider
+    photo.status = STATUS_DONE
+    return reply.text
+
+
+def photo_url(photo, variant="thumb"):
+    """URL картинки для шаблонов: вариант, если он готов, иначе оригинал (если браузер его покажет)."""
+    path = getattr(photo, f"{variant}_path", None)
+    if not path and extension(photo.filename) in BROWSER_EXTENSIONS:
+        path = photo.filename
+    if not path:
+        return url_for("static", filename="images/logo_symptera.png")
+    return url_for("static", filename=f"uploads/{path}")
+
+
+app.jinja_env.globals.update(photo_url=photo_url)
+
+
+@jobs.handler("tip", on_error=mark_job_failed)
+def run_tip_job(job):
+    tip = db.session.get(Tip, job.target_id)
+    if tip is None:
+        return ""
+    reply = ask_aika_reply(job.prompt)
+    tip.text = reply.text
+    tip.provider = reply.provider
+    tip.status = STATUS_DONE
+    return reply.text
+
+
+# ------------------ Tip pool ------------------
+# /tips отдаёт готовый совет из пула (tip_pool.py); пул пополняет фоновая задача,
+# когда провайдер не занят пользователями. TIP_POOL_SIZE=0 — пул выключен
+tip_pool = TipPool(
+    target=int(os.getenv("TIP_POOL_SIZE", 20)),
+    max_age=int(os.getenv("TIP_POOL_MAX_AGE", 7 * 86400)),
+    dedup_window=int(os.getenv("TIP_POOL_DEDUP_WINDOW", 30 * 86400)),
+    batch=int(os.getenv("TIP_POOL_BATCH", 5)),
+    cacheable=lambda text: is_real_reply(text),
+)
+TIP_POOL_INTERVAL = float(os.getenv("TIP_POOL_INTERVAL", 60))
+TIP_POOL_BACKOFF = float(os.getenv("TIP_POOL_BACKOFF", 600))  # пауза, если пополнение ничего не дало
+
+
+def ai_idle() -> bool:
+    """Провайдер свободен: задач в очереди нет и занято меньше половины слотов."""
+    queued = Job.query.filter(Job.status == "queued", Job.kind != "tip_refill").first()
+    if queued is not None:
+        return False
+    return admission.in_flight(ai.name) < max(1, admission.limit_for(ai.name) // 2)
+
+
+@jobs.handler("tip_refill")
+def run_tip_refill_job(job):
+    outcomes = tip_pool.refill(ask_aika, idle=ai_idle)
+    # что-то добавили, но пул ещё неполон — следующая порция; одни дубли — ждём таймера
+    if outcomes["added"]:
+        schedule_tip_refill(current_job_id=job.id)
+    return json.dumps(outcomes)
+
+
+def schedule_tip_refill(current_job_id=None):
+    """Одна задача пополнения на все воркеры — и только если пул неполон, а провайдер свободен."""
+    if not tip_pool.enabled or not tip_pool.deficit() or not ai_idle():
+        return
+    last = (
+        Job.query.filter(Job.kind == "tip_refill", Job.id != current_job_id)
+        .order_by(Job.id.desc())
+        .first()
+    )
+    if last is not None:
+        if last.status in ("queued", "running"):
+            return
+        # провайдер отвечал ошибками или одними дублями — не дёргаем его каждые TIP_POOL_INTERVAL
+        fruitless = last.status == "error" or not json.loads(last.result or "{}").get("added")
+        if fruitless and last.finished_at and (datetime.utcnow() - last.finished_at).total_seconds() < TIP_POOL_BACKOFF:
+            return
+    jobs.submit("tip_refill", "")
+
+
+# ------------------ Уборка ------------------
+# Удаление аккаунта — порциями по ACCOUNT_DELETE_CHUNK строк; файлы фото, уборка сирот
+# в uploads и возврат места SQLite — фоновые задачи (cleanup.py)
+ACCOUNT_DELETE_CHUNK = int(os.getenv("ACCOUNT_DELETE_CHUNK", 500))
+UPLOADS_GC_INTERVAL  = float(os.getenv("UPLOADS_GC_INTERVAL", 86400))   # 0 — выключено
+UPLOADS_GC_GRACE     = int(os.getenv("UPLOADS_GC_GRACE", 3600))
+DB_VACUUM_INTERVAL   = float(os.getenv("DB_VACUUM_INTERVAL", 86400))    # 0 — выключено
+
+
+@jobs.handler("purge_uploads")
+def run_purge_uploads_job(job):
+    result = cleanup.purge_uploads(UPLOAD_DIR, json.loads(job.prompt), grace=UPLOADS_GC_GRACE)
+    return json.dumps(result)
+
+
+@jobs.handler("uploads_gc")
+def run_uploads_gc_job(job):
+    result = cleanup.collect_orphans(UPLOAD_DIR, grace=UPLOADS_GC_GRACE)
+    if result["removed"]:
+        print(f"🧹 Uploads GC: {result['removed']} orphaned files, {result['freed_bytes'] / 1024 / 1024:.1f} MB")
+    return json.dumps(result)
+
+
+@jobs.handler("db_vacuum")
+def run_db_vacuum_job(job):
+    return json.dumps(cleanup.vacuum())
+
+
+def schedule_periodic(kind, every):
+    """Задача kind раз в every секунд на все воркеры: по времени последней такой задачи в Job."""
+    if every <= 0:
+        return
+    last = Job.query.filter(Job.kind == kind).order_by(Job.id.desc()).first()
+    if last is not None:
+        if last.status in ("queued", "running"):
+            return
+        if last.finished_at and (datetime.utcnow() - last.finished_at).total_seconds() < every:
+            return
+    jobs.submit(kind, "")
+
+
+def _maintenance_loop():
+    while True:
+        try:
+            with app.app_context():
+                schedule_periodic("uploads_gc", UPLOADS_GC_INTERVAL)
+                schedule_periodic("db_vacuum", DB_VACUUM_INTERVAL)
+        except Exception as e:
+            print("MAINTENANCE ERROR:", repr(e))
+        time.sleep(60)
+
+
+def _tip_pool_loop():
+    """Раз в TIP_POOL_INTERVAL секунд: замер пула для метрик и пополнение в простой."""
+    while True:
+        try:
+            with app.app_context():
+                tip_pool.observe()
+                schedule_tip_refill()
+        except Exception as e:
+            print("TIP POOL ERROR:", repr(e))
+        time.sleep(TIP_POOL_INTERVAL)
+
+
+# ------------------ Near-duplicate symptom cache ------------------
+# «I have a headache» и «have a headache today» получают один и тот же ответ без вызова ИИ
+symptom_cache = SymptomAnswerCache(
+    threshold=float(os.getenv("SYMPTOM_CACHE_THRESHOLD", 0.8)),
+    maxsize=int(os.getenv("SYMPTOM_CACHE_SIZE", 5000)),
+)
 
-            if resp.status_code == 200:
-                response_text = ""
-                for line in resp.iter_lines():
-                    if not line:
-                        continue
-                    try:
-                        obj = json.loads(line.decode("utf-8"))
-                        chunk = obj.get("response", "")
-                        if chunk:
-                            response_text += chunk
-                    except Exception as e:
-                        print("Ollama stream JSON parse error:", e)
-                        continue
-                return response_text.strip() or "⚠️ Empty response from Ollama. This is not a diagnosis."
-            else:
-                return f"⚠️ Ollama error {resp.status_code}: {resp.text}"
-
-        # ---- Нет провайдера / ключа ----
-        else:
-            return random.choice([
-                "Try to rest and drink some water 💧 (This is not a diagnosis.)",
-                "If you feel worse, contact a doctor ⚕️ (This is not a diagnosis.)",
-                "Monitor your symptoms 🙏 (This is not a diagnosis.)"
-            ])
-
-    except Exception as e:
-        print("AI ERROR:", e)
-        return random.choice([
-            "Try to rest and drink some water 💧 (This is not a diagnosis.)",
-            "If you feel worse, contact a doctor ⚕️ (This is not a diagnosis.)",
-            "Monitor your symptoms 🙏 (This is not a diagnosis.)"
-        ])
+
+# Память чата: последние CHAT_CONTEXT_TURNS реплик + пересказ более старых,
+# всё вместе не больше CHAT_CONTEXT_TOKENS (оценка без токенизатора модели)
+memory = ConversationMemory(
+    max_turns=int(os.getenv("CHAT_CONTEXT_TURNS", 6)),
+    max_tokens=int(os.getenv("CHAT_CONTEXT_TOKENS", 700)),
+    summary_tokens=int(os.getenv("CHAT_SUMMARY_TOKENS", 200)),
+    summarize_every=int(os.getenv("CHAT_SUMMARIZE_EVERY", 4)),
+)
+CHAT_SUMMARY_BACKOFF = float(os.getenv("CHAT_SUMMARY_BACKOFF", 600))  # пауза после неудачного пересказа
+
+
+def remember_symptom_answer(text, answer) -> bool:
+    """Ответ без памяти чата — в общий кэш; True, если он туда попал."""
+    if not is_real_reply(answer):
+        return False
+    symptom_cache.add(text, answer)
+    return True
+
+
+def warm_symptom_cache():
+    """
+    Индекс строим по последним сохранённым ответам, дальше — инкрементально.
+    Кэш общий для всех пользователей — берём только ответы без памяти чата (context_free).
+    """
+    with app.app_context():
+        recent = (
+            db.session.query(Symptom.text, Symptom.category)
+            .filter(Symptom.status == STATUS_DONE, Symptom.context_free.is_(True), Symptom.category != "")
+            .order_by(Symptom.id.desc())
+            .limit(symptom_cache.maxsize)
+            .all()
+        )
+    symptom_cache.warm((text, answer) for text, answer in reversed(recent) if is_real_reply(answer))
+
+
+# ------------------ Старт воркера ------------------
+# Импорт app не ходит в БД, не грузит SDK и не запускает потоки — это дёшево и для
+# CLI-команд. Всё, что нужно именно работающему воркеру, делает init_worker().
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def init_worker():
+    """
+    Один раз на процесс: gunicorn post_worker_init, ASGI lifespan или первый запрос.
+    Прогрев идёт в фоне и не задерживает начало обслуживания запросов.
+    """
+    global _worker_pid
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+    threading.Thread(target=_warm_up, name="worker-warm-up", daemon=True).start()
+
+
+def _warm_up():
+    started = time.perf_counter()
+    with app.app_context():
+        missing = migrations.missing()
+        if missing:
+            print(f"⚠️ Database schema is behind ({len(missing)} migrations): run flask --app app db upgrade")
+            return
+        # подхватываем задачи, которые не успели выполниться до рестарта
+        jobs.recover()
+    if symptom_cache.maxsize > 0:
+        warm_symptom_cache()
+    warm_pool(IMAGE_WORKERS)  # процессы для фото и PIL в них — до первой загрузки
+    for provider in providers:
+        try:
+            provider.warm_up()
+        except Exception as e:
+            print(f"AI WARM-UP ERROR ({provider.name}):", repr(e))
+    if tip_pool.enabled:
+        threading.Thread(target=_tip_pool_loop, name="tip-pool", daemon=True).start()
+    threading.Thread(target=_maintenance_loop, name="maintenance", daemon=True).start()
+    print(f"🔥 Worker {os.getpid()} warmed up in {time.perf_counter() - started:.2f}s")
+
+
+@app.before_request
+def _init_worker_once():
+    # для серверов без хука на старт воркера (flask run, python app.py)
+    if _worker_pid != os.getpid():
+        init_worker()
+
+
+def sse(event: str, data) -> str:
+    """Одно сообщение Server-Sent Events (data всегда JSON)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 # ------------------ Routes: Public ------------------
 @app.route("/")
@@ -223,8 +826,6 @@ def register():
     return render_template("register.html")
 
 
-from flask import request
-
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
@@ -251,6 +852,15 @@ def logout():
 def dashboard():
     profile = current_user
 
+    # 🧠 Генерация персонального совета на основе данных
+    # (ИИ вызывается только если профиль изменился или совет устарел)
+    advice = advice_cache.get_or_create(profile, lambda: ask_aika(dashboard_prompt(profile)))
+
+    # ⚙️ Отправляем всё в шаблон dashboard.html
+    return render_template("base.html", user=profile, advice=advice)
+
+
+def dashboard_prompt(profile) -> str:
     # 🩺 Собираем описание профиля для AI-совета
     profile_info = (
         f"The user is {profile.age or 'unknown'} years old, "
@@ -266,16 +876,11 @@ def dashboard():
         f"Smoking: {'yes' if profile.smoking else 'no'}, "
         f"Alcohol: {'yes' if profile.alcohol else 'no'}."
     )
-
-    # 🧠 Генерация персонального совета на основе данных
-    advice = ask_aika(
+    return (
         f"{profile_info} Based on this health profile, give one short, friendly, personalized health advice. "
         f"Keep it under 50 words and make it motivational. This is not a diagnosis."
     )
 
-    # ⚙️ Отправляем всё в шаблон dashboard.html
-    return render_template("base.html", user=profile, advice=advice)
-
 # ---------- Edit Profile ----------
 @app.route("/edit_profile", methods=["GET", "POST"])
 @login_required
@@ -297,6 +902,8 @@ def edit_profile():
         user.smoking = bool(request.form.get("smoking"))
         user.alcohol = bool(request.form.get("alcohol"))
 
+        # профиль поменялся — старый совет больше не актуален
+        advice_cache.invalidate(user.id)
         db.session.commit()
         return redirect(url_for("dashboard"))
 
@@ -310,21 +917,35 @@ def account():
     return render_template("account.html", user=user)
 
 
+# ---------- Export ----------
+@app.route("/account/export")
+@login_required
+def export_history():
+    # вся история отдаётся потоком: память воркера не растёт с её размером
+    fmt = request.args.get("format", "json")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    return Response(
+        stream_with_context(export.stream(fmt, current_user.id, upload_dir=UPLOAD_DIR)),
+        mimetype=export.FORMATS[fmt][0],
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(fmt)}"'},
+    )
+
+
 # ---------- Delete Account ----------
 @app.route("/delete_account", methods=["POST"])
 @login_required
 def delete_account():
-    user = current_user
-
-    # Удаляем все связанные записи
-    Symptom.query.delete()
-    Photo.query.delete()
-    Tip.query.delete()
-
-    db.session.delete(user)
-    db.session.commit()
-
+    user_id = current_user.id
     logout_user()
+    advice_cache.invalidate(user_id)
+
+    # только записи этого пользователя, порциями — без долгой блокировки SQLite
+    files, removed = cleanup.delete_user(user_id, chunk=ACCOUNT_DELETE_CHUNK)
+    print(f"🗑 Account {user_id} deleted: {removed}, {len(files)} files to purge")
+    # файлы фото и превью — в фоне (те, что есть и у других пользователей, останутся)
+    if files:
+        jobs.submit("purge_uploads", json.dumps(files))
     return redirect(url_for("index"))
 
 
@@ -332,30 +953,102 @@ def delete_account():
 @app.route("/symptoms", methods=["GET", "POST"])
 @login_required
 def symptoms():
-    from datetime import datetime
-
     if request.method == "POST":
         user_input = request.form.get("symptom", "").strip()
         if not user_input:
             return redirect(url_for("symptoms"))
+        admit(current_user.id)
 
-        # Ask AI
-        ai_response = ask_aika(
-            f"The user says: '{user_input}'. Give a short English response (1–2 sentences) with care and clarity. This is not a diagnosis."
-        )
-
-        # Save to DB
-        new_symptom = Symptom(text=user_input, category=ai_response)
+        # Save to DB (ответ допишет фоновая задача)
+        new_symptom = Symptom(user_id=current_user.id, text=user_input, category="", status=STATUS_PENDING)
         db.session.add(new_symptom)
         db.session.commit()
 
+        # Ask AI
+        jobs.submit("symptom", symptom_prompt(user_input), target_id=new_symptom.id, user_id=current_user.id)
+
         return redirect(url_for("symptoms"))
 
-    # Load chat history
-    symptoms = Symptom.query.order_by(Symptom.created_at.asc()).all()
+    # Load chat history: последние N сообщений пользователя, старые — по ссылке
+    cursor = decode_cursor(request.args.get("before"))
+    symptoms, older = latest_page(Symptom, "symptom", current_user.id, CHAT_PAGE_SIZE, cursor)
+    symptoms.reverse()  # в чате — снизу вверх
     for s in symptoms:
         s.time = s.created_at.strftime("%I:%M %p")
-    return render_template("symptoms.html", symptoms=symptoms)
+    return render_template("symptoms.html", symptoms=symptoms, older=older, paged=cursor is not None)
+
+
+def symptom_prompt(user_input: str, context=None) -> str:
+    history = f"{context.render()}\n" if context is not None and not context.empty else ""
+    return (
+        f"{history}The user says: '{user_input}'. Give a short English response (1–2 sentences) "
+        f"with care and clarity. This is not a diagnosis."
+    )
+
+
+@app.route("/symptoms/stream", methods=["POST"])
+@login_required
+def symptoms_stream():
+    """Тот же чат, но ответ уходит в браузер токенами (SSE) по мере генерации."""
+    user_input = request.form.get("symptom", "").strip()
+    if not user_input:
+        return jsonify({"error": "empty message"}), 400
+
+    user_id = current_user.id
+    admission.check_user(user_id, ai.name)
+    prompt, cached, fresh = stream_prompt(user_id, user_input)
+    # слот занимаем до заголовков ответа: если все провайдеры перегружены — честный 503
+    attempts, first, lease = (None, None, None) if cached else stream_start()
+
+    def generate():
+        parts = []
+        served = {"provider": "cache"} if cached else {}
+        completed = False
+        try:
+            for chunk in ([cached] if cached else ask_aika_stream(prompt, served, attempts, first, lease)):
+                parts.append(chunk)
+                yield sse("token", chunk)
+            completed = True
+        finally:
+            if lease:
+                lease.release()
+            # сохраняем даже если клиент закрыл вкладку посреди ответа
+            done = save_streamed_symptom(
+                user_id, user_input, "".join(parts), completed and fresh and not cached, served.get("provider"),
+            )
+        yield sse("done", done)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if lease:
+        # клиент ушёл до первого куска — генератор не стартует, слот отпускаем при закрытии
+        response.call_on_close(lease.release)
+    return response
+
+
+def stream_prompt(user_id, user_input):
+    """(промпт с памятью чата, готовый ответ из кэша или None, разговор без предыстории?)."""
+    context = memory.context(user_id)
+    # без истории на почти такую же жалобу ответ уже есть — отдаём его сразу одним куском;
+    # с историей ответ зависит от разговора, кэш не годится
+    cached = symptom_cache.lookup(user_input) if context.empty else None
+    return symptom_prompt(user_input, context), cached, context.empty
+
+
+def save_streamed_symptom(user_id, user_input, answer, remember, provider=None):
+    """Сохраняет реплику чата после стрима; возвращает данные для события done."""
+    answer = answer.strip()
+    context_free = remember_symptom_answer(user_input, answer) if remember else False
+    new_symptom = Symptom(
+        user_id=user_id, text=user_input, category=answer, provider=provider, context_free=context_free,
+    )
+    db.session.add(new_symptom)
+    db.session.commit()
+    schedule_summary(user_id)
+    return {"id": new_symptom.id, "created_at": new_symptom.created_at.isoformat(), "provider": provider}
 
 
 # ------------------ Photo (protected) ------------------
@@ -367,52 +1060,31 @@ def photo():
 
     if request.method == "POST":
         file = request.files.get("photo")
-        print("📥 Incoming request method:", request.method)
-        file = request.files.get("photo")
-        print("📸 File object:", file)
-        if file:
-            print("📁 Filename:", file.filename)
 
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            file.save(filepath)
-
-            import PIL
-            from PIL import Image
-
-            # если файл HEIC — конвертируем в JPG
-            if filename.lower().endswith(".heic"):
-                try:
-                    from pillow_heif import register_heif_opener
-                    register_heif_opener()
-
-                    heic_image = Image.open(filepath)
-                    new_filename = filename.rsplit(".", 1)[0] + ".jpg"
-                    new_path = os.path.join(app.config["UPLOAD_FOLDER"], new_filename)
-                    heic_image.save(new_path, format="JPEG")
-                    os.remove(filepath)  # удаляем оригинал
-                    filename = new_filename
-                    filepath = new_path
-                    print("✅ Converted HEIC → JPG:", filepath)
-                except Exception as e:
-                    print("⚠️ HEIC conversion failed:", e)
-
-            # AI анализ
-            ai_result = ask_aika(
-                "The user uploaded a skin photo. "
-                "Give a gentle English health suggestion (not a diagnosis)."
+            admit(current_user.id)
+            # пишем потоком в uploads/<ab>/<sha256>.<ext>: одинаковые фото не дублируются
+            # и файлы разных пользователей с одним именем не перезатирают друг друга
+            try:
+                sha, filename = save_upload(file, app.config["UPLOAD_FOLDER"])
+            except UnsupportedImage as e:
+                return render_template("photo.html", result=None, error=str(e))
+
+            new_photo = Photo(
+                user_id=current_user.id, filename=filename, sha256=sha, result="", status=STATUS_PENDING
             )
-
-            new_photo = Photo(filename=filename, result=ai_result)
             db.session.add(new_photo)
             db.session.commit()
 
+            # AI анализ — в фоне, страница заберёт результат через /jobs/photo/<id>
+            jobs.submit("photo", PHOTO_PROMPT, target_id=new_photo.id, user_id=current_user.id)
+
             # 👇 добавь это
             result = {
                 "filename": filename,
-                "analysis": ai_result,
-                "url": url_for("static", filename=f"uploads/{filename}")
+                "analysis": None,
+                "url": photo_url(new_photo, "medium"),
+                "poll": url_for("job_status", kind="photo", item_id=new_photo.id, variant="medium"),
             }
     return render_template("photo.html", result=result)
 
@@ -421,23 +1093,109 @@ def photo():
 @login_required
 def tips():
     if request.method == "POST":
-        text = ask_aika("Give one short English tip about nutrition, sleep, or physical activity. This is not a diagnosis.")
-        new_tip = Tip(text=text)
+        category = request.form.get("category")
+        if category not in TIP_CATEGORIES:
+            category = None  # любая тема
+        admission.check_user(current_user.id, ai.name)
+        # готовый совет из пула — сразу в историю, без модели
+        pooled = tip_pool.pop(category) if tip_pool.enabled else None
+        if pooled is not None:
+            db.session.add(Tip(user_id=current_user.id, text=pooled[1], status=STATUS_DONE, provider="pool"))
+            db.session.commit()
+            return redirect(url_for("history"))
+
+        admission.check_capacity(ai.name)
+        new_tip = Tip(user_id=current_user.id, text="", status=STATUS_PENDING)
         db.session.add(new_tip)
         db.session.commit()
+        jobs.submit("tip", tip_prompt(category), target_id=new_tip.id, user_id=current_user.id)
         return redirect(url_for("history"))
 
-    return render_template("tips.html")
+    return render_template("tips.html", categories=TIP_CATEGORIES)
 
 # ------------------ History (protected or public?) ------------------
 # Если хочешь закрыть историю — оставь @login_required.
 @app.route("/history")
 @login_required
 def history():
-    symptoms = Symptom.query.order_by(Symptom.created_at.desc()).all()
-    photos   = Photo.query.order_by(Photo.created_at.desc()).all()
-    tips     = Tip.query.order_by(Tip.created_at.desc()).all()
-    return render_template("history.html", symptoms=symptoms, photos=photos, tips=tips)
+    # общая лента симптомов, фото и советов — по одной странице за раз
+    cursor = decode_cursor(request.args.get("cursor"))
+    feed, next_cursor = merged_feed(JOB_MODELS, current_user.id, HISTORY_PAGE_SIZE, cursor)
+    return render_template("history.html", feed=feed, next_cursor=next_cursor)
+
+
+@app.route("/history/search")
+@login_required
+def search_history():
+    # полнотекстовый поиск (FTS5) только по своим записям, самые релевантные — первыми
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    results, has_more = [], False
+    if query:
+        results, has_more = search.search(
+            current_user.id, query, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE
+        )
+    return render_template(
+        "history.html",
+        feed=[(kind, item) for kind, item, _ in results],
+        snippets={(kind, item.id): snippet for kind, item, snippet in results},
+        query=query,
+        next_page=page + 1 if has_more else None,
+    )
+
+
+# ------------------ Job status (poll) ------------------
+@app.route("/jobs/<kind>/<int:item_id>")
+@login_required
+def job_status(kind, item_id):
+    model = JOB_MODELS.get(kind)
+    item = db.session.get(model, item_id) if model else None
+    if item is None or item.user_id != current_user.id:
+        return jsonify({"error": "not found"}), 404
+
+    job = Job.query.filter_by(kind=kind, target_id=item_id).order_by(Job.id.desc()).first()
+    text = {"symptom": "category", "photo": "result", "tip": "text"}[kind]
+    data = {
+        "status": item.status,
+        "job": job.status if job else None,
+        "error": job.error if job else None,
+        "text": getattr(item, text),
+    }
+    if kind == "photo":
+        variant = "medium" if request.args.get("variant") == "medium" else "thumb"
+        data["image"] = photo_url(item, variant)
+    return jsonify(data)
+
+
+# ------------------ Перегрузка ------------------
+@app.errorhandler(AdmissionError)
+def admission_error(e):
+    # fetch/SSE ждут JSON, браузер — страницу «Aika is busy»
+    if request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json":
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    else:
+        response = make_response(render_template("busy.html", message=str(e), retry_after=e.retry_after))
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+# ------------------ Stats ------------------
+@app.route("/stats")
+@login_required
+def stats():
+    # hits / misses / coalesced — счётчики этого воркера; суммы по всем воркерам — в /metrics
+    return jsonify({
+        "worker": {"pid": os.getpid(), "counters": "per-worker, totals across workers in /metrics"},
+        "advice_cache": advice_cache.stats(),
+        "jobs": jobs.stats(),
+        "coalescing": inflight.stats(),
+        "symptom_cache": symptom_cache.stats(),
+        "admission": admission.stats(),
+        "provider": ai.stats(),
+        "failover": failover.stats(),
+        "tip_pool": tip_pool.stats(),
+    })
 
 
 @app.route('/about')
@@ -449,9 +1207,14 @@ if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
 
     print("🧠 Flask started with:")
-    print("AI_PROVIDER =", os.getenv("AI_PROVIDER"))
+    print("AI_PROVIDER =", ai.name, "| model =", ai.model)
+    if len(providers) > 1:
+        print("AI_PROVIDERS =", " → ".join(p.name for p in providers))
     print("OPENAI_API_KEY =", (os.getenv("OPENAI_API_KEY")[:10] + "...") if os.getenv("OPENAI_API_KEY") else None)
 
+    # dev-сервер: схему догоняем сами, в проде это делает release-шаг
+    with app.app_context():
+        migrations.upgrade(verbose=True)
     app.run(host="0.0.0.0", port=port)
 
 
@@ -0,0 +1,278 @@
+"""
+Async-режим (ASGI): ожидание ответа ИИ держит корутину, а не поток воркера,
+поэтому один процесс держит сотни одновременных генераций.
+
+    uvicorn asgi:application --workers 2
+    gunicorn -k uvicorn_worker.UvicornWorker -w 2 asgi:application
+
+Маршруты, которые ждут ИИ прямо в запросе (/dashboard, /symptoms/stream),
+работают на asyncio; всё остальное — тот же Flask через WSGI-мост в пуле потоков.
+Обычный режим (gunicorn app:app) никуда не делся.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import jsonify, render_template, request
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+
+import metrics
+from admission import AdmissionError
+from app import (
+    app, ai, providers, admission, advice_cache,
+    ask_aika_async, ask_aika_stream_async, astream_start, dashboard_prompt, stream_prompt,
+    save_streamed_symptom, sse, init_worker,
+)
+
+# Потоки для синхронной части: Flask-маршруты, БД, шаблоны.
+# Сам ИИ их не занимает — ожидание ответа в async-маршрутах идёт в цикле событий.
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 32))
+_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+# ------------------ Flask через WSGI-мост ------------------
+def _run_wsgi_app():
+    """
+    Синхронное тело WsgiToAsgiInstance.run_wsgi_app. Это внутренности asgiref
+    (версия закреплена в requirements-async.txt) — если они поменялись, падаем при импорте,
+    а не молча возвращаемся к одному потоку на все WSGI-запросы.
+    """
+    wrapped = getattr(WsgiToAsgiInstance.__dict__.get("run_wsgi_app"), "func", None)
+    if not callable(wrapped):
+        raise RuntimeError(
+            "asgiref.wsgi.WsgiToAsgiInstance.run_wsgi_app changed: "
+            "install the asgiref version pinned in requirements-async.txt"
+        )
+    return wrapped
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # по умолчанию asgiref гоняет все WSGI-запросы в одном потоке — даём пул
+    run_wsgi_app = sync_to_async(_run_wsgi_app(), thread_sensitive=False, executor=_pool)
+
+
+class _Wsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_asgi = _Wsgi(app)
+
+
+# ------------------ Запрос / ответ ------------------
+class Reply:
+    """Готовый ответ Flask, собранный в потоке и отправляемый из цикла событий."""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    def of(cls, rv):
+        # вызывать внутри контекста запроса: process_response сохранит сессию и куки
+        response = app.process_response(app.make_response(rv))
+        return cls(response.status_code, response.headers.to_wsgi_list(), response.get_data())
+
+    async def send(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in self.headers],
+        })
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class AsyncRequest:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.environ = None
+        self.disconnected = False
+
+    async def read(self):
+        body = []
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected = True
+                break
+            body.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        self.environ = _build_environ(self.scope, b"".join(body))
+
+    async def watch_disconnect(self):
+        # клиент закрыл вкладку — перестаём стримить (ответ всё равно сохраним)
+        while not self.disconnected:
+            if (await self.receive())["type"] == "http.disconnect":
+                self.disconnected = True
+
+    async def run(self, fn, *args):
+        """fn в потоке пула, внутри контекста этого запроса (current_user, db.session)."""
+        def call():
+            with app.request_context(self.environ):
+                try:
+                    return fn(*args)
+                except AdmissionError as e:
+                    return _error_reply(e)
+        return await asyncio.get_running_loop().run_in_executor(_pool, call)
+
+
+def _build_environ(scope, body):
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+    host = dict(headers).get("host") or "{}:{}".format(*scope.get("server") or ("localhost", 80))
+    builder = EnvironBuilder(
+        path=scope["path"],
+        base_url=f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}",
+        query_string=scope.get("query_string", b"").decode("latin-1"),
+        method=scope["method"],
+        headers=headers,
+        data=body,
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    return environ
+
+
+def _unauthorized():
+    return Reply.of(app.login_manager.unauthorized())
+
+
+def _error_reply(e):
+    # та же страница / JSON «Aika is busy», что и в обычном режиме (app.admission_error)
+    return Reply.of(app.handle_user_exception(e))
+
+
+# ------------------ /dashboard ------------------
+def _dashboard_lookup():
+    if not current_user.is_authenticated:
+        return _unauthorized()
+    fingerprint, advice = advice_cache.lookup(current_user)
+    return fingerprint, advice, dashboard_prompt(current_user)
+
+
+def _dashboard_render(fingerprint, advice, generated):
+    if generated:
+        advice_cache.store(current_user.id, fingerprint, advice)
+    return Reply.of(render_template("base.html", user=current_user, advice=advice))
+
+
+async def dashboard(req, send):
+    state = await req.run(_dashboard_lookup)
+    if isinstance(state, Reply):
+        return state
+    fingerprint, advice, prompt = state
+    generated = advice is None
+    if generated:
+        advice = await ask_aika_async(prompt)
+    return await req.run(_dashboard_render, fingerprint, advice, generated)
+
+
+# ------------------ /symptoms/stream ------------------
+def _stream_begin():
+    if not current_user.is_authenticated:
+        return _unauthorized()
+    user_input = request.form.get("symptom", "").strip()
+    if not user_input:
+        return Reply.of((jsonify({"error": "empty message"}), 400))
+    admission.check_user(current_user.id, ai.name)
+    return (current_user.id, user_input) + stream_prompt(current_user.id, user_input)
+
+
+async def _once(text):
+    yield text
+
+
+async def symptoms_stream(req, send):
+    state = await req.run(_stream_begin)
+    if isinstance(state, Reply):
+        return state
+    user_id, user_input, prompt, cached, fresh = state
+    # слот — до заголовков ответа, чтобы при перегрузке успеть отдать 503
+    attempts, first, lease = (None, None, None) if cached else await astream_start()
+
+    watcher = asyncio.ensure_future(req.watch_disconnect())
+    parts = []
+    served = {"provider": "cache"} if cached else {}
+    completed = False
+    chunks = _once(cached) if cached else ask_aika_stream_async(prompt, served, attempts, first, lease)
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                if req.disconnected:
+                    break
+                parts.append(chunk)
+                await send({"type": "http.response.body", "body": sse("token", chunk).encode(), "more_body": True})
+            else:
+                completed = True
+    finally:
+        watcher.cancel()
+        if lease:
+            await lease.arelease()
+        # сохраняем даже если клиент закрыл вкладку посреди ответа
+        done = await req.run(
+            save_streamed_symptom, user_id, user_input, "".join(parts), completed and fresh and not cached,
+            served.get("provider"),
+        )
+    await send({"type": "http.response.body", "body": sse("done", done).encode()})
+
+
+# ------------------ ASGI-приложение ------------------
+ASYNC_ROUTES = {
+    ("GET", "/dashboard"): dashboard,
+    ("POST", "/symptoms/stream"): symptoms_stream,
+}
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    handler = ASYNC_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        return await flask_asgi(scope, receive, send)
+
+    started = time.perf_counter()
+    req = AsyncRequest(scope, receive)
+    await req.read()
+    try:
+        reply = await handler(req, send)
+    except AdmissionError as e:
+        reply = await req.run(_error_reply, e)
+    if reply is not None:
+        await reply.send(send)
+    metrics.REQUEST_LATENCY.labels(
+        handler.__name__, scope["method"], str(reply.status if reply else 200)
+    ).observe(time.perf_counter() - started)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            init_worker()  # восстановление задач и прогрев — в фоне
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for provider in providers:
+                await provider.aclose()  # закрываем пулы httpx
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,194 @@
+"""
+Локальная заглушка LLM для бенчмарков: говорит на протоколе Ollama
+(/api/generate, NDJSON-стрим) и OpenAI (/v1/chat/completions, SSE-стрим).
+
+    python bench/fake_llm.py --port 11500 --token-rate 40 --latency-median 300 --error-rate 0.02
+
+Приложение направляем на неё через OLLAMA_URL=http://127.0.0.1:11500
+или OPENAI_BASE_URL=http://127.0.0.1:11500/v1 (+ любой OPENAI_API_KEY).
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "rest drink water sleep well try light stretching keep track of your symptoms "
+    "and talk to a doctor if it gets worse eat more vegetables take short walks"
+).split()
+
+
+class FakeLLMConfig:
+    def __init__(self, token_rate=50.0, tokens=40, latency_median=200.0, latency_sigma=0.5,
+                 error_rate=0.0, error_status=503, seed=None):
+        self.token_rate = token_rate          # токенов в секунду
+        self.tokens = tokens                  # длина ответа
+        self.latency_median = latency_median  # мс до первого токена (медиана)
+        self.latency_sigma = latency_sigma    # разброс логнормального распределения
+        self.error_rate = error_rate          # доля ответов с ошибкой
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def first_token_delay(self) -> float:
+        with self.lock:
+            return self.latency_median / 1000 * math.exp(self.random.gauss(0, self.latency_sigma))
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def tokens_iter(self):
+        delay = 1.0 / self.token_rate if self.token_rate > 0 else 0
+        time.sleep(self.first_token_delay())
+        for i in range(self.tokens):
+            if i:
+                time.sleep(delay)
+            yield ("" if i == 0 else " ") + WORDS[i % len(WORDS)]
+        yield ". This is not a diagnosis."
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # сотни одновременных соединений от async-режима
+
+    def handle_error(self, request, client_address):
+        # клиент оборвал стрим (таймаут, остановка приложения) — это не ошибка заглушки
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_handler(config: FakeLLMConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _start_stream(self, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _end_stream(self):
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._send_json(200, {"requests": config.requests, "errors": config.errors})
+            self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = self._body()
+            if config.should_fail():
+                return self._send_json(config.error_status, {"error": "injected failure"})
+            if self.path == "/api/generate":
+                return self._ollama(body)
+            if self.path in ("/v1/chat/completions", "/chat/completions"):
+                return self._openai(body)
+            self._send_json(404, {"error": "not found"})
+
+        # ---- Ollama ----
+        def _ollama(self, body):
+            model = body.get("model", "fake")
+            if body.get("stream") is False:
+                text = "".join(config.tokens_iter())
+                return self._send_json(200, {"model": model, "response": text, "done": True})
+            self._start_stream("application/x-ndjson")
+            for token in config.tokens_iter():
+                line = {"model": model, "response": token, "done": False}
+                self._chunk(json.dumps(line).encode("utf-8") + b"\n")
+            self._chunk(json.dumps({"model": model, "response": "", "done": True}).encode("utf-8") + b"\n")
+            self._end_stream()
+
+        # ---- OpenAI ----
+        def _openai(self, body):
+            model = body.get("model", "fake")
+            created = int(time.time())
+            if not body.get("stream"):
+                text = "".join(config.tokens_iter())
+                return self._send_json(200, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": config.tokens, "total_tokens": config.tokens},
+                })
+            self._start_stream("text/event-stream")
+            for token in config.tokens_iter():
+                event = {
+                    "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self._chunk(b"data: [DONE]\n\n")
+            self._end_stream()
+
+    return Handler
+
+
+def start(port=0, config=None, host="127.0.0.1"):
+    """Запуск в фоне (для loadtest.py). Возвращает (server, url)."""
+    config = config or FakeLLMConfig()
+    server = FakeLLMServer((host, port), make_handler(config))
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per answer")
+    parser.add_argument("--latency-median", type=float, default=200.0, help="ms before the first token (median)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal sigma of the first-token delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        token_rate=args.token_rate, tokens=args.tokens,
+        latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, error_status=args.error_status, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama/OpenAI server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer((args.host, args.port), make_handler(config_from_args(args)))
+    print(f"🤖 Fake LLM on http://{args.host}:{args.port} (Ollama /api/generate, OpenAI /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
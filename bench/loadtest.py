@@ -0,0 +1,340 @@
+"""
+Нагрузочный тест: поднимает заглушку LLM (bench/fake_llm.py) и приложение
+на отдельной БД, гоняет смесь login / dashboard / symptoms / history / photo
+на нескольких уровнях конкурентности и печатает p50/p95/p99 и RPS по маршрутам.
+
+    python bench/loadtest.py --concurrency 1,8,32 --duration 20
+    python bench/loadtest.py --write-baseline          # обновить bench/baseline.json
+    python bench/loadtest.py --baseline bench/baseline.json --tolerance 0.25   # для CI
+
+Код выхода 1 — есть регрессия относительно baseline.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_llm  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+DEFAULT_PHOTO = os.path.join(ROOT, "static", "uploads", "images.jpg")
+
+# Реалистичная смесь: чаще всего смотрят dashboard и историю
+DEFAULT_MIX = "dashboard=4,history=3,symptoms=2,symptoms_stream=1,photo=1,tips=1,login=1"
+
+SYMPTOMS = [
+    "I have a headache", "my throat hurts", "I can't sleep at night", "I feel tired all day",
+    "stomach ache after lunch", "my back hurts when I sit", "I have a runny nose",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# ------------------ Запуск приложения ------------------
+def start_app(port, llm_url, workdir, server, workers, provider):
+    env = dict(os.environ)
+    env.update({
+        "AI_PROVIDER": provider,
+        "OLLAMA_URL": llm_url,
+        "OPENAI_BASE_URL": f"{llm_url}/v1",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "sk-fake"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "ADMISSION_DB": os.path.join(workdir, "admission.db"),
+        # виртуальные пользователи кликают без пауз — пользовательский лимит мешал бы замеру
+        "AI_RATE_PER_MINUTE": env.get("AI_RATE_PER_MINUTE", "0"),
+        "SECRET_KEY": "bench",
+        "PORT": str(port),
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:app"]
+    elif server == "uvicorn":
+        # async-режим (asgi.py)
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--workers", str(workers),
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    log = open(os.path.join(workdir, "app.log"), "wb")
+    # схема — отдельным шагом, как release в Procfile
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "db", "upgrade"],
+                   cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"App exited with code {proc.returncode}, see {log.name}")
+        try:
+            requests.get(url + "/", timeout=1)
+            return proc, url
+        except requests.RequestException:
+            time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError("App did not start in 60s")
+
+
+# ------------------ Виртуальный пользователь ------------------
+class VirtualUser:
+    def __init__(self, base_url, photo_bytes, results, lock, rnd):
+        self.base = base_url
+        self.session = requests.Session()
+        self.photo = photo_bytes
+        self.results = results
+        self.lock = lock
+        self.random = rnd
+        name = uuid.uuid4().hex[:12]
+        self.email = f"{name}@bench.local"
+        self.password = "bench-pass"
+        self.session.post(self.base + "/register", data={
+            "username": name, "email": self.email, "password": self.password, "age": "30",
+        }, allow_redirects=False, timeout=120)
+        self.login()
+        if "session" not in self.session.cookies:
+            raise RuntimeError(f"Could not log in as {self.email}")
+
+    def record(self, route, started, ok):
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.results[route]["latencies"].append(elapsed)
+            if not ok:
+                self.results[route]["errors"] += 1
+
+    def request(self, route, method, path, ok_status=(200, 302), **kwargs):
+        started = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base + path, allow_redirects=False, timeout=120, **kwargs)
+            # редирект на /login — сессия потеряна, это тоже ошибка
+            ok = resp.status_code in ok_status and "/login" not in resp.headers.get("Location", "")
+        except requests.RequestException:
+            ok = False
+        self.record(route, started, ok)
+
+    def login(self):
+        # успешный вход — только редирект; 200 значит «Invalid credentials»
+        self.request("login", "POST", "/login", ok_status=(302,),
+                     data={"email": self.email, "password": self.password})
+
+    def dashboard(self):
+        self.request("dashboard", "GET", "/dashboard")
+
+    def history(self):
+        self.request("history", "GET", "/history")
+
+    def symptoms(self):
+        self.request("symptoms", "POST", "/symptoms", data={"symptom": self.random.choice(SYMPTOMS)})
+
+    def symptoms_stream(self):
+        # время до полного ответа: читаем SSE до конца
+        started = time.perf_counter()
+        try:
+            with self.session.post(self.base + "/symptoms/stream", stream=True, timeout=120,
+                                   data={"symptom": self.random.choice(SYMPTOMS)}) as resp:
+                for _ in resp.iter_content(chunk_size=None):
+                    pass
+                ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        self.record("symptoms_stream", started, ok)
+
+    def tips(self):
+        self.request("tips", "POST", "/tips")
+
+    def photo_upload(self):
+        self.request("photo", "POST", "/photo", files={"photo": ("bench.jpg", self.photo, "image/jpeg")})
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_level(base_url, concurrency, duration, mix, photo_bytes, seed):
+    results = defaultdict(lambda: {"latencies": [], "errors": 0})
+    lock = threading.Lock()
+    routes, weights = zip(*mix.items())
+
+    # регистрация и первый вход — до замера, иначе на высокой конкурентности
+    # весь интервал уходит на хеширование паролей
+    users = [None] * concurrency
+
+    def signup(index):
+        users[index] = VirtualUser(base_url, photo_bytes, results, lock, random.Random(seed + index))
+
+    run_threads(signup, concurrency)
+    if not all(users):
+        raise RuntimeError("Some virtual users failed to sign up, see the errors above")
+    results.clear()
+    stop_at = time.time() + duration
+
+    def worker(index):
+        user = users[index]
+        actions = {
+            "login": user.login, "dashboard": user.dashboard, "history": user.history,
+            "symptoms": user.symptoms, "symptoms_stream": user.symptoms_stream, "tips": user.tips,
+            "photo": user.photo_upload,
+        }
+        while time.time() < stop_at:
+            actions[user.random.choices(routes, weights)[0]]()
+
+    started = time.time()
+    run_threads(worker, concurrency)
+    elapsed = time.time() - started
+
+    report = {}
+    for route, data in sorted(results.items()):
+        lat = data["latencies"]
+        report[route] = {
+            "requests": len(lat),
+            "errors": data["errors"],
+            "rps": round(len(lat) / elapsed, 2),
+            "p50_ms": round(percentile(lat, 50) * 1000, 1),
+            "p95_ms": round(percentile(lat, 95) * 1000, 1),
+            "p99_ms": round(percentile(lat, 99) * 1000, 1),
+        }
+    return report
+
+
+def print_report(concurrency, report):
+    print(f"\n=== concurrency {concurrency} ===")
+    print(f"{'route':<16}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, row in report.items():
+        print(f"{route:<16}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def compare(results, baseline, tolerance, settings=None):
+    """
+    Регрессия: p95 вырос или RPS упал больше чем на tolerance.
+    Сравнивать имеет смысл только тот же прогон: другие настройки, нет уровня
+    или маршрута из baseline — тоже ошибка, а не «регрессий нет».
+    """
+    problems = []
+    for key, value in baseline.get("settings", {}).items():
+        if settings is not None and settings.get(key) != value:
+            problems.append(f"setting {key}: {settings.get(key)!r} != baseline {value!r}")
+    for level, routes in baseline.get("results", {}).items():
+        if level not in results:
+            problems.append(f"c={level}: level is in the baseline but was not run")
+            continue
+        for route, base in routes.items():
+            current = results[level].get(route)
+            if not current:
+                problems.append(f"c={level} {route}: route is in the baseline but got no requests")
+                continue
+            if base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                problems.append(f"c={level} {route}: p95 {current['p95_ms']} ms > baseline {base['p95_ms']} ms")
+            if base["rps"] and current["rps"] < base["rps"] * (1 - tolerance):
+                problems.append(f"c={level} {route}: rps {current['rps']} < baseline {base['rps']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test with a local fake LLM")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated levels")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route=weight,...")
+    parser.add_argument("--server", choices=["gunicorn", "uvicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn / uvicorn workers")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama")
+    parser.add_argument("--url", help="benchmark an already running app instead of starting one")
+    parser.add_argument("--photo", default=DEFAULT_PHOTO)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="compare against this baseline JSON")
+    parser.add_argument("--write-baseline", action="store_true", help=f"save results to {DEFAULT_BASELINE}")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    fake_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(","):
+        route, weight = part.split("=")
+        mix[route.strip()] = float(weight)
+    with open(args.photo, "rb") as fh:
+        photo_bytes = fh.read()
+
+    workdir = tempfile.mkdtemp(prefix="aika-bench-")
+    llm_server, llm_url = fake_llm.start(config=fake_llm.config_from_args(args))
+    app_proc = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            app_proc, base_url = start_app(
+                free_port(), llm_url, workdir, args.server, args.workers, args.provider
+            )
+        print(f"App: {base_url}   fake LLM: {llm_url}   workdir: {workdir}")
+
+        results = {}
+        for level in [int(x) for x in args.concurrency.split(",")]:
+            report = run_level(base_url, level, args.duration, mix, photo_bytes, args.seed or 0)
+            print_report(level, report)
+            results[str(level)] = report
+    finally:
+        if app_proc is not None:
+            app_proc.terminate()
+            app_proc.wait(timeout=15)
+        llm_server.shutdown()
+
+    settings = {
+        "duration": args.duration, "mix": args.mix, "server": args.server, "workers": args.workers,
+        "provider": args.provider, "token_rate": args.token_rate, "tokens": args.tokens,
+        "latency_median": args.latency_median, "error_rate": args.error_rate,
+    }
+    payload = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": settings,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(payload, fh, indent=2)
+    if args.write_baseline:
+        with open(DEFAULT_BASELINE, "w") as fh:
+            json.dump(payload, fh, indent=2)
+        print(f"\nBaseline written to {DEFAULT_BASELINE}")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            problems = compare(results, json.load(fh), args.tolerance, settings)
+        if problems:
+            print("\n❌ Regressions (or a run not comparable to the baseline):")
+            for line in problems:
+                print("  -", line)
+            sys.exit(1)
+        print("\n✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Стоимость холодного старта: сколько занимает `import app` (то, что платит каждый
+gunicorn-воркер при старте и перезапуске) и какие модули в этом виноваты.
+
+Запускает импорт в чистом процессе несколько раз (python -X importtime) на
+временной БД и печатает медиану времени импорта и топ модулей по суммарному времени.
+
+    python bench/startup.py
+    python bench/startup.py --provider openai --top 30
+    python bench/startup.py --module asgi                  # async-режим
+    python bench/startup.py --output startup.json          # отчёт для истории / CI
+    python bench/startup.py --baseline startup.json --tolerance 0.3   # код выхода 1 при регрессии
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# строка из -X importtime: "import time:   self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+_PROBE = (
+    "import time; _t = time.perf_counter(); import {module}; "
+    "print('IMPORT_SECONDS', time.perf_counter() - _t)"
+)
+
+
+def run_once(module, env):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    seconds = float(proc.stdout.split("IMPORT_SECONDS")[-1])
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return seconds, modules
+
+
+def profile(module, repeat, env):
+    times = []
+    per_module = defaultdict(list)
+    for _ in range(repeat):
+        seconds, modules = run_once(module, env)
+        times.append(seconds)
+        for name, values in modules.items():
+            per_module[name].append(values)
+
+    def median(name, index):
+        return statistics.median(values[index] for values in per_module[name])
+
+    # пакеты целиком (flask, sqlalchemy, openai …): время платит тот, кто импортировал первым
+    packages = {
+        name: median(name, 1) for name in per_module
+        if "." not in name and name != module
+    }
+    return {
+        "module": module,
+        "repeat": repeat,
+        "import_ms": round(statistics.median(times) * 1000, 1),
+        "import_ms_min": round(min(times) * 1000, 1),
+        "modules_loaded": len(per_module),
+        "packages": {
+            name: round(us / 1000, 1)
+            for name, us in sorted(packages.items(), key=lambda item: -item[1])
+        },
+        "self_ms": {
+            name: round(median(name, 0) / 1000, 1)
+            for name in sorted(per_module, key=lambda n: -median(n, 0))[:50]
+        },
+    }
+
+
+def print_report(report, top):
+    print(f"\nimport {report['module']}: {report['import_ms']} ms median "
+          f"(min {report['import_ms_min']} ms, {report['repeat']} runs, {report['modules_loaded']} modules)")
+    print(f"\n{'package':<32}{'cumulative ms':>14}")
+    for name, ms in list(report["packages"].items())[:top]:
+        print(f"{name:<32}{ms:>14}")
+    print(f"\n{'module (own code)':<48}{'self ms':>10}")
+    for name, ms in list(report["self_ms"].items())[:top]:
+        print(f"{name:<48}{ms:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="what to import (app or asgi)")
+    parser.add_argument("--provider", default="offline", help="AI_PROVIDER for the import")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="write the report JSON here")
+    parser.add_argument("--baseline", help="compare import time against this report JSON")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aika-startup-")
+    env = dict(os.environ)
+    env.update({
+        "AI_PROVIDER": args.provider,
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "sk-fake"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        "ADMISSION_DB": os.path.join(workdir, "admission.db"),
+        "DB_AUTO_MIGRATE": "0",
+    })
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    try:
+        report = profile(args.module, args.repeat, env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report["provider"] = args.provider
+    print_report(report, args.top)
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            base = json.load(fh)
+        limit = base["import_ms"] * (1 + args.tolerance)
+        if report["import_ms"] > limit:
+            print(f"\n❌ import {args.module}: {report['import_ms']} ms > baseline {base['import_ms']} ms "
+                  f"(+{args.tolerance:.0%})")
+            sys.exit(1)
+        print(f"\n✅ import {args.module} within {args.tolerance:.0%} of baseline ({base['import_ms']} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Удаление аккаунта и уборка: файлы фото и место в SQLite.
+
+- delete_user(): записи пользователя удаляются порциями, каждая порция — своя
+  короткая транзакция, так что SQLite не держит блокировку записи всё удаление;
+- purge_uploads(): файлы удалённых фото (оригинал и варианты) — только если на них
+  больше не ссылается ни одна запись: одинаковые фото хранятся один раз на всех;
+- collect_orphans(): периодически убирает из uploads/<ab>/ файлы без записей
+  и брошенные *.part;
+- vacuum(): отдаёт ОС освободившиеся страницы SQLite (auto_vacuum=INCREMENTAL).
+
+    flask --app app cleanup uploads --dry-run   # что удалит уборка сирот
+    flask --app app cleanup vacuum              # вернуть место сейчас
+    flask --app app cleanup vacuum --full       # один раз для старой БД: включить auto_vacuum
+"""
+import os
+import re
+import time
+
+import click
+from sqlalchemy import delete, select
+
+from models import db, User, Symptom, Photo, Tip, Advice, Job
+
+# таблицы с записями пользователя (порядок не важен — друг на друга они не ссылаются)
+USER_TABLES = (Job, Symptom, Tip, Photo)
+PHOTO_PATHS = ("filename", "thumb_path", "medium_path")
+
+# uploads/<ab>/<sha256>.<ext> и варианты <sha256>_<name>.jpg (imaging.py)
+_PREFIX_RE = re.compile(r"^[0-9a-f]{2}$")
+_CONTENT_RE = re.compile(r"^([0-9a-f]{64})(?:_[a-z]+)?\.[a-z0-9]+$")
+
+
+# ------------------ Удаление аккаунта ------------------
+def delete_user(user_id, chunk=500, pause=0.0):
+    """
+    Удаляет пользователя и всё, что ему принадлежит.
+    Возвращает (пути файлов его фото относительно uploads, {таблица: удалено строк});
+    файлы убирает фоновая задача через purge_uploads().
+    """
+    files = set()
+    removed = {}
+    for model in USER_TABLES:
+        columns = [model.id] + ([getattr(Photo, c) for c in PHOTO_PATHS] if model is Photo else [])
+        removed[model.__tablename__] = 0
+        while True:
+            rows = db.session.execute(select(*columns).where(model.user_id == user_id).limit(chunk)).all()
+            if not rows:
+                break
+            if model is Photo:
+                files.update(path for row in rows for path in row[1:] if path)
+            db.session.execute(
+                delete(model).where(model.id.in_([row[0] for row in rows])),
+                execution_options={"synchronize_session": False},
+            )
+            db.session.commit()  # порция — отдельная транзакция: другие писатели успевают между ними
+            removed[model.__tablename__] += len(rows)
+            if pause:
+                time.sleep(pause)
+    db.session.execute(delete(Advice).where(Advice.user_id == user_id))
+    # то, что успело появиться между порциями, удалит ON DELETE CASCADE
+    db.session.execute(delete(User).where(User.id == user_id), execution_options={"synchronize_session": False})
+    db.session.commit()
+    return sorted(files), removed
+
+
+# ------------------ Файлы ------------------
+def _remove(root, path):
+    """Удаляет файл внутри root; возвращает его размер или None, если удалять нечего."""
+    path = os.path.realpath(os.path.join(root, path))
+    if not path.startswith(root + os.sep):
+        return None
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return None
+    return size
+
+
+def _touched_since(root, path, cutoff) -> bool:
+    try:
+        return os.path.getmtime(os.path.join(root, path)) >= cutoff
+    except FileNotFoundError:
+        return False
+
+
+def purge_uploads(upload_dir, paths, batch=500, grace=3600) -> dict:
+    """
+    Удаляет файлы из paths, на которые больше не ссылается ни одна запись Photo.
+    Файлы моложе grace секунд не трогаем: save_upload() отдаёт уже лежащий файл
+    (и обновляет ему mtime) раньше, чем запись Photo нового владельца сохранена.
+    Если он так и остался ничьим — его уберёт collect_orphans().
+    """
+    root = os.path.realpath(upload_dir)
+    cutoff = time.time() - grace
+    removed = kept = freed = 0
+    for i in range(0, len(paths), batch):
+        part = paths[i:i + batch]
+        referenced = set()
+        for name in PHOTO_PATHS:
+            column = getattr(Photo, name)
+            referenced.update(db.session.execute(select(column).where(column.in_(part))).scalars())
+        for path in part:
+            if path in referenced or _touched_since(root, path, cutoff):
+                kept += 1  # такое же фото есть (или прямо сейчас загружается) у другого пользователя
+                continue
+            size = _remove(root, path)
+            if size is not None:
+                removed += 1
+                freed += size
+    return {"removed": removed, "kept": kept, "freed_bytes": freed}
+
+
+def _orphans(root, cutoff, batch):
+    """Файлы старше cutoff, на которые не ссылается ни одна запись (пути относительно root)."""
+    with os.scandir(root) as entries:
+        folders = []
+        for entry in entries:
+            # *.part — загрузка оборвалась до переименования (imaging.save_upload)
+            if entry.is_file() and entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+                yield entry.name
+            elif entry.is_dir() and _PREFIX_RE.match(entry.name):
+                folders.append(entry.name)
+    # файлы в корне uploads (до хранения по sha256) не трогаем: их происхождение неизвестно
+    for folder in sorted(folders):
+        with os.scandir(os.path.join(root, folder)) as entries:
+            files = [
+                (f"{folder}/{entry.name}", match.group(1))
+                for entry in entries
+                if (match := _CONTENT_RE.match(entry.name)) and entry.is_file() and entry.stat().st_mtime < cutoff
+            ]
+        for i in range(0, len(files), batch):
+            part = files[i:i + batch]
+            known = set(db.session.execute(
+                select(Photo.sha256).where(Photo.sha256.in_({sha for _, sha in part}))
+            ).scalars())
+            for path, sha in part:
+                if sha not in known:
+                    yield path
+
+
+def collect_orphans(upload_dir, grace=3600, batch=500, dry_run=False) -> dict:
+    """
+    Уборка uploads: файлы без записи Photo и брошенные *.part старше grace секунд
+    (моложе — возможно, запись о фото ещё не сохранена).
+    """
+    root = os.path.realpath(upload_dir)
+    removed = freed = 0
+    for path in _orphans(root, time.time() - grace, batch):
+        if dry_run:
+            print("orphan:", path)
+            removed += 1
+            continue
+        size = _remove(root, path)
+        if size is not None:
+            removed += 1
+            freed += size
+    return {"removed": removed, "freed_bytes": freed}
+
+
+# ------------------ SQLite ------------------
+def vacuum(engine=None, step_pages=2000, pause=0.05) -> dict:
+    """
+    Отдаёт ОС свободные страницы порциями по step_pages (каждая — короткая запись)
+    и усекает WAL. Работает, если БД в auto_vacuum=INCREMENTAL; на других СУБД — ничего.
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != "sqlite":
+        return {}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        free = before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if mode == 2:  # INCREMENTAL
+            while free:
+                # execute() в pysqlite делает один шаг — одну страницу; executescript доводит до конца
+                conn.connection.dbapi_connection.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+                left = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                if left >= free:
+                    break
+                free = left
+                time.sleep(pause)
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    return {
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(mode, mode),
+        "free_pages_before": before,
+        "released_bytes": (before - free) * page_size,
+    }
+
+
+def full_vacuum(engine=None):
+    """Переводит существующую SQLite-БД в auto_vacuum=INCREMENTAL (VACUUM блокирует БД целиком)."""
+    engine = engine or db.engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+# ------------------ CLI ------------------
+def init_app(app, upload_dir):
+    @app.cli.group("cleanup")
+    def cleanup_cli():
+        """Уборка файлов и места в базе."""
+
+    @cleanup_cli.command("uploads")
+    @click.option("--grace", type=int, default=3600, help="Не трогать файлы моложе стольких секунд.")
+    @click.option("--dry-run", is_flag=True, help="Только показать, что будет удалено.")
+    def uploads_command(grace, dry_run):
+        """Удалить файлы фото, на которые не ссылается ни одна запись."""
+        result = collect_orphans(upload_dir, grace=grace, dry_run=dry_run)
+        click.echo(f"{'Would remove' if dry_run else 'Removed'} {result['removed']} files, "
+                   f"{result['freed_bytes'] / 1024 / 1024:.1f} MB freed.")
+
+    @cleanup_cli.command("vacuum")
+    @click.option("--full", is_flag=True, help="VACUUM целиком и включить auto_vacuum (БД заблокирована на время).")
+    def vacuum_command(full):
+        """Вернуть ОС место, освободившееся после удалений."""
+        if full:
+            if db.engine.dialect.name != "sqlite":
+                raise click.ClickException("--full is only for SQLite")
+            full_vacuum()
+        result = vacuum()
+        if not result:
+            click.echo("Nothing to do: the database server reclaims space itself.")
+        elif result["auto_vacuum"] != "incremental":
+            click.echo(f"auto_vacuum={result['auto_vacuum']}: run once with --full to enable incremental vacuum.")
+        else:
+            click.echo(f"Released {result['released_bytes'] / 1024 / 1024:.1f} MB.")
@@ -0,0 +1,175 @@
+import re
+
+from models import db, Symptom, User, STATUS_DONE
+
+# Грубая оценка числа токенов без токенизатора модели: слово или знак ≈ токен,
+# длинные слова BPE режет на несколько кусков. Для бюджета промпта этого хватает.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return sum(1 + len(piece) // 8 for piece in _TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Обрезает текст по словам, чтобы оценка токенов влезла в budget."""
+    if estimate_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    for word in text.split():
+        cost = estimate_tokens(word)
+        if used + cost > budget:
+            break
+        kept.append(word)
+        used += cost
+    return " ".join(kept) + " …"
+
+
+class ChatContext:
+    """Что модель знает о разговоре: пересказ старых реплик + последние реплики целиком."""
+
+    def __init__(self, summary="", turns=()):
+        self.summary = summary or ""
+        self.turns = list(turns)    # [(текст пользователя, ответ Aika)] — от старых к новым
+
+    @property
+    def empty(self) -> bool:
+        return not self.summary and not self.turns
+
+    def render(self) -> str:
+        lines = []
+        if self.summary:
+            lines.append(f"Summary of the earlier conversation: {self.summary}")
+        if self.turns:
+            lines.append("Recent messages:")
+            for user_text, answer in self.turns:
+                lines.append(f"User: {user_text}")
+                lines.append(f"Aika: {answer}")
+        return "\n".join(lines)
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+
+class ConversationMemory:
+    """
+    Ограниченная память чата:
+    - в промпт идут последние max_turns реплик, пока влезают в бюджет max_tokens;
+    - всё, что старше, сворачивается в пересказ (User.chat_summary) фоновой задачей,
+      пересказ сам ограничен summary_tokens;
+    - пересказ обновляется, когда накопилось summarize_every несвёрнутых старых реплик.
+    Размер промпта (а с ним и время генерации) почти не растёт с длиной разговора.
+    """
+
+    def __init__(self, max_turns=6, max_tokens=700, summary_tokens=200, summarize_every=4):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize_every = summarize_every
+
+    def _turns_query(self, user_id, before_id=None):
+        query = Symptom.query.filter(
+            Symptom.user_id == user_id,
+            Symptom.status == STATUS_DONE,
+            Symptom.category.isnot(None),
+            Symptom.category != "",
+        )
+        if before_id is not None:
+            query = query.filter(Symptom.id < before_id)
+        return query
+
+    def context(self, user_id, before_id=None) -> ChatContext:
+        """Контекст для нового сообщения; before_id — реплика, на которую отвечаем (не включаем её)."""
+        if not self.max_turns:
+            return ChatContext()
+        user = db.session.get(User, user_id)
+        summary = truncate_to_tokens((user.chat_summary or "") if user else "", self.summary_tokens)
+
+        rows = (
+            self._turns_query(user_id, before_id)
+            .with_entities(Symptom.text, Symptom.category)
+            .order_by(Symptom.created_at.desc(), Symptom.id.desc())
+            .limit(self.max_turns)
+            .all()
+        )
+        # свежие реплики важнее — набираем от новых к старым, пока влезаем в бюджет
+        budget = self.max_tokens - estimate_tokens(summary)
+        turns = []
+        for user_text, answer in rows:
+            cost = estimate_tokens(user_text) + estimate_tokens(answer) + 4
+            if cost > budget:
+                break
+            turns.append((user_text, answer))
+            budget -= cost
+        turns.reverse()
+        return ChatContext(summary, turns)
+
+    # ---------- Пересказ ----------
+    def pending_summary(self, user_id, limit=None):
+        """
+        Запрос реплик старше окна последних max_turns, ещё не вошедших в пересказ (от старых к новым),
+        или None, если сворачивать нечего. limit — не больше стольких: пока провайдер недоступен, несвёрнутых реплик становится всё больше.
+        """
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        recent_ids = [
+            row.id for row in
+            self._turns_query(user_id)
+            .with_entities(Symptom.id)
+            .order_by(Symptom.created_at.desc(), Symptom.id.desc())
+            .limit(self.max_turns)
+            .all()
+        ]
+        if len(recent_ids) < self.max_turns:
+            return None
+        query = self._turns_query(user_id).filter(Symptom.id < min(recent_ids))
+        if user.chat_summary_upto:
+            query = query.filter(Symptom.id > user.chat_summary_upto)
+        return query.order_by(Symptom.id).limit(limit)
+
+    def needs_summary(self, user_id) -> bool:
+        if not self.max_turns:
+            return False
+        pending = self.pending_summary(user_id, limit=self.summarize_every)
+        return pending is not None and pending.count() >= self.summarize_every
+
+    def summary_prompt(self, user_id):
+        """(промпт для обновления пересказа, id последней сворачиваемой реплики) или (None, None)."""
+        # в строке пересказа не меньше токена — больше max_tokens реплик за проход не свернуть
+        pending = self.pending_summary(user_id, limit=self.max_tokens)
+        rows = pending.all() if pending is not None else []
+        if not rows:
+            return None, None
+        user = db.session.get(User, user_id)
+        # в один проход сворачиваем не больше, чем влезает в бюджет
+        lines, used = [], 0
+        last_id = None
+        for row in rows:
+            line = f"User: {row.text}\nAika: {row.category}"
+            cost = estimate_tokens(line)
+            if lines and used + cost > self.max_tokens:
+                break
+            lines.append(truncate_to_tokens(line, self.max_tokens))
+            used += cost
+            last_id = row.id
+        prompt = (
+            f"Current summary of a health chat: {user.chat_summary or '(empty)'}\n"
+            f"New messages:\n" + "\n".join(lines) + "\n"
+            f"Rewrite the summary so it also covers the new messages. Keep symptoms, their timing, "
+            f"medications and advice already given. Under {int(self.summary_tokens * 0.6)} words, "
+            f"plain English, third person, no greeting."
+        )
+        return prompt, last_id
+
+    def save_summary(self, user_id, summary, upto_id):
+        user = db.session.get(User, user_id)
+        if user is None:
+            return
+        # модель по системному промпту дописывает дисклеймер — в пересказе он не нужен
+        summary = summary.replace("This is not a diagnosis.", "").strip()
+        user.chat_summary = truncate_to_tokens(summary, self.summary_tokens)
+        user.chat_summary_upto = upto_id
+        db.session.commit()
@@ -0,0 +1,83 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def database_url(default_path, env=None) -> str:
+    """DATABASE_URL (sqlite / postgresql / mysql …) или SQLite-файл в instance/."""
+    env = os.environ if env is None else env
+    return env.get("DATABASE_URL") or f"sqlite:///{default_path}"
+
+
+def engine_options(url, env=None) -> dict:
+    """Параметры create_engine для SQLALCHEMY_ENGINE_OPTIONS."""
+    env = os.environ if env is None else env
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return {}
+        return {
+            # соединение берут и потоки запросов, и фоновые ИИ-задачи
+            "connect_args": {"check_same_thread": False, "timeout": _busy_timeout(env) / 1000},
+            "pool_size": int(env.get("DB_POOL_SIZE", 10)),
+            "max_overflow": int(env.get("DB_MAX_OVERFLOW", 20)),
+        }
+    return {
+        "pool_size": int(env.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(env.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": float(env.get("DB_POOL_TIMEOUT", 30)),
+        # соединение, которое сервер закрыл за время простоя, заметим до запроса
+        "pool_pre_ping": True,
+        "pool_recycle": int(env.get("DB_POOL_RECYCLE", 1800)),
+    }
+
+
+def _busy_timeout(env) -> int:
+    return int(env.get("SQLITE_BUSY_TIMEOUT_MS", 10000))
+
+
+def sqlite_pragmas(env=None) -> list:
+    """
+    PRAGMA для каждого нового соединения с SQLite:
+    - WAL: читатели не ждут писателя, писатели — читателей;
+    - synchronous=NORMAL: в WAL не теряет целостность, fsync только на checkpoint;
+    - busy_timeout: занятая БД — ждём, а не сразу «database is locked»;
+    - mmap и кэш страниц побольше — горячие индексы читаются из памяти;
+    - foreign_keys: SQLite без него не выполняет ON DELETE CASCADE;
+    - auto_vacuum=INCREMENTAL действует только для новой БД (существующую
+      переводит flask cleanup vacuum --full) — место отдаёт cleanup.vacuum().
+    """
+    env = os.environ if env is None else env
+    return [
+        # до создания первой таблицы, иначе не применится
+        "PRAGMA auto_vacuum=INCREMENTAL",
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={env.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={_busy_timeout(env)}",
+        f"PRAGMA mmap_size={int(env.get('SQLITE_MMAP_MB', 256)) * 1024 * 1024}",
+        # отрицательное значение — размер в КиБ, а не в страницах
+        f"PRAGMA cache_size=-{int(env.get('SQLITE_CACHE_MB', 64)) * 1024}",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",
+    ]
+
+
+def init_app(app, db, default_path):
+    """Настраивает БД приложения: URL, пул соединений и PRAGMA для SQLite."""
+    url = database_url(default_path)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == "sqlite":
+        pragmas = sqlite_pragmas()
+
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
@@ -0,0 +1,219 @@
+"""
+Выгрузка всей истории пользователя: профиль, симптомы, советы, анализы фото.
+
+Записи читаются порциями (yield_per; на PostgreSQL — серверный курсор) и сразу
+уходят клиенту генератором, так что память не зависит от длины истории.
+
+    GET /account/export?format=csv|json|ndjson|zip
+    flask --app app export alice@example.com --format ndjson -o alice.ndjson
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import click
+from sqlalchemy import select
+
+from models import db, User, Symptom, Photo, Tip
+
+# (раздел в JSON, тип записи, модель, колонки)
+SECTIONS = [
+    ("symptoms", "symptom", Symptom, ("id", "created_at", "status", "text", "category")),
+    ("tips", "tip", Tip, ("id", "created_at", "status", "text")),
+    ("photos", "photo", Photo, ("id", "created_at", "status", "result", "filename", "width", "height")),
+]
+PROFILE_FIELDS = (
+    "username", "email", "created_at", "age", "gender", "height", "weight",
+    "health_conditions", "allergies", "medications", "sleep_hours", "activity_level",
+    "diet_type", "smoking", "alcohol", "chat_summary",
+)
+# формат -> (mimetype, расширение файла)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "zip": ("application/zip", "zip"),
+}
+# CSV — одна таблица на все типы записей
+CSV_COLUMNS = ("type", "id", "created_at", "status", "text", "answer", "file")
+
+CHUNK_ROWS = 500          # строк из БД за раз
+BUFFER_BYTES = 64 * 1024  # отдаём клиенту кусками примерно такого размера
+
+
+# ------------------ Чтение ------------------
+def profile(user_id) -> dict:
+    user = db.session.get(User, user_id)
+    return {field: getattr(user, field) for field in PROFILE_FIELDS} if user else {}
+
+
+def iter_rows(model, columns, user_id, chunk=CHUNK_ROWS):
+    """Строки одной таблицы (старые → новые) без загрузки всех в память."""
+    statement = (
+        select(*(getattr(model, c) for c in columns))
+        .where(model.user_id == user_id)
+        .order_by(model.created_at, model.id)
+        .execution_options(yield_per=chunk, stream_results=True)
+    )
+    for row in db.session.execute(statement):
+        yield dict(zip(columns, row))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# один энкодер на все строки — json.dumps на каждый вызов создаёт новый
+_encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+
+
+def _dumps(value) -> str:
+    return _encoder.encode(value)
+
+
+def _buffered(pieces, size=BUFFER_BYTES):
+    """Склеивает мелкие строки в куски ~size, чтобы не писать в сокет по строчке."""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+# ------------------ Форматы ------------------
+def ndjson(user_id, chunk=CHUNK_ROWS):
+    yield _dumps({"type": "profile", **profile(user_id)}) + "\n"
+    for _, kind, model, columns in SECTIONS:
+        for record in iter_rows(model, columns, user_id, chunk):
+            yield _dumps({"type": kind, **record}) + "\n"
+
+
+def as_json(user_id, chunk=CHUNK_ROWS):
+    # один JSON-документ, но собираем его по кусочкам
+    yield '{"profile": ' + _dumps(profile(user_id))
+    for section, _, model, columns in SECTIONS:
+        yield f', "{section}": ['
+        for i, record in enumerate(iter_rows(model, columns, user_id, chunk)):
+            yield ("," if i else "") + _dumps(record)
+        yield "]"
+    yield "}\n"
+
+
+def as_csv(user_id, chunk=CHUNK_ROWS):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def line(*values):
+        writer.writerow(values)
+        text = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return text
+
+    yield line(*CSV_COLUMNS)
+    for field, value in profile(user_id).items():
+        yield line("profile", "", "", "", field, "" if value is None else value, "")
+    for _, kind, model, columns in SECTIONS:
+        for r in iter_rows(model, columns, user_id, chunk):
+            created = r["created_at"].isoformat() if r["created_at"] else ""
+            if kind == "symptom":
+                yield line(kind, r["id"], created, r["status"], r["text"], r["category"] or "", "")
+            elif kind == "tip":
+                yield line(kind, r["id"], created, r["status"], "", r["text"], "")
+            else:
+                yield line(kind, r["id"], created, r["status"], "", r["result"] or "", r["filename"])
+
+
+class _ZipSink:
+    """Файл «только на запись» для ZipFile: накопленное забираем генератором."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def as_zip(user_id, upload_dir, chunk=CHUNK_ROWS):
+    """history.ndjson + оригиналы фото; архив пишется потоком, без временного файла."""
+    sink = _ZipSink()
+    # ZipFile видит, что у sink нет tell(), и пишет размеры после данных (data descriptor)
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("history.ndjson", "w", force_zip64=True) as entry:
+            for piece in _buffered(ndjson(user_id, chunk)):
+                entry.write(piece.encode("utf-8"))
+                yield sink.drain()
+
+        root = os.path.realpath(upload_dir)
+        for photo in iter_rows(Photo, ("id", "created_at", "filename"), user_id, chunk):
+            path = os.path.realpath(os.path.join(root, photo["filename"]))
+            if not path.startswith(root + os.sep) or not os.path.isfile(path):
+                continue
+            info = zipfile.ZipInfo(
+                f"photos/{photo['id']}{os.path.splitext(path)[1].lower()}",
+                date_time=(photo["created_at"] or datetime.utcnow()).timetuple()[:6],
+            )
+            info.compress_type = zipfile.ZIP_STORED  # JPEG/HEIC уже сжаты
+            with open(path, "rb") as src, archive.open(info, "w") as dst:
+                while block := src.read(BUFFER_BYTES):
+                    dst.write(block)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+def stream(fmt, user_id, upload_dir=None, chunk=CHUNK_ROWS):
+    """Генератор кусков выгрузки (str для текстовых форматов, bytes для zip)."""
+    if fmt == "zip":
+        return (piece for piece in as_zip(user_id, upload_dir, chunk) if piece)
+    source = {"csv": as_csv, "json": as_json, "ndjson": ndjson}[fmt]
+    return _buffered(source(user_id, chunk))
+
+
+def filename(fmt) -> str:
+    return f"aika-history-{datetime.utcnow():%Y-%m-%d}.{FORMATS[fmt][1]}"
+
+
+# ------------------ CLI ------------------
+def init_app(app, upload_dir):
+    @app.cli.command("export")
+    @click.argument("user")
+    @click.option("--format", "fmt", type=click.Choice(sorted(FORMATS)), default="ndjson")
+    @click.option("-o", "--output", type=click.Path(dir_okay=False), default=None,
+                  help="Куда писать (по умолчанию — stdout).")
+    def export_command(user, fmt, output):
+        """Выгрузить историю пользователя USER (id, email или username)."""
+        found = User.query.filter(
+            (User.email == user.lower()) | (User.username == user) |
+            (User.id == (int(user) if user.isdigit() else -1))
+        ).first()
+        if found is None:
+            raise click.ClickException(f"User '{user}' not found")
+        binary = fmt == "zip"
+        if output is None:
+            target = click.get_binary_stream("stdout") if binary else click.get_text_stream("stdout")
+            for piece in stream(fmt, found.id, upload_dir):
+                target.write(piece)
+            target.flush()
+            return
+        with open(output, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8", "newline": ""})) as target:
+            for piece in stream(fmt, found.id, upload_dir):
+                target.write(piece)
+        click.echo(f"Exported {found.username} → {output}", err=True)
@@ -0,0 +1,371 @@
+"""
+Цепочка провайдеров: failover, hedged-запросы и circuit breaker.
+
+Провайдеры опрашиваются по порядку (AI_PROVIDERS=ollama,huggingface,openai).
+Основной не ответил за свою «обычную» задержку (перцентиль последних ответов) —
+тот же промпт параллельно уходит следующему, побеждает первый нормальный ответ.
+Ответил ошибкой — следующий запускается сразу. Всё укладывается в бюджет времени;
+не уложились — вызывающий отвечает заглушкой. Провайдер, который падает раз за разом,
+circuit breaker на время исключает из цепочки.
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import insort
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from admission import AdmissionError
+
+# ответ и кто его дал: имя провайдера, "cache", "pool" или "canned" (заглушка)
+Answer = namedtuple("Answer", "text provider")
+
+
+class OutOfBudget(Exception):
+    """Цепочка не ответила за бюджет, а вызывающему заглушка не нужна (фоновая задача — в error)."""
+
+
+# ------------------ Circuit breaker ------------------
+class CircuitBreaker:
+    """
+    closed — вызовы идут; threshold ошибок подряд — open: провайдер пропускаем
+    reset секунд; потом half-open — пропускаем один пробный вызов: удачный
+    закрывает breaker, неудачный открывает снова. Состояние своё в каждом процессе.
+    """
+
+    def __init__(self, threshold=5, reset=30.0):
+        self.threshold = threshold
+        self.reset = reset
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли вызвать провайдера сейчас (в half-open — только один пробный вызов)."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def abandon(self):
+        """Пробный вызов так и не дошёл до провайдера (нет слота) — пробу можно повторить."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+# ------------------ Задержки ------------------
+class LatencyWindow:
+    """Последние size длительностей удачных вызовов и их перцентили."""
+
+    def __init__(self, size=200):
+        self._recent = deque(maxlen=size)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            if len(self._recent) == self._recent.maxlen:
+                self._sorted.remove(self._recent[0])
+            self._recent.append(seconds)
+            insort(self._sorted, seconds)
+
+    def __len__(self):
+        return len(self._recent)
+
+    def percentile(self, p):
+        with self._lock:
+            if not self._sorted:
+                return None
+            return self._sorted[min(len(self._sorted) - 1, int(len(self._sorted) * p))]
+
+
+# ------------------ Цепочка ------------------
+class Failover:
+    """
+    budget — секунд на ответ в запросе, job_budget — в фоновой задаче;
+    hedge_percentile — после какого перцентиля задержек провайдера звать следующего
+    (пока замеров меньше min_samples — через hedge_delay секунд, не раньше hedge_min);
+    breaker_failures / breaker_reset — настройки circuit breaker.
+    Провайдеры-заглушки (offline) в цепочку не входят: их ответ — не отказ для breaker,
+    а без настоящих провайдеров цепочка пуста и вызывающий сразу отвечает заглушкой.
+    """
+
+    def __init__(self, providers, budget=30.0, job_budget=120.0, hedge=True, hedge_percentile=0.95,
+                 hedge_delay=5.0, hedge_min=0.5, min_samples=20, breaker_failures=5, breaker_reset=30.0,
+                 max_workers=32):
+        self.providers = [p for p in providers if not p.canned]
+        self.budget = budget
+        self.job_budget = job_budget
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay_default = hedge_delay
+        self.hedge_min = hedge_min
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.breakers = {p.name: CircuitBreaker(breaker_failures, breaker_reset) for p in self.providers}
+        self.latency = {p.name: LatencyWindow() for p in self.providers}
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # статистика
+        self.served = {}
+        self.hedged = 0
+        self.failed_over = 0
+        self.out_of_budget = 0
+
+    @classmethod
+    def from_env(cls, providers, env=None):
+        env = os.environ if env is None else env
+        return cls(
+            providers,
+            budget=float(env.get("AI_LATENCY_BUDGET", 30)),
+            job_budget=float(env.get("AI_JOB_LATENCY_BUDGET", 120)),
+            hedge=env.get("AI_HEDGE", "1") == "1",
+            hedge_percentile=float(env.get("AI_HEDGE_PERCENTILE", 95)) / 100,
+            hedge_delay=float(env.get("AI_HEDGE_DELAY", 5)),
+            hedge_min=float(env.get("AI_HEDGE_MIN", 0.5)),
+            breaker_failures=int(env.get("AI_BREAKER_FAILURES", 5)),
+            breaker_reset=float(env.get("AI_BREAKER_RESET", 30)),
+        )
+
+    @property
+    def primary(self):
+        return self.providers[0] if self.providers else None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # после fork потоки родителя не наследуются — создаём свой пул
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="ai-failover")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def hedge_delay(self, provider, budget) -> float:
+        """Сколько ждать provider, прежде чем звать следующего: его p95 (или default), не больше budget/2."""
+        window = self.latency[provider.name]
+        delay = window.percentile(self.hedge_percentile) if len(window) >= self.min_samples else None
+        return min(max(delay or self.hedge_delay_default, self.hedge_min), budget / 2)
+
+    def allowed(self, providers=None):
+        """Провайдеры, которых breaker пропускает, — для последовательного failover (стрим)."""
+        for provider in self._chain(providers):
+            if self.breakers[provider.name].allow():
+                yield provider
+            else:
+                metrics.AI_FAILOVER.labels(provider.name, "breaker_open").inc()
+
+    def _chain(self, providers=None):
+        return [p for p in providers or self.providers if p.name in self.breakers]
+
+    # ---------- Учёт ----------
+    def record(self, provider, seconds=None, error=None):
+        """Итог вызова провайдера: задержка удачного, ошибка — в breaker. Перегрузка (admission) — не ошибка."""
+        breaker = self.breakers[provider.name]
+        if error is None:
+            self.latency[provider.name].add(seconds)
+            breaker.success()
+        elif isinstance(error, AdmissionError):
+            breaker.abandon()
+        else:
+            was_open = breaker.state == "open"
+            breaker.failure()
+            if breaker.state == "open" and not was_open:
+                print(f"⚠️ Circuit open for {provider.name} after {breaker.failures} failures: {error!r}")
+        metrics.AI_CIRCUIT_OPEN.labels(provider.name).set(breaker.state != "closed")
+
+    def served_by(self, answer: Answer, kind="generate") -> Answer:
+        with self._lock:
+            self.served[answer.provider] = self.served.get(answer.provider, 0) + 1
+        metrics.AI_SERVED.labels(answer.provider, kind).inc()
+        return answer
+
+    def _timed(self, attempt, provider):
+        started = time.monotonic()
+        try:
+            text = attempt(provider)
+        except Exception as e:
+            self.record(provider, error=e)
+            raise
+        self.record(provider, time.monotonic() - started)
+        return text
+
+    async def _atimed(self, attempt, provider):
+        started = time.monotonic()
+        try:
+            text = await attempt(provider)
+        except Exception as e:
+            self.record(provider, error=e)
+            raise
+        self.record(provider, time.monotonic() - started)
+        return text
+
+    def _next(self, queue):
+        # breaker проверяем в момент запуска: пробный вызов half-open не «сгорает» впустую
+        while queue:
+            provider = queue.pop(0)
+            if self.breakers[provider.name].allow():
+                return provider
+            metrics.AI_FAILOVER.labels(provider.name, "breaker_open").inc()
+        return None
+
+    def _launched(self, provider, reason):
+        if reason == "hedge":
+            with self._lock:
+                self.hedged += 1
+            metrics.AI_HEDGED.labels(provider.name).inc()
+        elif reason == "error":
+            with self._lock:
+                self.failed_over += 1
+            metrics.AI_FAILOVER.labels(provider.name, "error").inc()
+
+    def _give_up(self, errors, timed_out, strict=False):
+        if timed_out:
+            with self._lock:
+                self.out_of_budget += 1
+            metrics.AI_FAILOVER.labels("", "budget").inc()
+        # все провайдеры заняты (очередь admission) — пусть маршрут отдаст «Aika is busy»
+        if errors and all(isinstance(e, AdmissionError) for e in errors):
+            raise errors[0]
+        if timed_out and strict:
+            raise OutOfBudget("AI providers did not answer within the latency budget")
+        return None
+
+    # ---------- Вызов ----------
+    def call(self, attempt, providers=None, budget=None, admitted=None, queue_wait=0.0):
+        """
+        attempt(provider) -> текст (нормальный ответ) или исключение.
+        Возвращает Answer первого нормального ответа или None, если цепочка
+        не ответила за budget секунд / все провайдеры упали.
+        admitted — threading.Event, который attempt ставит, получив слот провайдера (фоновые задачи):
+        budget тогда считается с этого момента, слот ждём до queue_wait секунд,
+        а не уложились — OutOfBudget вместо None.
+        """
+        budget = budget or self.budget
+        deadline = time.monotonic() + budget + (queue_wait if admitted is not None else 0)
+        waiting = admitted is not None
+        queue = self._chain(providers)
+        pending = {}
+        errors = []
+        reason = None
+        while True:
+            launch = queue and (not pending or reason == "hedge")
+            if launch:
+                provider = self._next(queue)
+                if provider is not None:
+                    self._launched(provider, reason if pending or errors else None)
+                    pending[self.executor.submit(self._timed, attempt, provider)] = provider
+                    next_hedge = time.monotonic() + self.hedge_delay(provider, budget)
+            if not pending:
+                return self._give_up(errors, False)
+            now = time.monotonic()
+            if waiting and admitted.is_set():
+                # слот получен — с этого момента идёт бюджет на ответ
+                waiting = False
+                deadline = min(deadline, now + budget)
+            if now >= deadline:
+                return self._give_up(errors, True, strict=admitted is not None)
+            hedging = self.hedge and queue
+            timeout = min(deadline, next_hedge) - now if hedging else deadline - now
+            if waiting:
+                timeout = min(timeout, 0.25)  # часто проверяем, не получен ли слот: от этого момента бюджет
+            done, _ = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return Answer(future.result(), provider.name)
+                except Exception as e:
+                    errors.append(e)
+            # упал последний запущенный — следующего сразу; никто не ответил за p95 — hedge
+            reason = "error" if not pending else ("hedge" if hedging and time.monotonic() >= next_hedge else None)
+
+    async def acall(self, attempt, providers=None, budget=None):
+        """call() для async-режима: attempt(provider) — корутина; проигравшие отменяются."""
+        budget = budget or self.budget
+        deadline = time.monotonic() + budget
+        queue = self._chain(providers)
+        pending = {}
+        errors = []
+        reason = None
+        try:
+            while True:
+                launch = queue and (not pending or reason == "hedge")
+                if launch:
+                    provider = self._next(queue)
+                    if provider is not None:
+                        self._launched(provider, reason if pending or errors else None)
+                        pending[asyncio.ensure_future(self._atimed(attempt, provider))] = provider
+                        next_hedge = time.monotonic() + self.hedge_delay(provider, budget)
+                if not pending:
+                    return self._give_up(errors, False)
+                now = time.monotonic()
+                if now >= deadline:
+                    return self._give_up(errors, True)
+                hedging = self.hedge and queue
+                timeout = min(deadline, next_hedge) - now if hedging else deadline - now
+                done, _ = await asyncio.wait(pending, timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return Answer(task.result(), provider.name)
+                    except Exception as e:
+                        errors.append(e)
+                reason = "error" if not pending else ("hedge" if hedging and time.monotonic() >= next_hedge else None)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # ---------- Метрики ----------
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.served.values())
+            backup = total - (self.served.get(self.primary.name, 0) if self.primary else 0)
+            return {
+                "chain": [p.name for p in self.providers],
+                "served": dict(self.served),
+                # доля ответов не от основного провайдера (включая заглушки)
+                "failover_rate": round(backup / total, 3) if total else 0.0,
+                "hedged": self.hedged,
+                "failed_over": self.failed_over,
+                "out_of_budget": self.out_of_budget,
+                "providers": {
+                    p.name: {
+                        "circuit": self.breakers[p.name].state,
+                        "trips": self.breakers[p.name].trips,
+                        "p50": _rounded(self.latency[p.name].percentile(0.5)),
+                        "p95": _rounded(self.latency[p.name].percentile(0.95)),
+                        "hedge_after": round(self.hedge_delay(p, self.budget), 3),
+                    }
+                    for p in self.providers
+                },
+            }
+
+
+def _rounded(value):
+    return round(value, 3) if value is not None else None
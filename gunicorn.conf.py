@@ -0,0 +1,27 @@
+import glob
+import os
+
+# Настройки gunicorn (подхватываются автоматически: web: gunicorn app:app)
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(server):
+    # метрики прошлого запуска не должны попасть в /metrics
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+def post_worker_init(worker):
+    # приложение уже импортировано воркером: запускаем фоновый прогрев до первого запроса
+    from app import init_worker
+    init_worker()
+
+
+def child_exit(server, worker):
+    # воркер умер — его gauge-значения больше не считаем
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,192 @@
+import os
+import io
+import time
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+# Что принимаем на загрузку
+ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif", "heic", "heif"}
+# Что браузер умеет показать сам (HEIC — нет)
+BROWSER_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif"}
+
+# Размеры вариантов (по длинной стороне)
+VARIANTS = {"thumb": 320, "medium": 1280}
+
+CHUNK_SIZE = 64 * 1024
+
+# Больше этого не декодируем вообще (12 Мп фото с телефона ≈ 12_000_000)
+MAX_DECODE_PIXELS = int(os.getenv("MAX_DECODE_PIXELS", 50_000_000))
+
+# EXIF Orientation, при которых ширина и высота меняются местами
+_ROTATED = {5, 6, 7, 8}
+
+# umask процесса: прочитать можно только заменив его — делаем это один раз при импорте, пока потоков нет
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class UnsupportedImage(ValueError):
+    """Файл не похож на поддерживаемую картинку."""
+
+
+def extension(filename: str) -> str:
+    name = secure_filename(filename or "")
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def save_upload(file, upload_dir):
+    """
+    Пишем загрузку на диск потоком, попутно считая sha256.
+    Файл ложится в uploads/<ab>/<sha256>.<ext> — одинаковые фото хранятся один раз.
+    Возвращает (sha256, путь относительно upload_dir).
+    """
+    ext = extension(file.filename)
+    if ext not in ALLOWED_EXTENSIONS:
+        raise UnsupportedImage(f"Unsupported file type: .{ext or '?'}")
+    if ext == "jpeg":
+        ext = "jpg"
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+
+        sha = digest.hexdigest()
+        rel_path = f"{sha[:2]}/{sha}.{ext}"
+        final_path = os.path.join(upload_dir, rel_path)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)  # такое фото уже есть
+            # свежий mtime: уборка сирот (cleanup.py) не тронет файл, пока запись о фото не сохранена
+            os.utime(final_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            # mkstemp создаёт файл 0600 — отдавать uploads может сервер статики под другим пользователем
+            os.chmod(tmp_path, 0o644 & ~_UMASK)
+            os.replace(tmp_path, final_path)
+        return sha, rel_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ------------------ Пул процессов для конвертации ------------------
+_pool = None
+_pool_pid = None
+
+
+def _init_worker():
+    # HEIF-открывалку регистрируем один раз на процесс пула, а не на каждый запрос
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+
+def _mp_context():
+    # fork из воркера, где уже крутятся потоки (очередь задач, прогрев, пул SQLAlchemy),
+    # копирует в ребёнка блокировки, захваченные этими потоками, — и ребёнок виснет.
+    # forkserver форкает из чистого однопоточного процесса (spawn — где его нет)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def get_pool(max_workers=2) -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, mp_context=_mp_context())
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _warm():
+    # импорт PIL и плагинов в процессе пула — заранее, а не на первом загруженном фото
+    from PIL import Image, ImageOps  # noqa: F401
+    return os.getpid()
+
+
+def warm_pool(max_workers=2):
+    """Поднимает процессы пула и прогревает в них PIL; не ждёт результата."""
+    pool = get_pool(max_workers)
+    return [pool.submit(_warm) for _ in range(max_workers)]
+
+
+def open_bounded(path, max_side):
+    """
+    Открывает картинку с ограничением по памяти:
+    - до декодирования проверяем размер по заголовку (MAX_DECODE_PIXELS);
+    - JPEG декодируем сразу в уменьшенном масштабе (draft, DCT-scaling 1/2..1/8);
+    - поворачиваем по EXIF и приводим к RGB.
+    Возвращает (картинка, (ширина, высота) оригинала с учётом поворота).
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(path)  # читает только заголовок
+    width, height = image.size
+    if width * height > MAX_DECODE_PIXELS:
+        image.close()
+        raise UnsupportedImage(f"Image is too large ({width}x{height})")
+    if image.getexif().get(0x0112) in _ROTATED:
+        width, height = height, width
+
+    if image.format == "JPEG":
+        image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image, (width, height)
+
+
+def make_variants(upload_dir, rel_path, sha):
+    """
+    Выполняется в процессе пула: конвертирует оригинал (в т.ч. HEIC) в JPEG-варианты.
+    Возвращает размеры оригинала и относительные пути вариантов.
+    """
+    from PIL import Image
+
+    folder = os.path.dirname(rel_path)
+    result = {}
+    image, (result["width"], result["height"]) = open_bounded(
+        os.path.join(upload_dir, rel_path), max(VARIANTS.values())
+    )
+    with image:
+        # от большего к меньшему: каждый вариант уменьшаем из предыдущего, а не из оригинала
+        variant = image
+        for name, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            variant = variant.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            variant_rel = f"{folder}/{sha}_{name}.jpg"
+            variant.save(os.path.join(upload_dir, variant_rel), format="JPEG", quality=85, optimize=True)
+            result[f"{name}_path"] = variant_rel
+    return result
+
+
+def prepare_for_model(upload_dir, rel_path, max_side=768, quality=80):
+    """
+    Выполняется в процессе пула: компактный JPEG для vision-модели.
+    Уменьшаем до max_side (предпочтительное разрешение провайдера) и пережимаем.
+    Возвращает (байты JPEG, {"bytes", "decode_ms", "width", "height"}).
+    """
+    from PIL import Image
+
+    started = time.perf_counter()
+    image, _ = open_bounded(os.path.join(upload_dir, rel_path), max_side)
+    with image:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        decode_ms = round((time.perf_counter() - started) * 1000, 1)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        width, height = image.size
+    payload = buffer.getvalue()
+    return payload, {"bytes": len(payload), "decode_ms": decode_ms, "width": width, "height": height}
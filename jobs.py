@@ -0,0 +1,152 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import db, Job
+
+
+class JobQueue:
+    """
+    Фоновая очередь ИИ-задач.
+    Выполняет задачи пул потоков внутри процесса, а сами задачи лежат в таблице Job —
+    после рестарта незавершённые задачи подхватываются заново.
+    """
+
+    def __init__(self, app=None, max_workers=4, lease=300):
+        self.max_workers = max_workers
+        self.lease = lease          # сколько секунд задача может висеть в running
+        self.handlers = {}
+        self.error_handlers = {}
+        self.app = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._local_pending = 0     # отправлено в пул этого процесса, но ещё не завершено
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["jobs"] = self
+
+    def handler(self, kind, on_error=None):
+        """
+        Регистрирует обработчик: fn(job) -> текст результата.
+        on_error(job) вызывается, если обработчик упал (например, пометить запись как error).
+        """
+        def decorator(fn):
+            self.handlers[kind] = fn
+            if on_error is not None:
+                self.error_handlers[kind] = on_error
+            return fn
+        return decorator
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # после fork потоки родителя не наследуются — создаём свой пул
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="ai-job")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    # ---------- Постановка ----------
+    def submit(self, kind, prompt, target_id=None, user_id=None) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for job kind '{kind}'")
+        job = Job(kind=kind, prompt=prompt, target_id=target_id, user_id=user_id, status="queued")
+        db.session.add(job)
+        db.session.commit()
+        self._dispatch(job.id)
+        return job
+
+    def _dispatch(self, job_id):
+        with self._lock:
+            self._local_pending += 1
+        self.executor.submit(self._run, job_id)
+
+    # ---------- Выполнение ----------
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                # атомарно «забираем» задачу — её может пытаться взять и другой воркер
+                claimed = Job.query.filter_by(id=job_id, status="queued").update({
+                    "status": "running",
+                    "started_at": datetime.utcnow(),
+                    "worker": os.getpid(),
+                })
+                db.session.commit()
+                if not claimed:
+                    return
+
+                job = db.session.get(Job, job_id)
+                if job is None:
+                    return  # задачу удалили вместе с аккаунтом
+                try:
+                    job.result = self.handlers[job.kind](job)
+                    job.status = "done"
+                except Exception as e:
+                    print(f"JOB {job_id} ({job.kind}) FAILED:", e)
+                    db.session.rollback()
+                    job = db.session.get(Job, job_id)
+                    if job is None:
+                        return
+                    job.status = "error"
+                    job.error = str(e)
+                    if job.kind in self.error_handlers:
+                        self.error_handlers[job.kind](job)
+                job.finished_at = datetime.utcnow()
+                try:
+                    db.session.commit()
+                except StaleDataError:
+                    # строку задачи удалили, пока выполнялся обработчик
+                    db.session.rollback()
+        finally:
+            with self._lock:
+                self._local_pending -= 1
+
+    def recover(self):
+        """
+        Подхватываем задачи после рестарта: всё, что в очереди,
+        и всё, что «зависло» в running дольше lease (процесс умер посреди задачи).
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease)
+        Job.query.filter(Job.status == "running", Job.started_at < cutoff).update(
+            {"status": "queued"}, synchronize_session=False
+        )
+        db.session.commit()
+        job_ids = [row.id for row in Job.query.filter_by(status="queued").order_by(Job.created_at).all()]
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        return len(job_ids)
+
+    # ---------- Метрики ----------
+    def stats(self) -> dict:
+        counts = dict(
+            db.session.query(Job.status, func.count(Job.id))
+            .filter(Job.status.in_(["queued", "running"]))
+            .group_by(Job.status)
+            .all()
+        )
+        # время ожидания в очереди по последним 100 стартовавшим задачам
+        recent = (
+            db.session.query(Job.created_at, Job.started_at)
+            .filter(Job.started_at.isnot(None))
+            .order_by(Job.id.desc())
+            .limit(100)
+            .all()
+        )
+        waits = [(started - created).total_seconds() for created, started in recent]
+        with self._lock:
+            local_pending = self._local_pending
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "local_pending": local_pending,
+            "max_workers": self.max_workers,
+            "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait": round(max(waits), 3) if waits else 0.0,
+        }
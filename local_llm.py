@@ -0,0 +1,180 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import metrics
+
+
+# ------------------ Микро-батчинг ------------------
+class MicroBatcher:
+    """
+    Собирает одновременные запросы в пачки и отдаёт их run_batch одним вызовом.
+
+    Первый запрос открывает окно max_wait секунд; всё, что пришло за это время
+    (но не больше max_batch), уходит вместе. run_batch(items) -> [(результат, токены)]
+    в том же порядке; каждый вызывающий получает свой результат через Future.
+    Пачки выполняются по одной в отдельном потоке — модель на CPU и так занимает все ядра.
+    """
+
+    def __init__(self, run_batch, max_batch=8, max_wait=0.02, name="batch"):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        # статистика
+        self.batches = 0
+        self.requests = 0
+        self.tokens = 0
+        self.busy_seconds = 0.0
+        self.errors = 0
+
+    def _ensure_worker(self):
+        # после fork (gunicorn --preload) поток родителя не наследуется — запускаем свой
+        with self._lock:
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        future = self.submit(item)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            # ещё в очереди — отменяем: _collect не отдаст промпт модели впустую
+            future.cancel()
+            raise
+
+    # ---------- Поток пачек ----------
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                # окно уже закрыто — забираем только то, что успело встать в очередь
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        # вызывающий уже не ждёт (таймаут) — его промпт не считаем
+        return [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                print(f"BATCH ({self.name}, {len(batch)} prompts) FAILED:", repr(e))
+                self.errors += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - started
+            tokens = sum(count for _, count in results)
+            self.batches += 1
+            self.requests += len(batch)
+            self.tokens += tokens
+            self.busy_seconds += elapsed
+            metrics.observe_batch(self.name, len(batch), tokens, elapsed)
+            for (_, future), (result, _) in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "errors": self.errors,
+            "queued": self._queue.qsize(),
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.requests / self.batches, 2) if self.batches else 0,
+            # насколько заполнены пачки: 1.0 — всегда max_batch промптов за раз
+            "utilization": round(self.requests / (self.batches * self.max_batch), 3) if self.batches else 0,
+            "tokens": self.tokens,
+            "tokens_per_sec": round(self.tokens / self.busy_seconds, 1) if self.busy_seconds else 0,
+        }
+
+
+# ------------------ Модель transformers ------------------
+class LocalModel:
+    """
+    Небольшая causal LM из transformers на CPU. Загружается один раз на процесс —
+    в фоне при старте воркера (warm_up) или на первой пачке, но не при импорте.
+    """
+
+    def __init__(self, model, system_prompt="", max_new_tokens=180, threads=None):
+        self.model_name = model
+        self.system_prompt = system_prompt
+        self.max_new_tokens = max_new_tokens
+        self.threads = threads
+        self._model = None
+        self._tokenizer = None
+        self._torch = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                self._load()
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        started = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # в пачке промпты разной длины — дополняем слева, чтобы генерация шла с конца каждого
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32)
+        model.eval()
+        self._torch, self._tokenizer, self._model = torch, tokenizer, model
+        print(f"🧠 Local model {self.model_name} loaded in {time.perf_counter() - started:.1f}s (pid {os.getpid()})")
+
+    def _format(self, prompt):
+        tokenizer = self._tokenizer
+        if getattr(tokenizer, "chat_template", None):
+            messages = [{"role": "user", "content": prompt}]
+            if self.system_prompt:
+                messages.insert(0, {"role": "system", "content": self.system_prompt})
+            return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return f"{self.system_prompt}\n\nUser: {prompt}\nAika:"
+
+    def generate_batch(self, prompts):
+        """Один padded generate на всю пачку; [(текст, число новых токенов)]."""
+        self.load()
+        tokenizer = self._tokenizer
+        inputs = tokenizer([self._format(p) for p in prompts], return_tensors="pt", padding=True)
+        with self._torch.inference_mode():
+            output = self._model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        # у каждой строки после промпта — сгенерированное, хвост добит pad до самой длинной
+        generated = output[:, inputs["input_ids"].shape[1]:]
+        results = []
+        for row in generated:
+            tokens = int((row != tokenizer.pad_token_id).sum())
+            results.append((tokenizer.decode(row, skip_special_tokens=True).strip(), tokens))
+        return results
@@ -0,0 +1,265 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Под gunicorn задайте PROMETHEUS_MULTIPROC_DIR (пустая папка) — тогда /metrics
+# собирает значения со всех воркеров (см. gunicorn.conf.py).
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120)
+
+# ------------------ HTTP ------------------
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Flask request latency (until headers are sent)",
+    ["endpoint", "method", "status"],
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size (non-streamed responses)",
+    ["endpoint"], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+
+# ------------------ SQL ------------------
+SQL_QUERIES = Histogram(
+    "sql_queries_per_request", "SQL statements executed per request",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+SQL_DURATION = Histogram(
+    "sql_query_duration_seconds", "Duration of a single SQL statement",
+    ["endpoint"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+# ------------------ ИИ ------------------
+AI_LATENCY = Histogram(
+    "ai_request_duration_seconds", "Provider call latency",
+    ["provider", "model", "kind"], buckets=LLM_BUCKETS,
+)
+AI_ERRORS = Counter("ai_errors_total", "Failed provider calls", ["provider", "model", "kind"])
+AI_TIMEOUTS = Counter("ai_timeouts_total", "Provider calls that timed out", ["provider", "model", "kind"])
+AI_FIRST_TOKEN = Histogram(
+    "ai_stream_first_token_seconds", "Time to first streamed token",
+    ["provider", "model"], buckets=LLM_BUCKETS,
+)
+AI_RESPONSE_SIZE = Histogram(
+    "ai_response_chars", "Length of generated answers in characters",
+    ["provider", "model", "kind"], buckets=(50, 100, 200, 400, 800, 1600, 3200),
+)
+
+# ------------------ Цепочка провайдеров (failover.py) ------------------
+# доля резервных ответов: sum(rate(ai_served_total{provider!="<основной>"})) / sum(rate(ai_served_total))
+AI_SERVED = Counter(
+    "ai_served_total", "Answers by the provider that served them (cache, pool, canned included)",
+    ["provider", "kind"],
+)
+AI_FAILOVER = Counter(
+    "ai_failover_total", "Provider chain fallbacks: next provider after an error, open circuit, spent budget",
+    ["provider", "reason"],
+)
+AI_HEDGED = Counter("ai_hedged_total", "Hedged calls sent while the previous provider was still running", ["provider"])
+AI_CIRCUIT_OPEN = Gauge(
+    "ai_circuit_open", "1 while the provider's circuit breaker is open or half-open",
+    ["provider"], multiprocess_mode="livemax",
+)
+
+# ------------------ Допуск к провайдеру ------------------
+ADMISSION_WAIT = Histogram(
+    "ai_admission_wait_seconds", "Time spent waiting for a provider slot",
+    ["provider"], buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+ADMISSION_REJECTED = Counter(
+    "ai_admission_rejected_total", "Requests refused by admission control", ["provider", "reason"],
+)
+
+# ------------------ Локальная модель (микро-батчи) ------------------
+LOCAL_BATCH_SIZE = Histogram(
+    "ai_local_batch_size", "Prompts per local generate() batch",
+    ["model"], buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LOCAL_BATCH_DURATION = Histogram(
+    "ai_local_batch_seconds", "Duration of one local generate() batch",
+    ["model"], buckets=LLM_BUCKETS,
+)
+# tokens/sec = rate(ai_local_generated_tokens_total) / rate(ai_local_batch_seconds_sum)
+LOCAL_TOKENS = Counter("ai_local_generated_tokens_total", "Tokens generated by the local model", ["model"])
+
+# ------------------ Пул советов ------------------
+# размер пула общий (таблица pooled_tip) — каждый воркер лишь периодически его замеряет
+TIP_POOL_SIZE = Gauge(
+    "tip_pool_size", "Ready tips in the pool", ["category"], multiprocess_mode="livemax",
+)
+TIP_POOL_OLDEST = Gauge(
+    "tip_pool_oldest_seconds", "Age of the oldest ready tip", ["category"], multiprocess_mode="livemax",
+)
+# скорость пополнения: rate(tip_pool_generated_total{outcome="added"})
+TIP_POOL_GENERATED = Counter(
+    "tip_pool_generated_total", "Tips generated for the pool", ["category", "outcome"],
+)
+TIP_POOL_SERVED = Counter(
+    "tip_pool_served_total", "Tips served by /tips: from the pool or by a live call", ["source"],
+)
+TIP_POOL_SERVED_AGE = Histogram(
+    "tip_pool_served_age_seconds", "How long a tip waited in the pool before being served",
+    buckets=(60, 600, 3600, 6 * 3600, 86400, 3 * 86400, 7 * 86400),
+)
+
+# ------------------ Кэши и склейка запросов ------------------
+# счётчики в /stats — свои в каждом воркере; общие для всех воркеров — эти
+# hit rate: rate(advice_cache_lookups_total{result="hit"}) / rate(advice_cache_lookups_total)
+ADVICE_CACHE_LOOKUPS = Counter(
+    "advice_cache_lookups_total", "Dashboard advice cache lookups (hit in memory or in the Advice table, miss)",
+    ["result"],
+)
+SYMPTOM_CACHE_LOOKUPS = Counter(
+    "symptom_cache_lookups_total", "Near-duplicate symptom cache lookups", ["result"],
+)
+AI_COALESCED = Counter(
+    "ai_coalesced_total", "Identical in-flight prompts: real calls, callers that joined one, short-cache hits",
+    ["outcome"],
+)
+
+# ------------------ Картинки ------------------
+IMAGE_PROCESSING = Histogram(
+    "image_processing_seconds", "Image pipeline step duration (HEIC conversion, variants, model payload)",
+    ["step", "format"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+
+
+def _endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "background"
+
+
+def _is_timeout(error) -> bool:
+    # requests.Timeout, httpx.TimeoutException, openai.APITimeoutError, socket.timeout …
+    return isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower()
+
+
+@contextmanager
+def track_ai(provider, model, kind="generate"):
+    """Время, ошибки и таймауты одного вызова провайдера."""
+    labels = (provider, model or "", kind)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        AI_ERRORS.labels(*labels).inc()
+        if _is_timeout(e):
+            AI_TIMEOUTS.labels(*labels).inc()
+        raise
+    finally:
+        AI_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+
+
+def track_stream(chunks, provider, model):
+    """Оборачивает стрим: время до первого токена, полное время, ошибки."""
+    labels = (provider, model or "", "stream")
+    started = time.perf_counter()
+    first = True
+    size = 0
+    try:
+        for chunk in chunks:
+            if first:
+                AI_FIRST_TOKEN.labels(provider, model or "").observe(time.perf_counter() - started)
+                first = False
+            size += len(chunk)
+            yield chunk
+    except Exception as e:
+        AI_ERRORS.labels(*labels).inc()
+        if _is_timeout(e):
+            AI_TIMEOUTS.labels(*labels).inc()
+        raise
+    finally:
+        AI_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        AI_RESPONSE_SIZE.labels(*labels).observe(size)
+
+
+async def atrack_stream(chunks, provider, model):
+    """track_stream для async-генераторов (asgi.py)."""
+    labels = (provider, model or "", "stream")
+    started = time.perf_counter()
+    first = True
+    size = 0
+    try:
+        async for chunk in chunks:
+            if first:
+                AI_FIRST_TOKEN.labels(provider, model or "").observe(time.perf_counter() - started)
+                first = False
+            size += len(chunk)
+            yield chunk
+    except Exception as e:
+        AI_ERRORS.labels(*labels).inc()
+        if _is_timeout(e):
+            AI_TIMEOUTS.labels(*labels).inc()
+        raise
+    finally:
+        AI_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        AI_RESPONSE_SIZE.labels(*labels).observe(size)
+
+
+def observe_answer(provider, model, kind, text):
+    AI_RESPONSE_SIZE.labels(provider, model or "", kind).observe(len(text or ""))
+
+
+def observe_batch(model, size, tokens, seconds):
+    LOCAL_BATCH_SIZE.labels(model).observe(size)
+    LOCAL_BATCH_DURATION.labels(model).observe(seconds)
+    LOCAL_TOKENS.labels(model).inc(tokens)
+
+
+# ------------------ SQLAlchemy ------------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("query_started")
+    if not stack:
+        return
+    started = stack.pop()
+    SQL_DURATION.labels(_endpoint()).observe(time.perf_counter() - started)
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+
+
+# ------------------ Flask ------------------
+def init_app(app):
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.sql_queries = 0
+
+    @app.after_request
+    def _record_request(response):
+        if "request_started" not in g:
+            return response
+        endpoint = _endpoint()
+        REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(
+            time.perf_counter() - g.request_started
+        )
+        if not response.is_streamed and response.content_length is not None:
+            RESPONSE_SIZE.labels(endpoint).observe(response.content_length)
+        SQL_QUERIES.labels(endpoint).observe(g.sql_queries)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        # METRICS_TOKEN задан — без него /metrics не отдаём
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(403)
+        if MULTIPROC_DIR:
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
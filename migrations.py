@@ -0,0 +1,247 @@
+"""
+Версионные миграции схемы.
+
+Каждая миграция — функция fn(conn) с номером; применённые номера хранятся
+в таблице schema_version. Применяются отдельным шагом до старта воркеров
+(release в Procfile). Если upgrade() всё же зовут несколько процессов сразу
+(DB_AUTO_MIGRATE=1), выполняет только первый: остальные ждут блокировку.
+
+    flask --app app db status     # текущая версия и что ещё не применено
+    flask --app app db upgrade    # применить (или до --to N)
+
+Новая колонка / индекс / таблица — новая функция с декоратором @migration(N, "…").
+"""
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+
+import search
+from models import db
+
+MIGRATIONS = []   # [(версия, описание, fn)] по возрастанию версии
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+# ------------------ Хелперы для миграций ------------------
+def add_column(conn, table_name, column_name):
+    """ALTER TABLE … ADD COLUMN по описанию колонки в models.py (если её ещё нет)."""
+    if column_name in {c["name"] for c in inspect(conn).get_columns(table_name)}:
+        return
+    column = db.metadata.tables[table_name].columns[column_name]
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    conn.execute(text(ddl))
+
+
+def create_index(conn, table_name, index_name):
+    for index in db.metadata.tables[table_name].indexes:
+        if index.name == index_name:
+            index.create(conn, checkfirst=True)
+            return
+    raise KeyError(f"index {index_name} is not declared on {table_name}")
+
+
+def create_table(conn, table_name):
+    """Новая таблица из models.py вместе с её индексами (если её ещё нет)."""
+    db.metadata.tables[table_name].create(conn, checkfirst=True)
+
+
+def rebuild_table(conn, table_name):
+    """
+    SQLite не меняет ограничения (FOREIGN KEY …) у существующей таблицы: создаём её
+    заново по models.py и переносим все строки. Индексы берутся из модели,
+    триггеры старой таблицы удаляются вместе с ней — поисковые восстанавливает search.create().
+    """
+    table = db.metadata.tables[table_name]
+    existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in existing)
+    old_name = f"_old_{table_name}"
+    for index in inspect(conn).get_indexes(table_name):
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+    triggers = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :t"), {"t": table_name}
+    ).scalars().all()
+    for trigger in triggers:
+        conn.execute(text(f'DROP TRIGGER "{trigger}"'))
+    conn.execute(text(f'ALTER TABLE "{table_name}" RENAME TO "{old_name}"'))
+    table.create(conn)
+    conn.execute(text(f'INSERT INTO "{table_name}" ({columns}) SELECT {columns} FROM "{old_name}"'))
+    conn.execute(text(f'DROP TABLE "{old_name}"'))
+
+
+def cascade_foreign_keys(conn, table_name, referred_table):
+    """Не-SQLite: пересоздаёт внешние ключи table_name -> referred_table с ON DELETE CASCADE."""
+    for fk in inspect(conn).get_foreign_keys(table_name):
+        if fk["referred_table"] != referred_table or (fk.get("options") or {}).get("ondelete") == "CASCADE":
+            continue
+        local = ", ".join(f'"{c}"' for c in fk["constrained_columns"])
+        remote = ", ".join(f'"{c}"' for c in fk["referred_columns"])
+        conn.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT "{fk["name"]}"'))
+        conn.execute(text(
+            f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({local}) '
+            f'REFERENCES "{referred_table}" ({remote}) ON DELETE CASCADE'
+        ))
+
+
+# ------------------ Миграции ------------------
+@migration(1, "baseline: tables, columns and indexes declared in models.py")
+def _baseline(conn):
+    # БД, созданные до версионных миграций, догоняем до моделей: недостающие
+    # таблицы, колонки (status, thumb_path, chat_summary …) и индексы
+    db.metadata.create_all(conn)
+    for table in db.metadata.sorted_tables:
+        for column in table.columns:
+            add_column(conn, table.name, column.name)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+@migration(2, "full-text search index (FTS5) over symptoms, tips and photo results")
+def _search_index(conn):
+    if not search.available(conn):
+        return  # FTS5 есть только в SQLite; на других БД поиск выключен
+    search.create(conn)
+    search.rebuild(conn)
+
+
+@migration(3, "pooled_tip: pre-generated tips served by /tips")
+def _tip_pool(conn):
+    create_table(conn, "pooled_tip")
+
+
+@migration(4, "ON DELETE CASCADE from user-owned rows to user")
+def _cascade_user_rows(conn):
+    tables = ("symptom", "photo", "tip", "advice", "job")
+    if conn.dialect.name != "sqlite":
+        for table_name in tables:
+            cascade_foreign_keys(conn, table_name, "user")
+        return
+    for table_name in tables:
+        # строки уже удалённых пользователей (старый delete_account их оставлял) не переносим;
+        # удаляем до пересоздания, пока триггеры ещё чистят поисковый индекс
+        conn.execute(text(
+            f'DELETE FROM "{table_name}" WHERE user_id IS NOT NULL AND user_id NOT IN (SELECT id FROM "user")'
+        ))
+        rebuild_table(conn, table_name)
+    if search.available(conn) and inspect(conn).has_table("search_index"):
+        search.create(conn)
+
+
+@migration(5, "provider column: which provider of the chain served each answer")
+def _answer_provider(conn):
+    for table_name in ("symptom", "photo", "tip"):
+        add_column(conn, table_name, "provider")
+
+
+@migration(6, "symptom.context_free: answers safe to share through the near-duplicate cache")
+def _symptom_context_free(conn):
+    # у старых ответов не узнать, была ли у модели предыстория — в кэш они не попадут
+    add_column(conn, "symptom", "context_free")
+
+
+# ------------------ Применение ------------------
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " description VARCHAR(200) NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def _lock(conn):
+    """Одна миграция на всю БД: остальные воркеры ждут здесь."""
+    if conn.dialect.name == "sqlite":
+        # сразу берём блокировку на запись: два воркера не создадут одну таблицу дважды
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(8217001)"))
+
+
+def applied_versions(conn) -> set:
+    _ensure_version_table(conn)
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+
+
+def pending(conn):
+    done = applied_versions(conn)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def missing(engine=None) -> list:
+    """Неприменённые миграции — только чтение, для проверки при старте воркера."""
+    engine = engine or db.engine
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return list(MIGRATIONS)
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def upgrade(engine=None, target=None, verbose=False) -> list:
+    """Применяет недостающие миграции (до target включительно); список применённых версий."""
+    engine = engine or db.engine
+    applied = []
+    if engine.dialect.name == "sqlite":
+        # pysqlite сам не открывает транзакцию перед DDL — управляем ей вручную
+        conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    else:
+        conn = engine.connect()
+    with conn:
+        _lock(conn)
+        try:
+            for version, description, fn in pending(conn):
+                if target is not None and version > target:
+                    break
+                if verbose:
+                    print(f"🛠 Migration {version}: {description}")
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": version, "d": description, "t": datetime.utcnow()},
+                )
+                applied.append(version)
+        except BaseException:
+            if engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("ROLLBACK")
+            else:
+                conn.rollback()
+            raise
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("COMMIT")
+        else:
+            conn.commit()
+    return applied
+
+
+# ------------------ CLI ------------------
+def init_app(app):
+    @app.cli.group("db")
+    def db_cli():
+        """Схема базы данных."""
+
+    @db_cli.command("upgrade")
+    @click.option("--to", "target", type=int, default=None, help="Остановиться на этой версии.")
+    def upgrade_command(target):
+        """Применить недостающие миграции."""
+        applied = upgrade(target=target, verbose=True)
+        click.echo(f"Applied: {', '.join(map(str, applied))}" if applied else "Schema is up to date.")
+
+    @db_cli.command("status")
+    def status_command():
+        """Текущая версия схемы и неприменённые миграции."""
+        with db.engine.connect() as conn:
+            done = applied_versions(conn)
+            conn.commit()
+        click.echo(f"Database: {db.engine.url.render_as_string(hide_password=True)}")
+        for version, description, _ in MIGRATIONS:
+            click.echo(f"  [{'x' if version in done else ' '}] {version:>3}  {description}")
@@ -4,6 +4,11 @@ from flask_login import UserMixin
 
 db = SQLAlchemy()
 
+# Статусы записей, ответ для которых генерирует фоновая задача
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
 # -------------------------------
 #  Пользователь с медпрофилем
 # -------------------------------
@@ -32,10 +37,15 @@ class User(db.Model, UserMixin):
     smoking = db.Column(db.Boolean, default=False)
     alcohol = db.Column(db.Boolean, default=False)
 
+    # --- Память чата (conversation.py) ---
+    chat_summary = db.Column(db.Text, nullable=True)           # сжатый пересказ старых реплик
+    chat_summary_upto = db.Column(db.Integer, nullable=True)   # id последней реплики в пересказе
+
     # Связи
-    symptoms = db.relationship("Symptom", backref="user", lazy=True)
-    photos = db.relationship("Photo", backref="user", lazy=True)
-    tips = db.relationship("Tip", backref="user", lazy=True)
+    # записи удаляет сама БД (ON DELETE CASCADE) — ORM их не подгружает ради удаления
+    symptoms = db.relationship("Symptom", backref="user", lazy=True, cascade="all, delete-orphan", passive_deletes=True)
+    photos = db.relationship("Photo", backref="user", lazy=True, cascade="all, delete-orphan", passive_deletes=True)
+    tips = db.relationship("Tip", backref="user", lazy=True, cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -46,11 +56,18 @@ class User(db.Model, UserMixin):
 # -------------------------------
 class Symptom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=True)
     text = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(255))
+    status = db.Column(db.String(10), default=STATUS_DONE, server_default=STATUS_DONE)
+    provider = db.Column(db.String(30))   # кто ответил: ollama / openai … / cache / canned (failover.py)
+    # ответ сгенерирован без памяти чата — только такие годятся для общего кэша похожих жалоб
+    context_free = db.Column(db.Boolean, default=False, server_default="0")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # лента пользователя: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (db.Index("ix_symptom_user_created", "user_id", "created_at", "id"),)
+
     def __repr__(self):
         return f"<Symptom {self.text[:20]}>"
 
@@ -60,11 +77,21 @@ class Symptom(db.Model):
 # -------------------------------
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
-    filename = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)  # оригинал: uploads/<ab>/<sha256>.<ext>
     result = db.Column(db.Text)
+    sha256 = db.Column(db.String(64), index=True)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    thumb_path = db.Column(db.String(255))    # JPEG 320px — для истории
+    medium_path = db.Column(db.String(255))   # JPEG 1280px — для страницы скана
+    status = db.Column(db.String(10), default=STATUS_DONE, server_default=STATUS_DONE)
+    provider = db.Column(db.String(30))   # кто ответил (failover.py)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # лента пользователя: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (db.Index("ix_photo_user_created", "user_id", "created_at", "id"),)
+
     def __repr__(self):
         return f"<Photo {self.filename}>"
 
@@ -74,11 +101,71 @@ class Photo(db.Model):
 # -------------------------------
 class Tip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=True)
     text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), default=STATUS_DONE, server_default=STATUS_DONE)
+    provider = db.Column(db.String(30))   # кто ответил; "pool" — готовый совет из пула
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # лента пользователя: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (db.Index("ix_tip_user_created", "user_id", "created_at", "id"),)
+
     def __repr__(self):
         return f"<Tip {self.text[:30]}>"
 
 
+# -------------------------------
+#  Пул готовых советов для /tips (tip_pool.py)
+# -------------------------------
+class PooledTip(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(20), nullable=False)       # nutrition / sleep / activity
+    text = db.Column(db.Text, nullable=False)
+    fingerprint = db.Column(db.String(40), unique=True, nullable=False)  # sha1 нормализованного текста
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    served_at = db.Column(db.DateTime, nullable=True)          # выдан пользователю (строка — для дедупликации)
+
+    # выдача: WHERE served_at IS NULL AND category = ? ORDER BY created_at
+    __table_args__ = (db.Index("ix_pooled_tip_ready", "served_at", "category", "created_at"),)
+
+    def __repr__(self):
+        return f"<PooledTip {self.category} {self.text[:30]}>"
+
+
+# -------------------------------
+#  Кэш персонального совета (dashboard)
+# -------------------------------
+class Advice(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 полей профиля
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Advice user={self.user_id}>"
+
+
+# -------------------------------
+#  Фоновые ИИ-задачи (очередь в jobs.py)
+# -------------------------------
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)        # symptom / photo / tip
+    target_id = db.Column(db.Integer, nullable=True)       # id записи, которую заполняем
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=True)
+    prompt = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), default="queued")    # queued / running / done / error
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    worker = db.Column(db.Integer)                         # pid процесса, который взял задачу
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_job_status_created", "status", "created_at"),
+        db.Index("ix_job_kind_target", "kind", "target_id"),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
@@ -0,0 +1,83 @@
+import base64
+from datetime import datetime
+from heapq import merge
+
+from sqlalchemy import and_, or_
+
+
+# Курсор = позиция последней показанной записи: (created_at, kind, id).
+# Порядок ленты: created_at ↓, kind ↓, id ↓ — kind нужен, чтобы записи разных
+# таблиц с одинаковым временем имели однозначный порядок.
+def encode_cursor(created_at: datetime, kind: str, item_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{kind}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Невалидный / пустой курсор = первая страница (None)."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, kind, item_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), kind, int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _older_than(model, kind, cursor):
+    """WHERE для keyset: всё, что в ленте идёт строго после курсора."""
+    created_at, cursor_kind, cursor_id = cursor
+    if kind < cursor_kind:
+        return model.created_at <= created_at
+    if kind > cursor_kind:
+        return model.created_at < created_at
+    return or_(
+        model.created_at < created_at,
+        and_(model.created_at == created_at, model.id < cursor_id),
+    )
+
+
+def keyset_page(model, kind, user_id, limit, cursor=None):
+    """
+    limit + 1 записей пользователя (новые → старые) после курсора.
+    Идёт по индексу (user_id, created_at, id), без OFFSET и без чужих записей.
+    """
+    query = model.query.filter(model.user_id == user_id)
+    if cursor is not None:
+        query = query.filter(_older_than(model, kind, cursor))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+
+
+def latest_page(model, kind, user_id, limit, cursor=None):
+    """Одна страница одной таблицы: (записи новые → старые, курсор на следующую или None)."""
+    rows = keyset_page(model, kind, user_id, limit, cursor)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, kind, rows[-1].id)
+    return rows, next_cursor
+
+
+def merged_feed(sources, user_id, limit, cursor=None):
+    """
+    Общая лента из нескольких таблиц: sources = {kind: model}.
+    Из каждой таблицы берём максимум limit + 1 строк и сливаем их по времени.
+    Возвращает ([(kind, row), ...], курсор на следующую страницу или None).
+    """
+    streams = [
+        [(kind, row) for row in keyset_page(model, kind, user_id, limit, cursor)]
+        for kind, model in sources.items()
+    ]
+    feed = list(merge(
+        *streams,
+        key=lambda item: (item[1].created_at, item[0], item[1].id),
+        reverse=True,
+    ))[:limit + 1]
+
+    next_cursor = None
+    if len(feed) > limit:
+        feed = feed[:limit]
+        kind, row = feed[-1]
+        next_cursor = encode_cursor(row.created_at, kind, row.id)
+    return feed, next_cursor
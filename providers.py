@@ -0,0 +1,609 @@
+import os
+import json
+import base64
+import random
+import time
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ------------------ Общие настройки ------------------
+SYSTEM_PROMPT = (
+    "You are Aika — a friendly health assistant. "
+    "Always reply ONLY in English, never in any other language. "
+    "Be concise and kind. End every response with: 'This is not a diagnosis.'"
+)
+
+# Заглушки, когда провайдер недоступен
+FALLBACK_REPLIES = [
+    "Try to rest and drink some water 💧 (This is not a diagnosis.)",
+    "If you feel worse, contact a doctor ⚕️ (This is not a diagnosis.)",
+    "Monitor your symptoms 🙏 (This is not a diagnosis.)"
+]
+
+# Ретраим только «подождите» от сервера — остальные ошибки сразу наверх
+RETRY_STATUSES = (429, 503)
+
+
+class ProviderError(Exception):
+    """Провайдер ответил ошибкой; текст исключения можно показать пользователю."""
+
+
+def _env_float(env, name, default):
+    value = env.get(name)
+    return float(value) if value else default
+
+
+def _timeouts(env, prefix):
+    """(connect, read) — свои для каждого провайдера, с общими значениями по умолчанию."""
+    connect = _env_float(env, f"{prefix}_CONNECT_TIMEOUT", _env_float(env, "AI_CONNECT_TIMEOUT", 3.05))
+    read = _env_float(env, f"{prefix}_READ_TIMEOUT", _env_float(env, "AI_READ_TIMEOUT", 90))
+    return connect, read
+
+
+def _backoff_delay(attempt, backoff, retry_after=None):
+    """Экспоненциальная пауза с джиттером; Retry-After от сервера имеет приоритет."""
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def with_retries(call, retries=2, backoff=0.5):
+    """
+    Вызывает call() и повторяет только на 429/503.
+    Работает и с requests.Response (status_code), и с исключениями SDK (e.status_code).
+    """
+    for attempt in range(retries + 1):
+        try:
+            result = call()
+        except Exception as e:
+            if getattr(e, "status_code", None) not in RETRY_STATUSES or attempt == retries:
+                raise
+            retry_after = None
+        else:
+            if getattr(result, "status_code", None) not in RETRY_STATUSES or attempt == retries:
+                return result
+            retry_after = result.headers.get("Retry-After")
+            result.close()
+        time.sleep(_backoff_delay(attempt, backoff, retry_after))
+
+
+async def awith_retries(call, retries=2, backoff=0.5):
+    """То же, что with_retries, для корутин (httpx.AsyncClient, AsyncOpenAI)."""
+    for attempt in range(retries + 1):
+        try:
+            result = await call()
+        except Exception as e:
+            if getattr(e, "status_code", None) not in RETRY_STATUSES or attempt == retries:
+                raise
+            retry_after = None
+        else:
+            if getattr(result, "status_code", None) not in RETRY_STATUSES or attempt == retries:
+                return result
+            retry_after = result.headers.get("Retry-After")
+            await result.aclose()
+        await asyncio.sleep(_backoff_delay(attempt, backoff, retry_after))
+
+
+# ------------------ Базовый провайдер ------------------
+class Provider:
+    """
+    Интерфейс провайдера: generate() — ответ целиком, stream() — кусками,
+    analyze_image() — ответ по картинке (если провайдер умеет vision).
+    """
+
+    name = "base"
+    env_prefix = "AI"   # префикс своих переменных окружения: OLLAMA_READ_TIMEOUT, OLLAMA_MAX_INFLIGHT …
+    model = None
+    supports_vision = False
+    canned = False      # отвечает только заглушками — в цепочку failover не входит
+    vision_size = 768   # до какой стороны уменьшать фото перед отправкой
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def analyze_image(self, prompt: str, image: bytes) -> str:
+        # без vision — только текстовый промпт
+        return self.generate(prompt)
+
+    def stream(self, prompt: str):
+        # по умолчанию стрима нет — отдаём ответ одним куском
+        yield self.generate(prompt)
+
+    # ---- async-режим (asgi.py) ----
+    async def agenerate(self, prompt: str) -> str:
+        # провайдеры без async-клиента — в пуле потоков, чтобы не блокировать цикл событий
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def astream(self, prompt: str):
+        yield await self.agenerate(prompt)
+
+    async def aclose(self):
+        """Закрыть async-клиенты (при остановке ASGI-воркера)."""
+
+    def warm_up(self):
+        """Подготовка в фоне при старте воркера (импорт SDK, пулы), чтобы первый запрос не ждал."""
+
+    def stats(self):
+        """Статистика провайдера для /stats (None — нечего показать)."""
+        return None
+
+    @classmethod
+    def from_env(cls, env):
+        """Провайдер из переменных окружения или None, если он не настроен."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{type(self).__name__} model={self.model}>"
+
+
+class HTTPProvider(Provider):
+    """Провайдер поверх requests: один пул keep-alive соединений на воркер."""
+
+    def __init__(self, timeout=(3.05, 90), retries=2, backoff=0.5, pool_size=10, async_pool_size=200):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.async_pool_size = async_pool_size
+        self._session = None
+        self._session_pid = None
+        self._aclient = None
+        self._aclient_loop = None
+
+    @property
+    def session(self) -> requests.Session:
+        # после fork (gunicorn --preload) каждому процессу нужен свой пул
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def post(self, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return with_retries(lambda: self.session.post(url, **kwargs), self.retries, self.backoff)
+
+    @property
+    def aclient(self):
+        """
+        httpx.AsyncClient для async-режима: один пул на цикл событий воркера.
+        Ожидающий ответа запрос держит только сокет, а не поток — их могут быть сотни.
+        """
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(
+                    max_connections=self.async_pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def apost(self, url, stream=False, **kwargs):
+        """POST через aclient; stream=True — тело читаем сами (и закрываем через aclose())."""
+        client = self.aclient
+        return await awith_retries(
+            lambda: client.send(client.build_request("POST", url, **kwargs), stream=stream),
+            self.retries, self.backoff,
+        )
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+
+def _http_options(env, prefix):
+    return dict(
+        timeout=_timeouts(env, prefix),
+        retries=int(env.get("AI_RETRIES", 2)),
+        backoff=_env_float(env, "AI_BACKOFF", 0.5),
+        pool_size=int(env.get("AI_POOL_SIZE", 10)),
+        async_pool_size=int(env.get("AI_ASYNC_POOL_SIZE", 200)),
+    )
+
+
+# ------------------ OpenAI ------------------
+class OpenAIProvider(Provider):
+    name = "openai"
+    env_prefix = "OPENAI"
+    supports_vision = True
+    vision_size = 512   # detail=low: модель всё равно смотрит на 512x512
+
+    def __init__(self, api_key, model="gpt-4o-mini", timeout=(3.05, 90), retries=2, backoff=0.5):
+        self.model = model
+        self.retries = retries
+        self.backoff = backoff
+        self.api_key = api_key
+        self.timeout = timeout
+        self._client = None
+        self._client_pid = None
+        self._aclient = None
+        self._aclient_loop = None
+
+    @property
+    def client(self):
+        # SDK (сотни миллисекунд импорта) грузим при первом вызове или в warm_up(), а не при импорте app
+        if self._client is None or self._client_pid != os.getpid():
+            import httpx
+            from openai import OpenAI
+
+            # у клиента свой httpx-пул; ретраи SDK выключены — ретраим сами только 429/503
+            self._client = OpenAI(
+                api_key=self.api_key,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                max_retries=0,
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    def warm_up(self):
+        self.client  # импорт SDK и создание клиента
+
+    @classmethod
+    def from_env(cls, env):
+        if not env.get("OPENAI_API_KEY"):
+            return None
+        return cls(
+            env["OPENAI_API_KEY"],
+            model=env.get("OPENAI_MODEL", "gpt-4o-mini"),
+            timeout=_timeouts(env, "OPENAI"),
+            retries=int(env.get("AI_RETRIES", 2)),
+            backoff=_env_float(env, "AI_BACKOFF", 0.5),
+        )
+
+    def _create(self, content, **kwargs):
+        return with_retries(lambda: self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            **kwargs
+        ), self.retries, self.backoff)
+
+    def generate(self, prompt: str) -> str:
+        completion = self._create(prompt)
+        return completion.choices[0].message.content.strip()
+
+    def stream(self, prompt: str):
+        for event in self._create(prompt, stream=True):
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    def analyze_image(self, prompt: str, image: bytes) -> str:
+        data_url = "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+        completion = self._create([
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": data_url, "detail": "low"}},
+        ])
+        return completion.choices[0].message.content.strip()
+
+    # ---- async ----
+    @property
+    def aclient(self):
+        import httpx
+        from openai import AsyncOpenAI
+
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = AsyncOpenAI(
+                api_key=self.api_key,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                max_retries=0,
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def _acreate(self, content, **kwargs):
+        client = self.aclient
+        return await awith_retries(lambda: client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            **kwargs
+        ), self.retries, self.backoff)
+
+    async def agenerate(self, prompt: str) -> str:
+        completion = await self._acreate(prompt)
+        return completion.choices[0].message.content.strip()
+
+    async def astream(self, prompt: str):
+        async for event in await self._acreate(prompt, stream=True):
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.close()
+            self._aclient = None
+
+
+# ------------------ HuggingFace ------------------
+class HuggingFaceProvider(HTTPProvider):
+    name = "huggingface"
+    env_prefix = "HF"
+
+    def __init__(self, api_key, model="HuggingFaceTB/SmolLM3-3B", **options):
+        super().__init__(**options)
+        self.api_key = api_key
+        self.model = model
+        self.url = f"https://api-inference.huggingface.co/models/{model}"
+
+    @classmethod
+    def from_env(cls, env):
+        if not env.get("HF_API_KEY"):
+            return None
+        return cls(
+            env["HF_API_KEY"],
+            model=env.get("HF_MODEL", "HuggingFaceTB/SmolLM3-3B"),
+            **_http_options(env, "HF")
+        )
+
+    def _request(self, prompt):
+        # многие модели HF не имеют Chat API — используем text generation endpoint
+        return dict(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={
+                "inputs": f"Reply only in English. {prompt}",
+                "parameters": {"max_new_tokens": 180}
+            },
+        )
+
+    def generate(self, prompt: str) -> str:
+        return self._parse(self.post(self.url, **self._request(prompt)))
+
+    async def agenerate(self, prompt: str) -> str:
+        return self._parse(await self.apost(self.url, **self._request(prompt)))
+
+    @staticmethod
+    def _parse(resp) -> str:
+        # resp — requests.Response или httpx.Response: нужные атрибуты у них одинаковые
+        if resp.status_code != 200:
+            raise ProviderError(f"⚠️ HuggingFace API error {resp.status_code}: {resp.text}")
+        try:
+            data = resp.json()
+        except Exception as e:
+            print("HF JSON PARSE ERROR:", e)
+            raise ProviderError("⚠️ Error parsing HuggingFace response. This is not a diagnosis.")
+        # Формат HF бывает разный
+        if isinstance(data, list) and data and "generated_text" in data[0]:
+            return data[0]["generated_text"].strip()
+        if isinstance(data, dict) and "generated_text" in data:
+            return data["generated_text"].strip()
+        # Если пришёл другой формат — возвращаем строку как есть
+        return str(data)
+
+
+# ------------------ Ollama (локально) ------------------
+class OllamaProvider(HTTPProvider):
+    name = "ollama"
+    env_prefix = "OLLAMA"
+
+    vision_size = 672   # llava-1.6 режет картинку на тайлы 336px
+
+    def __init__(self, model="mistral", url="http://127.0.0.1:11434", vision_model=None, **options):
+        super().__init__(**options)
+        self.model = model
+        self.url = url.rstrip("/")
+        # мультимодальная модель (например llava) — для анализа фото
+        self.vision_model = vision_model
+        self.supports_vision = bool(vision_model)
+
+    @classmethod
+    def from_env(cls, env):
+        return cls(
+            model=env.get("OLLAMA_MODEL", "mistral"),
+            url=env.get("OLLAMA_URL", "http://127.0.0.1:11434"),
+            vision_model=env.get("OLLAMA_VISION_MODEL") or None,
+            **_http_options(env, "OLLAMA")
+        )
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt)).strip()
+
+    def analyze_image(self, prompt: str, image: bytes) -> str:
+        if not self.vision_model:
+            return self.generate(prompt)
+        images = [base64.b64encode(image).decode("ascii")]
+        return "".join(self.stream(prompt, model=self.vision_model, images=images)).strip()
+
+    def stream(self, prompt: str, model=None, images=None):
+        # Принудительно просим английский
+        payload = {"model": model or self.model, "prompt": f"Reply only in English. {prompt}"}
+        if images:
+            payload["images"] = images
+        resp = self.post(
+            f"{self.url}/api/generate",
+            json=payload,
+            stream=True  # читаем стримом
+        )
+        with resp:
+            if resp.status_code != 200:
+                raise ProviderError(f"⚠️ Ollama error {resp.status_code}: {resp.text}")
+            sent = False
+            for chunk in _ollama_chunks(resp):
+                sent = True
+                yield chunk
+        if not sent:
+            raise ProviderError("⚠️ Empty response from Ollama. This is not a diagnosis.")
+
+    async def agenerate(self, prompt: str) -> str:
+        return "".join([chunk async for chunk in self.astream(prompt)]).strip()
+
+    async def astream(self, prompt: str, model=None, images=None):
+        payload = {"model": model or self.model, "prompt": f"Reply only in English. {prompt}"}
+        if images:
+            payload["images"] = images
+        resp = await self.apost(f"{self.url}/api/generate", json=payload, stream=True)
+        try:
+            if resp.status_code != 200:
+                await resp.aread()
+                raise ProviderError(f"⚠️ Ollama error {resp.status_code}: {resp.text}")
+            sent = False
+            async for line in resp.aiter_lines():
+                chunk, done = _ollama_line(line)
+                if chunk:
+                    sent = True
+                    yield chunk
+                if done:
+                    break
+        finally:
+            await resp.aclose()
+        if not sent:
+            raise ProviderError("⚠️ Empty response from Ollama. This is not a diagnosis.")
+
+
+def _ollama_line(line):
+    """Одна строка NDJSON Ollama -> (кусок текста, done)."""
+    if not line:
+        return "", False
+    try:
+        obj = json.loads(line)
+    except Exception as e:
+        print("Ollama stream JSON parse error:", e)
+        return "", False
+    return obj.get("response", ""), bool(obj.get("done"))
+
+
+def _ollama_chunks(resp):
+    """Разбираем NDJSON-стрим Ollama /api/generate на куски текста."""
+    for line in resp.iter_lines():
+        chunk, done = _ollama_line(line.decode("utf-8"))
+        if chunk:
+            yield chunk
+        if done:
+            break
+
+
+# ------------------ Локальная модель (transformers, в процессе) ------------------
+class LocalProvider(Provider):
+    """
+    Небольшая модель из transformers прямо в воркере, без отдельного демона.
+    Одновременные промпты склеиваются в пачки (local_llm.MicroBatcher) —
+    на CPU один generate на 8 промптов почти так же быстр, как на один.
+    """
+
+    name = "local"
+    env_prefix = "LOCAL"
+
+    def __init__(self, model="HuggingFaceTB/SmolLM2-360M-Instruct", max_batch=8, batch_wait=0.02,
+                 max_new_tokens=180, threads=None, timeout=(3.05, 90)):
+        # torch/transformers подгружаются только если выбран этот провайдер
+        from local_llm import LocalModel, MicroBatcher
+
+        self.model = model
+        self.timeout = timeout
+        self.engine = LocalModel(model, SYSTEM_PROMPT, max_new_tokens=max_new_tokens, threads=threads)
+        self.batcher = MicroBatcher(
+            self.engine.generate_batch, max_batch=max_batch, max_wait=batch_wait, name=model
+        )
+
+    @classmethod
+    def from_env(cls, env):
+        import importlib.util
+
+        if importlib.util.find_spec("transformers") is None or importlib.util.find_spec("torch") is None:
+            print("⚠️ AI_PROVIDER=local needs transformers and torch installed")
+            return None
+        return cls(
+            model=env.get("LOCAL_MODEL") or env.get("HF_MODEL") or "HuggingFaceTB/SmolLM2-360M-Instruct",
+            max_batch=int(env.get("LOCAL_MAX_BATCH", 8)),
+            batch_wait=_env_float(env, "LOCAL_BATCH_WAIT_MS", 20) / 1000,
+            max_new_tokens=int(env.get("LOCAL_MAX_NEW_TOKENS", 180)),
+            threads=int(env["LOCAL_THREADS"]) if env.get("LOCAL_THREADS") else None,
+            timeout=_timeouts(env, "LOCAL"),
+        )
+
+    def generate(self, prompt: str) -> str:
+        # ждём свою часть пачки; read-таймаут — на очередь и генерацию вместе
+        return self.batcher(prompt, timeout=self.timeout[1])
+
+    async def agenerate(self, prompt: str) -> str:
+        # поток батчера генерирует, корутина просто ждёт Future
+        return await asyncio.wait_for(asyncio.wrap_future(self.batcher.submit(prompt)), self.timeout[1])
+
+    def warm_up(self):
+        # модель грузится секунды — лучше до первого запроса, чем во время него
+        self.engine.load()
+
+    def stats(self) -> dict:
+        return self.batcher.stats()
+
+
+# ------------------ Нет провайдера / ключа ------------------
+class OfflineProvider(Provider):
+    name = "offline"
+    env_prefix = "OFFLINE"
+    canned = True
+
+    @classmethod
+    def from_env(cls, env):
+        return cls()
+
+    def generate(self, prompt: str) -> str:
+        return random.choice(FALLBACK_REPLIES)
+
+    async def agenerate(self, prompt: str) -> str:
+        return self.generate(prompt)
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "huggingface": HuggingFaceProvider,
+    "ollama": OllamaProvider,
+    "local": LocalProvider,
+    "offline": OfflineProvider,
+}
+
+
+def load_provider(env=None) -> Provider:
+    """Выбираем провайдера один раз при старте по AI_PROVIDER (openai | huggingface | ollama | local)."""
+    env = os.environ if env is None else env
+    name = env.get("AI_PROVIDER", "openai")
+    provider_cls = PROVIDERS.get(name)
+    provider = provider_cls.from_env(env) if provider_cls else None
+    if provider is None:
+        print(f"⚠️ AI provider '{name}' is not configured — using offline replies")
+        provider = OfflineProvider()
+    return provider
+
+
+def load_providers(env=None) -> list:
+    """
+    Цепочка провайдеров по AI_PROVIDERS (через запятую, первый — основной),
+    без AI_PROVIDERS — один AI_PROVIDER. Ненастроенные пропускаем;
+    не осталось ни одного — offline-заглушки.
+    """
+    env = os.environ if env is None else env
+    names = [n.strip() for n in env.get("AI_PROVIDERS", "").split(",") if n.strip()]
+    if not names:
+        return [load_provider(env)]
+    chain = []
+    for name in dict.fromkeys(names):
+        provider_cls = PROVIDERS.get(name)
+        provider = provider_cls.from_env(env) if provider_cls and name != "offline" else None
+        if provider is None:
+            # offline в цепочке не нужен: заглушка и так последний запасной вариант
+            if name != "offline":
+                print(f"⚠️ AI provider '{name}' is not configured — skipped in AI_PROVIDERS")
+            continue
+        chain.append(provider)
+    if not chain:
+        print("⚠️ No AI provider in AI_PROVIDERS is configured — using offline replies")
+        chain.append(OfflineProvider())
+    return chain
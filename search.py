@@ -0,0 +1,157 @@
+"""
+Полнотекстовый поиск по истории пользователя (SQLite FTS5).
+
+Одна виртуальная таблица search_index на симптомы, советы и анализы фото.
+rowid = id * 4 + код типа — по нему триггеры мгновенно находят строку
+при изменении / удалении записи. Колонка owner ("u<id пользователя>") тоже
+индексируется: фильтр по пользователю — часть MATCH, а не перебор всех совпадений.
+
+    flask --app app search rebuild    # переиндексировать всё (например, после импорта)
+    flask --app app search optimize   # слить сегменты индекса
+"""
+import re
+
+import click
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from models import db, Symptom, Photo, Tip
+
+# тип записи -> (код в rowid, модель, SQL-выражение с текстом для индекса, колонки этого текста)
+SOURCES = {
+    "symptom": (1, Symptom, "{row}.text || ' ' || coalesce({row}.category, '')", "text, category"),
+    "photo": (2, Photo, "coalesce({row}.result, '')", "result"),
+    "tip": (3, Tip, "{row}.text", "text"),
+}
+KIND_BY_CODE = {code: kind for kind, (code, *_) in SOURCES.items()}
+
+# маркеры подсветки в snippet(): управляющие символы не встречаются в тексте пользователя
+_MARK_START, _MARK_END = "\x02", "\x03"
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TERMS = 8
+
+
+def available(conn_or_engine) -> bool:
+    return conn_or_engine.dialect.name == "sqlite"
+
+
+# ------------------ Схема ------------------
+def _triggers(kind):
+    code, model, body, columns = SOURCES[kind]
+    table = model.__tablename__
+    insert = (
+        f"INSERT INTO search_index (rowid, owner, body) "
+        f"SELECT new.id * 4 + {code}, 'u' || new.user_id, {body.format(row='new')} "
+        f"WHERE new.user_id IS NOT NULL;"
+    )
+    delete = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {code};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_update AFTER UPDATE OF {columns}, user_id ON {table} "
+        f"BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+    ]
+
+
+def create(conn):
+    """Таблица FTS5 и триггеры, которые держат её в синхроне с symptom / photo / tip."""
+    # porter: "rashes" находится по "rash"; remove_diacritics — "cafe" по "café"
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        " owner, body, tokenize = 'porter unicode61 remove_diacritics 2')"
+    ))
+    for kind in SOURCES:
+        for ddl in _triggers(kind):
+            conn.execute(text(ddl))
+
+
+def rebuild(conn) -> int:
+    """Заново заполняет индекс из таблиц; возвращает число проиндексированных записей."""
+    conn.execute(text("DELETE FROM search_index"))
+    for code, model, body, _ in SOURCES.values():
+        table = model.__tablename__
+        conn.execute(text(
+            f"INSERT INTO search_index (rowid, owner, body) "
+            f"SELECT id * 4 + {code}, 'u' || user_id, {body.format(row=table)} "
+            f"FROM {table} WHERE user_id IS NOT NULL"
+        ))
+    return conn.execute(text("SELECT count(*) FROM search_index")).scalar()
+
+
+# ------------------ Поиск ------------------
+def match_expression(user_id, query):
+    """
+    Запрос пользователя -> выражение MATCH. Синтаксис FTS5 наружу не отдаём:
+    берём слова, все должны встретиться в тексте. Формы слова ("rashes" / "rash")
+    склеивает porter-токенизатор — префиксный поиск ("rash"*) не нужен и заметно медленнее.
+    """
+    terms = _WORD_RE.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return f'owner : "u{int(user_id)}" AND ' + " AND ".join(f'body : "{term}"' for term in terms)
+
+
+def search(user_id, query, limit=20, offset=0):
+    """
+    Записи пользователя, подходящие под запрос, от самых релевантных (bm25).
+    Возвращает ([(kind, запись, подсвеченный фрагмент)], есть ли ещё).
+    """
+    match = match_expression(user_id, query)
+    if match is None or not available(db.engine):
+        return [], False
+    rows = db.session.execute(text(
+        "SELECT rowid, snippet(search_index, 1, char(2), char(3), '…', 16) "
+        "FROM search_index WHERE search_index MATCH :match "
+        "ORDER BY bm25(search_index, 0.0, 1.0), rowid DESC LIMIT :limit OFFSET :offset"
+    ), {"match": match, "limit": limit + 1, "offset": offset}).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return _load(user_id, rows), has_more
+
+
+def _load(user_id, rows):
+    # записи подгружаем одним запросом на тип, порядок — как в выдаче FTS
+    ids = {kind: [] for kind in SOURCES}
+    for rowid, _ in rows:
+        ids[KIND_BY_CODE[rowid % 4]].append(rowid // 4)
+    loaded = {}
+    for kind, item_ids in ids.items():
+        if not item_ids:
+            continue
+        model = SOURCES[kind][1]
+        for item in model.query.filter(model.id.in_(item_ids), model.user_id == user_id):
+            loaded[(kind, item.id)] = item
+    results = []
+    for rowid, snippet in rows:
+        key = (KIND_BY_CODE[rowid % 4], rowid // 4)
+        if key in loaded:
+            results.append((key[0], loaded[key], highlight(snippet)))
+    return results
+
+
+def highlight(snippet) -> Markup:
+    """Фрагмент из snippet(): экранируем текст и превращаем маркеры в <mark>."""
+    safe = str(escape(snippet or ""))
+    return Markup(safe.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+# ------------------ CLI ------------------
+def init_app(app):
+    @app.cli.group("search")
+    def search_cli():
+        """Полнотекстовый индекс истории."""
+
+    @search_cli.command("rebuild")
+    def rebuild_command():
+        """Переиндексировать симптомы, советы и анализы фото."""
+        with db.engine.begin() as conn:
+            create(conn)
+            count = rebuild(conn)
+        click.echo(f"Indexed {count} records.")
+
+    @search_cli.command("optimize")
+    def optimize_command():
+        """Слить сегменты FTS5 в один (быстрее поиск после массовых вставок)."""
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+        click.echo("Search index optimized.")
@@ -0,0 +1,137 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Одинаковые по смыслу промпты: без лишних пробелов и регистра."""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых запросов: пока вызов по ключу ещё идёт, остальные
+    вызывающие с тем же ключом ждут его и получают тот же результат.
+    Опционально за ним стоит короткий кэш готовых ответов (ttl секунд, 0 — выключен).
+    """
+
+    def __init__(self, ttl=0, maxsize=256, cacheable=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.cacheable = cacheable or (lambda result: True)
+        self._calls = {}
+        self._acalls = {}   # key -> asyncio.Task общего вызова (async-режим, asgi.py)
+        self._cache = OrderedDict()  # key -> (result, expires_at)
+        self._lock = threading.Lock()
+        self.calls = 0        # реальные вызовы
+        self.coalesced = 0    # дождались чужого вызова
+        self.cache_hits = 0
+
+    _MISS = object()
+
+    def _cached(self, key):
+        # вызывается под self._lock
+        cached = self._cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            self.cache_hits += 1
+            metrics.AI_COALESCED.labels("cache_hit").inc()
+            return cached[0]
+        if cached:
+            del self._cache[key]
+        return self._MISS
+
+    def _store(self, key, result):
+        # вызывается под self._lock
+        if self.ttl > 0 and self.cacheable(result):
+            self._cache[key] = (result, time.monotonic() + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def do(self, key, fn):
+        with self._lock:
+            cached = self._cached(key)
+            if cached is not self._MISS:
+                return cached
+
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            metrics.AI_COALESCED.labels("call" if leader else "coalesced").inc()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    self._store(key, call.result)
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, coro_fn):
+        """
+        То же для корутин: ждущие не занимают потоков, только задача в цикле событий.
+        Общий вызов — отдельная задача, все (и первый) ждут её через shield: отмена одного
+        ждущего (клиент ушёл, hedge проиграл) не отменяет ответ остальным.
+        """
+        with self._lock:
+            cached = self._cached(key)
+            if cached is not self._MISS:
+                return cached
+            task = self._acalls.get(key)
+            if task is None:
+                task = self._acalls[key] = asyncio.ensure_future(self._arun(key, coro_fn))
+                # ждущих может не остаться — без «exception was never retrieved»
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self.calls += 1
+                metrics.AI_COALESCED.labels("call").inc()
+            else:
+                self.coalesced += 1
+                metrics.AI_COALESCED.labels("coalesced").inc()
+        return await asyncio.shield(task)
+
+    async def _arun(self, key, coro_fn):
+        try:
+            result = await coro_fn()
+        finally:
+            with self._lock:
+                del self._acalls[key]
+        with self._lock:
+            self._store(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "cache_hits": self.cache_hits,
+                "in_flight": len(self._calls) + len(self._acalls),
+                "cache_size": len(self._cache),
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,28 @@
+// Опрос фоновых ИИ-задач: любой элемент с data-poll="/jobs/<kind>/<id>"
+// получит текст ответа, как только задача завершится.
+(function () {
+    function poll(el, delay) {
+        fetch(el.dataset.poll, {headers: {"Accept": "application/json"}})
+            .then(resp => resp.ok ? resp.json() : Promise.reject(resp.status))
+            .then(data => {
+                if (data.status === "pending" && data.job !== "error") {
+                    // мягко увеличиваем интервал, чтобы не долбить сервер
+                    setTimeout(() => poll(el, Math.min(delay * 1.5, 5000)), delay);
+                    return;
+                }
+                el.textContent = data.status === "done"
+                    ? data.text
+                    : "⚠️ Aika could not answer this time. Please try again.";
+                // фото: превью появляется, когда готова конвертация
+                const img = el.dataset.img && document.getElementById(el.dataset.img);
+                if (img && data.image) img.src = data.image;
+                el.classList.remove("pending");
+                delete el.dataset.poll;
+            })
+            .catch(() => setTimeout(() => poll(el, 5000), 5000));
+    }
+
+    document.addEventListener("DOMContentLoaded", () => {
+        document.querySelectorAll("[data-poll]").forEach(el => poll(el, 1000));
+    });
+})();
@@ -0,0 +1,179 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Слова, которые не меняют смысл жалобы
+STOPWORDS = {
+    "a", "an", "the", "i", "im", "i'm", "ive", "i've", "me", "my", "mine", "have", "has", "had", "having",
+    "got", "get", "getting", "am", "is", "are", "was", "were", "be", "been", "it", "its",
+    "and", "or", "but", "so", "of", "to", "in", "on", "at", "for", "with", "since",
+    "feel", "feeling", "felt", "really", "very", "quite", "some", "bit", "little",
+    "today", "tonight", "yesterday", "now", "again", "just", "also", "what", "do", "should",
+}
+
+# Отрицание переворачивает смысл: «no fever» и «fever» — разные жалобы
+NEGATIONS = {"no", "not", "never", "without", "none", "nothing", "cannot", "cant", "dont", "didnt", "isnt"}
+
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize(text: str) -> list:
+    """Нижний регистр, только слова, без стоп-слов и простых окончаний."""
+    words = re.findall(r"[a-zа-яё0-9']+", text.lower())
+    tokens = []
+    for word in words:
+        if word in STOPWORDS:
+            continue
+        if word not in NEGATIONS:  # «nothing» не должно стать «noth»
+            word = _stem(word)
+        tokens.append(word)
+    return tokens
+
+
+def _stem(word: str) -> str:
+    # сравниваем слова целиком, поэтому «headaches» и «headache» должны совпасть
+    for suffix in ("ing", "ed"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    if len(word) > 5 and word.endswith("es") and word[:-2].endswith(("s", "x", "z", "ch", "sh")):
+        word = word[:-2]   # rashes -> rash, stitches -> stitch, headaches -> headach
+    elif len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    if word.endswith("che"):
+        word = word[:-1]   # headache -> headach: как у множественного числа
+    return word
+
+
+def shingles(tokens) -> set:
+    """
+    Слова нормализованного текста. Не символьные n-граммы: у «headache» и «heartache»
+    они почти совпадают, а для медицинского ответа это разные жалобы.
+    """
+    return set(tokens)
+
+
+def negated(tokens) -> bool:
+    return any(token in NEGATIONS or token.endswith("n't") for token in tokens)
+
+
+class SymptomAnswerCache:
+    """
+    Кэш ответов на почти одинаковые жалобы (MinHash + LSH, чистый Python).
+    Сигнатура из num_perm хэшей режется на bands полос; кандидаты — записи,
+    совпавшие хотя бы в одной полосе; ответ берём, если точный Жаккар по словам >= threshold
+    и у обеих жалоб одинаково есть или нет отрицания. Размер ограничен maxsize записями (LRU).
+    """
+
+    def __init__(self, threshold=0.8, maxsize=5000, num_perm=64, bands=16, seed=42):
+        assert num_perm % bands == 0, "num_perm must be divisible by bands"
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rnd = random.Random(seed)
+        self._perms = [
+            (rnd.randrange(1, _MERSENNE), rnd.randrange(0, _MERSENNE)) for _ in range(num_perm)
+        ]
+        self._entries = OrderedDict()                  # normalized -> (signature, words, answer)
+        self._buckets = [dict() for _ in range(bands)]  # band -> {band_key: set(normalized)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- MinHash ----------
+    def signature(self, shingle_set) -> tuple:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+            for s in shingle_set
+        ]
+        return tuple(
+            min((a * h + b) % _MERSENNE for h in hashes)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _prepare(self, text):
+        tokens = normalize(text)
+        if not tokens:
+            return None, None, None
+        words = shingles(tokens)
+        return " ".join(tokens), words, self.signature(words)
+
+    # ---------- API ----------
+    def lookup(self, text):
+        """Ответ на похожую жалобу или None."""
+        key, words, signature = self._prepare(text)
+        if key is None or self.maxsize <= 0:
+            return None
+        negation = negated(words)
+        with self._lock:
+            candidates = set()
+            for band, band_key in self._band_keys(signature):
+                candidates |= self._buckets[band].get(band_key, set())
+
+            best, best_score = None, 0.0
+            for candidate in candidates:
+                other = self._entries[candidate][1]
+                # LSH лишь отбирает кандидатов; решает точный Жаккар (слов в жалобе мало — оценка шумная)
+                if negated(other) != negation:
+                    continue
+                score = len(words & other) / len(words | other)
+                if score > best_score:
+                    best, best_score = candidate, score
+
+            if best is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best)
+                self.hits += 1
+                metrics.SYMPTOM_CACHE_LOOKUPS.labels("hit").inc()
+                return self._entries[best][2]
+            self.misses += 1
+            metrics.SYMPTOM_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+
+    def add(self, text, answer):
+        key, words, signature = self._prepare(text)
+        if key is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, words, answer)
+            for band, band_key in self._band_keys(signature):
+                self._buckets[band].setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def warm(self, pairs):
+        """Первичное наполнение из уже сохранённых (text, answer)."""
+        for text, answer in pairs:
+            self.add(text, answer)
+
+    def _remove(self, key):
+        signature, _, _ = self._entries.pop(key)
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "buckets": sum(len(b) for b in self._buckets),
+            }
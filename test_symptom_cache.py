@@ -0,0 +1,57 @@
+"""
+Кэш похожих жалоб (symptom_cache.py): ответ на одну жалобу не должен уходить
+на жалобу с другим смыслом.
+
+    python -m pytest -q test_symptom_cache.py
+"""
+from symptom_cache import SymptomAnswerCache
+
+FEVER = "Rest and drink fluids; see a doctor if the fever lasts more than 3 days."
+HEADACHE = "Rest in a quiet dark room and drink water."
+
+
+def make_cache():
+    cache = SymptomAnswerCache(threshold=0.8)
+    cache.add("I have a fever", FEVER)
+    cache.add("I have a headache", HEADACHE)
+    return cache
+
+
+def test_same_complaint_with_filler_words_hits():
+    cache = make_cache()
+    assert cache.lookup("have a headache today") == HEADACHE
+    assert cache.lookup("I've got a fever") == FEVER
+
+
+def test_negation_mismatch_is_a_miss():
+    cache = make_cache()
+    assert cache.lookup("I have no fever") is None
+    assert cache.lookup("I don't have a fever") is None
+    assert cache.lookup("without fever") is None
+    assert cache.lookup("not a fever") is None
+
+
+def test_negated_entry_is_not_served_for_plain_complaint():
+    cache = SymptomAnswerCache(threshold=0.8)
+    cache.add("I have no fever", "Good, no fever.")
+    assert cache.lookup("I have a fever") is None
+    assert cache.lookup("no fever") == "Good, no fever."
+
+
+def test_similarly_spelled_word_is_a_miss():
+    cache = make_cache()
+    assert cache.lookup("I have a heartache") is None
+    assert cache.lookup("I have a backache") is None
+
+
+def test_extra_symptom_words_are_a_miss():
+    cache = make_cache()
+    assert cache.lookup("I have a fever and a rash") is None
+    assert cache.lookup("severe headache with vomiting") is None
+
+
+def test_plural_matches_singular():
+    cache = make_cache()
+    cache.add("I have a rash", "Keep the skin clean and dry.")
+    assert cache.lookup("headaches") == HEADACHE
+    assert cache.lookup("rashes") == "Keep the skin clean and dry."
@@ -0,0 +1,212 @@
+"""
+Пул заранее сгенерированных советов для /tips.
+
+Фоновая задача (tip_refill в JobQueue) в свободное от пользователей время доводит
+запас каждой категории до target; запрос забирает готовый совет одним UPDATE
+и сразу записывает его пользователю — без ожидания модели. Пул лежит в таблице
+pooled_tip и общий для всех воркеров. Пуст — совет генерируется как раньше.
+"""
+import hashlib
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from models import db, PooledTip
+
+# категория -> темы: промпт каждый раз про другое, иначе модель повторяет один и тот же совет
+CATEGORIES = {
+    "nutrition": (
+        "hydration", "fiber", "protein", "added sugar", "vegetables and fruit",
+        "healthy snacks", "salt", "breakfast", "portion size", "mindful eating",
+    ),
+    "sleep": (
+        "a regular bedtime", "screens before bed", "caffeine timing", "bedroom temperature",
+        "daytime naps", "morning light", "a wind-down routine", "late meals",
+    ),
+    "activity": (
+        "walking", "stretching", "strength training", "breaks from sitting", "posture",
+        "warming up", "taking the stairs", "active commuting", "balance exercises",
+    ),
+}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fingerprint(text: str) -> str:
+    """Советы, отличающиеся только регистром и пунктуацией, — один и тот же совет."""
+    words = _WORD_RE.findall(text.lower())
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def tip_prompt(category=None, topic=None) -> str:
+    if category is None:
+        return "Give one short English tip about nutrition, sleep, or physical activity. This is not a diagnosis."
+    subject = "physical activity" if category == "activity" else category
+    topic = topic or random.choice(CATEGORIES[category])
+    return (
+        f"Give one short English tip about {subject}, focusing on {topic}. "
+        "One or two sentences. This is not a diagnosis."
+    )
+
+
+class TipPool:
+    """
+    target — сколько готовых советов держать в каждой категории;
+    max_age — старше не выдаём (устаревшие удаляются при пополнении);
+    dedup_window — сколько помним выданные советы, чтобы не сгенерировать их снова;
+    batch — сколько генераций делает одна задача пополнения.
+    """
+
+    def __init__(self, target=20, max_age=7 * 86400, dedup_window=30 * 86400, batch=5, cacheable=None):
+        self.target = target
+        self.max_age = max_age
+        self.dedup_window = dedup_window
+        self.batch = batch
+        self.cacheable = cacheable or (lambda text: bool(text))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = {"added": 0, "duplicate": 0, "rejected": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.target > 0
+
+    # ---------- Выдача ----------
+    def pop(self, category=None):
+        """
+        Забирает самый старый свежий совет (категории category или любой).
+        Не коммитит: совет и запись Tip пользователя сохраняются одной транзакцией.
+        Возвращает (category, text, created_at) или None.
+        """
+        now = datetime.utcnow()
+        candidate = (
+            select(PooledTip.id)
+            .where(PooledTip.served_at.is_(None), PooledTip.created_at >= now - timedelta(seconds=self.max_age))
+            .order_by(PooledTip.created_at)
+            .limit(1)
+            # PostgreSQL: параллельные запросы берут разные строки; SQLite и так пишет по одному
+            .with_for_update(skip_locked=True)
+        )
+        if category is not None:
+            candidate = candidate.where(PooledTip.category == category)
+        row = db.session.execute(
+            update(PooledTip)
+            .where(PooledTip.id == candidate.scalar_subquery(), PooledTip.served_at.is_(None))
+            .values(served_at=now)
+            .returning(PooledTip.category, PooledTip.text, PooledTip.created_at),
+            execution_options={"synchronize_session": False},
+        ).first()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            metrics.TIP_POOL_SERVED.labels("live").inc()
+            return None
+        metrics.TIP_POOL_SERVED.labels("pool").inc()
+        metrics.TIP_POOL_SERVED_AGE.observe((now - row.created_at).total_seconds())
+        return row.category, row.text, row.created_at
+
+    # ---------- Пополнение ----------
+    def add(self, category, text) -> str:
+        """Кладёт совет в пул: "added", "duplicate" или "rejected" (заглушка / ошибка модели)."""
+        text = (text or "").strip()
+        if not self.cacheable(text):
+            return "rejected"
+        mark = fingerprint(text)
+        if db.session.query(PooledTip.id).filter_by(fingerprint=mark).first():
+            return "duplicate"
+        db.session.add(PooledTip(category=category, text=text, fingerprint=mark))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # тот же совет одновременно добавил другой воркер
+            return "duplicate"
+        return "added"
+
+    def counts(self) -> dict:
+        """Готовые (свежие, не выданные) советы по категориям."""
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.max_age)
+        rows = (
+            db.session.query(PooledTip.category, func.count(PooledTip.id), func.min(PooledTip.created_at))
+            .filter(PooledTip.served_at.is_(None), PooledTip.created_at >= fresh_after)
+            .group_by(PooledTip.category)
+            .all()
+        )
+        found = {category: (count, oldest) for category, count, oldest in rows}
+        return {category: found.get(category, (0, None)) for category in CATEGORIES}
+
+    def deficit(self) -> dict:
+        """Сколько не хватает до target в каждой категории (только ненулевые)."""
+        missing = {category: self.target - count for category, (count, _) in self.counts().items()}
+        return {category: n for category, n in missing.items() if n > 0}
+
+    def prune(self) -> int:
+        """Удаляет устаревшие невыданные советы и выданные старше окна дедупликации."""
+        now = datetime.utcnow()
+        removed = PooledTip.query.filter(
+            (PooledTip.served_at.is_(None) & (PooledTip.created_at < now - timedelta(seconds=self.max_age)))
+            | (PooledTip.served_at < now - timedelta(seconds=self.dedup_window))
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def refill(self, generate, idle=lambda: True) -> dict:
+        """
+        До batch генераций в самые пустые категории; останавливается, как только
+        idle() сообщает, что провайдер нужен пользователям. generate(prompt) -> текст.
+        """
+        self.prune()
+        outcomes = {"added": 0, "duplicate": 0, "rejected": 0}
+        for _ in range(self.batch):
+            missing = self.deficit()
+            if not missing or not idle():
+                break
+            category = max(missing, key=missing.get)
+            outcome = self.add(category, generate(tip_prompt(category)))
+            outcomes[outcome] += 1
+            metrics.TIP_POOL_GENERATED.labels(category, outcome).inc()
+            if outcome == "rejected":
+                break  # провайдер отвечает заглушками — не тратим на него остаток порции
+        with self._lock:
+            for outcome, n in outcomes.items():
+                self.generated[outcome] += n
+        self.observe()
+        return outcomes
+
+    # ---------- Метрики ----------
+    def observe(self) -> dict:
+        """Обновляет gauge размера и возраста пула; возвращает counts()."""
+        counts = self.counts()
+        now = datetime.utcnow()
+        for category, (count, oldest) in counts.items():
+            metrics.TIP_POOL_SIZE.labels(category).set(count)
+            metrics.TIP_POOL_OLDEST.labels(category).set((now - oldest).total_seconds() if oldest else 0)
+        return counts
+
+    def stats(self) -> dict:
+        now = datetime.utcnow()
+        counts = self.observe()
+        with self._lock:
+            served = self.hits + self.misses
+            return {
+                "target": self.target,
+                "categories": {
+                    category: {
+                        "ready": count,
+                        "oldest_seconds": round((now - oldest).total_seconds()) if oldest else None,
+                    }
+                    for category, (count, oldest) in counts.items()
+                },
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / served, 3) if served else 0.0,
+                "generated": dict(self.generated),
+            }